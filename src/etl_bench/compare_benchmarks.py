@@ -0,0 +1,219 @@
+'''
+Regression gate for the ETL benchmarks.
+
+Compares a candidate result file of run_benchmarks.py against one
+or more stored baseline result files of the same workload. When
+several baseline files are given, their trials are pooled, so that
+repeated baseline runs narrow the estimate and widen the measured
+noise.
+
+Every benchmark of the baseline must be present in the candidate,
+run with the same options (number of workers, pipelining, and so
+on); benchmarks that only the candidate has are not compared. For each
+benchmark present in both, the relative changes of the
+median records per second and of the median peak RSS are computed.
+A throughput drop counts as a regression only if it exceeds both the
+allowed percentage and the noise, which is the larger of the
+baseline's and the candidate's relative spread (max - min) / median
+across trials. A peak RSS increase beyond its allowed percentage
+is a regression; peak RSS varies little between trials, so no
+noise margin is applied.
+
+Exit status is 0 without regressions, 1 with at least one
+regression, and 2 if the files cannot be compared, for instance
+because they are for different workloads, the candidate lacks
+a baseline benchmark, or a benchmark ran with different options.
+
+Usage, from the src directory:
+
+    python -m etl_bench.compare_benchmarks --baseline baselines/medium.json --maxRegression 10 candidate.json
+'''
+
+import argparse
+import json
+import os
+import sys
+
+from run_benchmarks import RESULT_FORMAT_VERSION, summarize
+
+
+DEFAULT_MAX_REGRESSION_PERCENT = 10.0
+DEFAULT_MAX_MEMORY_REGRESSION_PERCENT = 10.0
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+EXIT_INCOMPARABLE = 2
+
+
+class IncomparableResults(Exception):
+    '''
+    Raised when result files do not describe the same workload
+    and benchmark options, or are not benchmark result files.
+    '''
+    pass
+
+
+def loadResults(path):
+    '''
+    Read one run_benchmarks.py result file.
+
+    :param path: path to the JSON file
+    :type path: String
+    :return: the result document
+    :rtype: dict
+    '''
+    with open(path) as resultFile:
+        results = json.load(resultFile)
+    if results.get('formatVersion') != RESULT_FORMAT_VERSION:
+        raise IncomparableResults("%s: result format version %s; expected %s." % (path, results.get('formatVersion'), RESULT_FORMAT_VERSION))
+    return results
+
+def poolResults(resultsList):
+    '''
+    Combine result documents of the same workload into one, with
+    each benchmark's trials pooled and summarized afresh. A
+    benchmark's trials are only pooled if it ran with the same
+    options in every document.
+
+    :param resultsList: result documents, as returned by loadResults()
+    :type resultsList: [dict]
+    :return: a result document
+    :rtype: dict
+    '''
+    workload = resultsList[0]['workload']
+    for results in resultsList[1:]:
+        if results['workload'] != workload:
+            raise IncomparableResults("Baselines are for different workloads: %s and %s." % (workload, results['workload']))
+    pooledTrials = {}
+    pooledOptions = {}
+    for results in resultsList:
+        for benchmarkName, benchmarkResult in results['benchmarks'].items():
+            options = benchmarkResult.get('options')
+            if benchmarkName in pooledOptions and pooledOptions[benchmarkName] != options:
+                raise IncomparableResults("Baselines ran %s with different options: %s and %s." % (benchmarkName, pooledOptions[benchmarkName], options))
+            pooledOptions[benchmarkName] = options
+            pooledTrials.setdefault(benchmarkName, []).extend(benchmarkResult['trials'])
+    return {'formatVersion' : RESULT_FORMAT_VERSION,
+            'workload' : workload,
+            'benchmarks' : dict([(benchmarkName, {'options' : pooledOptions[benchmarkName],
+                                                  'trials' : trials,
+                                                  'summary' : summarize(trials)})
+                                 for benchmarkName, trials in pooledTrials.items()])}
+
+def relativeChange(baselineValue, candidateValue):
+    if not baselineValue or candidateValue is None:
+        return None
+    return (candidateValue - baselineValue) / float(baselineValue)
+
+def compareSummaries(baselineSummary, candidateSummary, maxRegression, maxMemoryRegression):
+    '''
+    Compare the summaries of one benchmark.
+
+    :param baselineSummary: summary of the baseline trials
+    :type baselineSummary: dict
+    :param candidateSummary: summary of the candidate trials
+    :type candidateSummary: dict
+    :param maxRegression: allowed relative throughput drop, e.g. 0.1
+    :type maxRegression: float
+    :param maxMemoryRegression: allowed relative peak RSS increase
+    :type maxMemoryRegression: float
+    :return: relative changes, the noise, and the regressions found
+    :rtype: dict
+    '''
+    throughputChange = relativeChange(baselineSummary['recordsPerSec'], candidateSummary['recordsPerSec'])
+    memoryChange = relativeChange(baselineSummary['peakRssMB'], candidateSummary['peakRssMB'])
+    noise = max(baselineSummary.get('recordsPerSecSpread') or 0.0,
+                candidateSummary.get('recordsPerSecSpread') or 0.0)
+    throughputThreshold = max(maxRegression, noise)
+    regressions = []
+    if throughputChange is not None and -throughputChange > throughputThreshold:
+        regressions.append('recordsPerSec')
+    if memoryChange is not None and memoryChange > maxMemoryRegression:
+        regressions.append('peakRssMB')
+    return {'recordsPerSecChange' : throughputChange,
+            'peakRssMBChange' : memoryChange,
+            'noise' : noise,
+            'recordsPerSecThreshold' : throughputThreshold,
+            'regressions' : regressions}
+
+def compareResults(baselineResults, candidateResults, maxRegression, maxMemoryRegression):
+    '''
+    Compare every benchmark of the baseline with the candidate's,
+    which must have run with the same options. Benchmarks that
+    only the candidate has are left out.
+
+    :return: benchmark name --> comparison, as from compareSummaries()
+    :rtype: dict
+    '''
+    if baselineResults['workload'] != candidateResults['workload']:
+        raise IncomparableResults("Baseline is for workload %s, candidate for %s." % (baselineResults['workload'], candidateResults['workload']))
+    missingBenchmarks = sorted(set(baselineResults['benchmarks'].keys()) - set(candidateResults['benchmarks'].keys()))
+    if len(missingBenchmarks) > 0:
+        raise IncomparableResults("Candidate lacks baseline benchmarks: %s." % ', '.join(missingBenchmarks))
+    comparisons = {}
+    for benchmarkName, candidateBenchmark in candidateResults['benchmarks'].items():
+        baselineBenchmark = baselineResults['benchmarks'].get(benchmarkName)
+        if baselineBenchmark is None:
+            continue
+        if baselineBenchmark.get('options') != candidateBenchmark.get('options'):
+            raise IncomparableResults("Baseline ran %s with options %s, candidate with %s." % \
+                                      (benchmarkName, baselineBenchmark.get('options'), candidateBenchmark.get('options')))
+        comparisons[benchmarkName] = compareSummaries(baselineBenchmark['summary'],
+                                                      candidateBenchmark['summary'],
+                                                      maxRegression,
+                                                      maxMemoryRegression)
+    if len(comparisons) == 0:
+        raise IncomparableResults("Baseline and candidate have no benchmark in common.")
+    return comparisons
+
+def formatPercent(fraction):
+    if fraction is None:
+        return 'n/a'
+    return '%+.1f%%' % (100 * fraction)
+
+def report(comparisons, baselineResults, candidateResults, outStream=sys.stdout):
+    for benchmarkName in sorted(comparisons.keys()):
+        comparison = comparisons[benchmarkName]
+        baselineSummary = baselineResults['benchmarks'][benchmarkName]['summary']
+        candidateSummary = candidateResults['benchmarks'][benchmarkName]['summary']
+        outStream.write('%s (%s)\n' % (benchmarkName, 'REGRESSED: ' + ', '.join(comparison['regressions']) if comparison['regressions'] else 'ok'))
+        outStream.write('    records/s:   %s --> %s (%s; threshold -%.1f%%, noise %.1f%%)\n' % \
+                        (baselineSummary['recordsPerSec'], candidateSummary['recordsPerSec'],
+                         formatPercent(comparison['recordsPerSecChange']),
+                         100 * comparison['recordsPerSecThreshold'], 100 * comparison['noise']))
+        outStream.write('    peak RSS MB: %s --> %s (%s)\n' % \
+                        (baselineSummary['peakRssMB'], candidateSummary['peakRssMB'],
+                         formatPercent(comparison['peakRssMBChange'])))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--baseline',
+                        help='stored result file of run_benchmarks.py; may be repeated,\n' +
+                             'in which case the baseline trials are pooled',
+                        action='append',
+                        required=True)
+    parser.add_argument('--maxRegression',
+                        help='allowed drop in records per second, in percent. Default: %s' % DEFAULT_MAX_REGRESSION_PERCENT,
+                        type=float,
+                        default=DEFAULT_MAX_REGRESSION_PERCENT)
+    parser.add_argument('--maxMemoryRegression',
+                        help='allowed increase in peak RSS, in percent. Default: %s' % DEFAULT_MAX_MEMORY_REGRESSION_PERCENT,
+                        type=float,
+                        default=DEFAULT_MAX_MEMORY_REGRESSION_PERCENT)
+    parser.add_argument('candidate', help='result file of the run to check')
+    args = parser.parse_args()
+
+    try:
+        baselineResults = poolResults([loadResults(baselinePath) for baselinePath in args.baseline])
+        candidateResults = loadResults(args.candidate)
+        comparisons = compareResults(baselineResults,
+                                     candidateResults,
+                                     args.maxRegression / 100.0,
+                                     args.maxMemoryRegression / 100.0)
+    except (IncomparableResults, IOError, ValueError, KeyError) as e:
+        sys.stderr.write('Cannot compare benchmark results: %s\n' % `e`)
+        sys.exit(EXIT_INCOMPARABLE)
+    report(comparisons, baselineResults, candidateResults)
+    if any([len(comparison['regressions']) > 0 for comparison in comparisons.values()]):
+        sys.exit(EXIT_REGRESSION)
+    sys.exit(EXIT_OK)
@@ -0,0 +1,312 @@
+'''
+Synthetic forum dumps for benchmarking the ETL.
+
+A WorkloadSpec describes a dump by its number of posts, the
+distribution of body lengths, the density of personal information
+(email addresses, phone numbers, zip codes, and the poster's own
+names) in bodies, the depth of reply threads, and the size of the
+class roster. From a spec, this module writes:
+
+    - an edX forum .bson dump, as produced by mongodump of the
+      forum's contents collection,
+    - a Piazza dump: class_content.json, users.json, and
+      account_mapping.csv.
+
+Generation is deterministic for a given spec, including its seed,
+so that repeated benchmark runs see identical input.
+'''
+
+import bson
+import csv
+from datetime import datetime, timedelta
+import hashlib
+import json
+import math
+import os
+import random
+
+
+FIRST_NAMES = ['Otto', 'Andreas', 'Maria', 'Theo', 'Jane', 'Wei', 'Priya', 'Carlos', 'Fatima', 'John',
+               'Aiko', 'Ingrid', 'Kwame', 'Olga', 'Rahul', 'Sofia', 'Tomas', 'Yuki', 'Zainab', 'Liam']
+LAST_NAMES = ['Homberg', 'Fritz', 'Garcia', 'Nguyen', 'Smith', 'Chen', 'Patel', 'Okafor', 'Ivanova', 'Rossi',
+              'Kowalski', 'Tanaka', 'Haddad', 'Muller', 'Silva', 'Johansson', 'Kim', 'Dubois', 'Levi', 'Moreau']
+FILLER_WORDS = ['the', 'circuit', 'answer', 'homework', 'problem', 'voltage', 'I', 'think', 'is', 'not',
+                'quite', 'right', 'because', 'lecture', 'said', 'we', 'should', 'use', 'Ohm', 'law',
+                'node', 'analysis', 'thanks', 'for', 'help', 'week', 'three', 'solution', 'can', 'someone']
+
+COURSE_ID = 'BenchX/ETL101/2014_Spring'
+START_TIME = datetime(2014, 1, 6, 8, 0, 0)
+
+
+class WorkloadSpec(object):
+    '''
+    Parameters of one synthetic dump.
+    '''
+
+    FIELDS = ['name', 'numPosts', 'meanBodyLength', 'bodyLengthSigma', 'piiDensity', 'threadDepth', 'rosterSize', 'seed']
+
+    def __init__(self,
+                 name='custom',
+                 numPosts=10000,
+                 meanBodyLength=400,
+                 bodyLengthSigma=1.0,
+                 piiDensity=0.2,
+                 threadDepth=3,
+                 rosterSize=5000,
+                 seed=1):
+        '''
+        :param name: label of the workload in benchmark results
+        :type name: String
+        :param numPosts: number of top-level posts plus replies
+        :type numPosts: int
+        :param meanBodyLength: mean post body length in characters
+        :type meanBodyLength: int
+        :param bodyLengthSigma: sigma of the lognormal body length distribution;
+            0 makes all bodies meanBodyLength long
+        :type bodyLengthSigma: float
+        :param piiDensity: expected number of PII items per 100 words of body
+        :type piiDensity: float
+        :param threadDepth: maximum number of reply levels below a thread
+        :type threadDepth: int
+        :param rosterSize: number of users in the class
+        :type rosterSize: int
+        :param seed: random seed
+        :type seed: int
+        '''
+        self.name = name
+        self.numPosts = numPosts
+        self.meanBodyLength = meanBodyLength
+        self.bodyLengthSigma = bodyLengthSigma
+        self.piiDensity = piiDensity
+        self.threadDepth = threadDepth
+        self.rosterSize = rosterSize
+        self.seed = seed
+
+    def toDict(self):
+        return dict([(fieldName, getattr(self, fieldName)) for fieldName in WorkloadSpec.FIELDS])
+
+    @classmethod
+    def fromDict(cls, specDict):
+        return cls(**dict([(fieldName, specDict[fieldName]) for fieldName in WorkloadSpec.FIELDS if fieldName in specDict]))
+
+    def key(self):
+        '''
+        Short string that identifies the generated data of this spec.
+        '''
+        return hashlib.md5(json.dumps(self.toDict(), sort_keys=True)).hexdigest()[:12]
+
+# Named workloads for the benchmark runner:
+STANDARD_WORKLOADS = {
+    'small'  : WorkloadSpec('small', numPosts=2000, rosterSize=1000),
+    'medium' : WorkloadSpec('medium', numPosts=20000, rosterSize=10000),
+    'large'  : WorkloadSpec('large', numPosts=200000, rosterSize=100000),
+    'piiHeavy' : WorkloadSpec('piiHeavy', numPosts=20000, piiDensity=3.0, rosterSize=10000),
+    'longBodies' : WorkloadSpec('longBodies', numPosts=5000, meanBodyLength=8000, bodyLengthSigma=1.5, rosterSize=5000),
+    }
+
+
+class RosterUser(object):
+    '''
+    One synthetic class member, with the ids by which
+    the edX platform and Piazza know them.
+    '''
+
+    def __init__(self, userIntId, fullName, screenName, anonScreenName, piazzaId, lti, email):
+        self.userIntId = userIntId
+        self.fullName = fullName
+        self.screenName = screenName
+        self.anonScreenName = anonScreenName
+        self.piazzaId = piazzaId
+        self.lti = lti
+        self.email = email
+
+def makeRoster(spec):
+    '''
+    Return the spec's class roster as a list of RosterUser.
+    user_int_ids are 1..rosterSize.
+    '''
+    rand = random.Random(spec.seed)
+    roster = []
+    for userIntId in range(1, spec.rosterSize + 1):
+        firstName = rand.choice(FIRST_NAMES)
+        lastName = rand.choice(LAST_NAMES)
+        screenName = '%s%s%d' % (firstName[0].lower(), lastName.lower(), userIntId)
+        anonScreenName = hashlib.sha1('anon%d' % userIntId).hexdigest()
+        piazzaId = 'hz%09d' % userIntId
+        lti = hashlib.md5('lti%d' % userIntId).hexdigest()
+        email = '%s.%s%d@example.com' % (firstName.lower(), lastName.lower(), userIntId)
+        roster.append(RosterUser(userIntId, '%s %s' % (firstName, lastName), screenName, anonScreenName, piazzaId, lti, email))
+    return roster
+
+def bodyLength(rand, spec):
+    if spec.bodyLengthSigma <= 0:
+        return spec.meanBodyLength
+    # Lognormal with the requested mean:
+    mu = math.log(spec.meanBodyLength) - spec.bodyLengthSigma ** 2 / 2
+    return max(1, int(rand.lognormvariate(mu, spec.bodyLengthSigma)))
+
+def makeBody(rand, spec, poster, roster):
+    '''
+    Return a post body of random length, with PII
+    items sprinkled in at the spec's density.
+    '''
+    targetLength = bodyLength(rand, spec)
+    piiPerWord = spec.piiDensity / 100.0
+    words = []
+    length = 0
+    while length < targetLength:
+        if rand.random() < piiPerWord:
+            piiKind = rand.randint(0, 4)
+            if piiKind == 0:
+                word = rand.choice(roster).email
+            elif piiKind == 1:
+                word = '%03d-%03d-%04d' % (rand.randint(200, 999), rand.randint(200, 999), rand.randint(0, 9999))
+            elif piiKind == 2:
+                word = '%05d' % rand.randint(10000, 99999)
+            elif piiKind == 3:
+                word = rand.choice(poster.fullName.split())
+            else:
+                word = poster.screenName
+        else:
+            word = rand.choice(FILLER_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:targetLength]
+
+def threadStructure(rand, spec):
+    '''
+    Generator of (postIndex, parentIndex, threadIndex, depth) for
+    numPosts posts. Top-level posts have parentIndex None.
+    Replies go to a random recent post of the current thread,
+    no deeper than threadDepth.
+    '''
+    threadIndex = None
+    threadPosts = []
+    for postIndex in range(spec.numPosts):
+        if threadIndex is None or spec.threadDepth == 0 or rand.random() < 0.2:
+            threadIndex = postIndex
+            threadPosts = [(postIndex, 0)]
+            yield (postIndex, None, threadIndex, 0)
+            continue
+        candidates = [(index, depth) for (index, depth) in threadPosts[-5:] if depth < spec.threadDepth]
+        if len(candidates) == 0:
+            candidates = [threadPosts[0]]
+        (parentIndex, parentDepth) = rand.choice(candidates)
+        threadPosts.append((postIndex, parentDepth + 1))
+        yield (postIndex, parentIndex, threadIndex, parentDepth + 1)
+
+def writeForumBson(bsonPath, spec, roster):
+    '''
+    Write an edX forum contents dump for the spec.
+
+    :return: number of documents written
+    :rtype: int
+    '''
+    rand = random.Random(spec.seed + 1)
+    postIds = []
+    with open(bsonPath, 'wb') as bsonFile:
+        for (postIndex, parentIndex, threadIndex, depth) in threadStructure(rand, spec):
+            poster = rand.choice(roster)
+            postId = bson.ObjectId('%024x' % (0x519461545924670200000000 + postIndex))
+            postIds.append(postId)
+            createdAt = START_TIME + timedelta(seconds=postIndex * 37)
+            upVoters = [str(rand.randint(1, spec.rosterSize)) for _ in range(rand.randint(0, 3))]
+            downVoters = [str(rand.randint(1, spec.rosterSize)) for _ in range(rand.randint(0, 2))]
+            doc = {'_id' : postId,
+                   '_type' : 'CommentThread' if parentIndex is None else 'Comment',
+                   'anonymous' : False,
+                   'anonymous_to_peers' : False,
+                   'at_position_list' : [],
+                   'author_id' : str(poster.userIntId),
+                   'author_username' : poster.screenName,
+                   'body' : makeBody(rand, spec, poster, roster),
+                   'course_id' : COURSE_ID,
+                   'created_at' : createdAt,
+                   'updated_at' : createdAt,
+                   'votes' : {'count' : len(upVoters) + len(downVoters),
+                              'point' : len(upVoters) - len(downVoters),
+                              'up_count' : len(upVoters),
+                              'down_count' : len(downVoters),
+                              'up' : upVoters,
+                              'down' : downVoters},
+                   }
+            if parentIndex is not None:
+                doc['comment_thread_id'] = postIds[threadIndex]
+                if depth > 1:
+                    doc['parent_id'] = postIds[parentIndex]
+                    doc['parent_ids'] = [postIds[parentIndex]]
+                doc['sk'] = '%s-%s' % (postIds[parentIndex], postId)
+            bsonFile.write(bson.BSON.encode(doc))
+    return spec.numPosts
+
+def writePiazzaDump(dumpDir, spec, roster):
+    '''
+    Write class_content.json, users.json, and account_mapping.csv
+    for the spec into dumpDir.
+
+    :return: paths of the content, users, and mapping files
+    :rtype: (String, String, String)
+    '''
+    rand = random.Random(spec.seed + 2)
+    posts = []
+    postsByIndex = {}
+    for (postIndex, parentIndex, threadIndex, depth) in threadStructure(rand, spec):
+        poster = rand.choice(roster)
+        created = (START_TIME + timedelta(seconds=postIndex * 37)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        numEdits = rand.randint(1, 3)
+        history = [{'subject' : 'Question %d' % threadIndex if depth == 0 else '',
+                    'content' : '<p>%s</p>' % makeBody(rand, spec, poster, roster),
+                    'created' : created,
+                    'anon' : 'no',
+                    'uid' : poster.piazzaId}
+                   for _ in range(numEdits)]
+        changeLog = [{'type' : 'create' if depth == 0 else 'i_answer',
+                      'anon' : 'no',
+                      'uid' : poster.piazzaId,
+                      'data' : 'hp%012d' % postIndex,
+                      'when' : created}]
+        changeLog.extend([{'type' : 'update', 'anon' : 'no', 'uid' : poster.piazzaId, 'when' : created}
+                          for _ in range(numEdits - 1)])
+        post = {'id' : 'hp%012d' % postIndex,
+                'type' : 'question' if depth == 0 else 'followup',
+                'history' : history,
+                'change_log' : changeLog,
+                'children' : [],
+                'created' : created,
+                'folders' : ['hw%d' % rand.randint(1, 8)],
+                'tags' : ['student'],
+                'tag_good_arr' : [rand.choice(roster).piazzaId for _ in range(rand.randint(0, 2))],
+                'tag_endorse_arr' : [],
+                'status' : 'active',
+                'nr' : postIndex,
+                'unique_views' : rand.randint(0, 500),
+                'no_answer' : 0,
+                'no_answer_followup' : 0,
+                'config' : {}}
+        postsByIndex[postIndex] = post
+        if parentIndex is None:
+            posts.append(post)
+        else:
+            postsByIndex[parentIndex]['children'].append(post)
+
+    contentPath = os.path.join(dumpDir, 'class_content.json')
+    with open(contentPath, 'w') as contentFile:
+        json.dump(posts, contentFile, indent=1)
+
+    users = [{'user_id' : user.piazzaId,
+              'name' : user.fullName,
+              'email' : user.email,
+              'lti_ids' : ['stanford.edu__%s' % user.lti],
+              'posts' : 0, 'asks' : 0, 'answers' : 0, 'views' : 0, 'days' : 0}
+             for user in roster]
+    usersPath = os.path.join(dumpDir, 'users.json')
+    with open(usersPath, 'w') as usersFile:
+        json.dump(users, usersFile, indent=1)
+
+    mappingPath = os.path.join(dumpDir, 'account_mapping.csv')
+    with open(mappingPath, 'wb') as mappingFile:
+        mappingWriter = csv.writer(mappingFile)
+        mappingWriter.writerow(['UID', 'Email', 'LTI Ids'])
+        for user in roster:
+            mappingWriter.writerow([user.email, user.piazzaId, 'stanford.edu__%d, stanford.edu__%s' % (user.userIntId, user.lti)])
+    return (contentPath, usersPath, mappingPath)
@@ -0,0 +1,287 @@
+'''
+Throughput benchmarks of the forum and Piazza ETL on synthetic dumps.
+
+For a workload (see generators.WorkloadSpec), the runner generates
+an edX forum .bson dump and a Piazza dump, unless they already exist
+in the data directory, and then times:
+
+    - EdxForumScrubber.runConversion() on the .bson dump, with the
+      posts read directly from the file, and anonymization on,
+    - PiazzaImporter construction on the Piazza dump, followed by
+      materializing every post, reply, change_log entry, and
+      history entry as PiazzaPost instances.
+
+MySQL is replaced by standins.StandInMySQLDB. Each trial runs in
+a fresh process, so that its peak RSS is its own. The results are
+written as JSON: per trial, the records, seconds, records per
+second, peak RSS, and the time of each stage; and a summary with
+the medians and the spread across trials. compare_benchmarks.py
+compares such files.
+
+Run from the src directory, e.g.:
+
+    python -m etl_bench.run_benchmarks --workload medium --trials 3 --output medium.json
+'''
+
+import argparse
+from datetime import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from generators import STANDARD_WORKLOADS, WorkloadSpec, makeRoster, writeForumBson, writePiazzaDump
+from standins import StandInMySQLDB
+
+
+RESULT_FORMAT_VERSION = 1
+DEFAULT_TRIALS = 3
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'etl_bench_data')
+
+FORUM_BENCHMARK = 'EdxForumScrubber'
+PIAZZA_BENCHMARK = 'PiazzaImporter'
+BENCHMARKS = (FORUM_BENCHMARK, PIAZZA_BENCHMARK)
+
+
+def prepareDumps(spec, dataDir):
+    '''
+    Generate the spec's dumps into a subdirectory of dataDir, unless
+    an earlier run already did.
+
+    :return: directory that holds forum.bson and the Piazza files
+    :rtype: String
+    '''
+    dumpDir = os.path.join(dataDir, '%s-%s' % (spec.name, spec.key()))
+    doneMarker = os.path.join(dumpDir, 'complete')
+    if os.path.exists(doneMarker):
+        return dumpDir
+    if not os.path.isdir(dumpDir):
+        os.makedirs(dumpDir)
+    roster = makeRoster(spec)
+    writeForumBson(os.path.join(dumpDir, 'forum.bson'), spec, roster)
+    writePiazzaDump(dumpDir, spec, roster)
+    open(doneMarker, 'w').close()
+    return dumpDir
+
+def peakRssMB():
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on OS X, kilobytes elsewhere:
+        return maxRss / (1024.0 * 1024.0)
+    return maxRss / 1024.0
+
+def runForumTrial(specDict, dumpDir, forumOptions):
+    '''
+    One EdxForumScrubber trial; runs in a worker process.
+    '''
+    from forum_etl.extractor import EdxForumScrubber
+    spec = WorkloadSpec.fromDict(specDict)
+    standInDb = StandInMySQLDB(makeRoster(spec))
+    logDir = tempfile.mkdtemp(prefix='etl_bench_logs')
+    try:
+        EdxForumScrubber.LOG_DIR = logDir
+        startTime = time.time()
+        scrubber = EdxForumScrubber(os.path.join(dumpDir, 'forum.bson'),
+                                    mysqlDbObj=standInDb,
+                                    forumTableName='contents',
+                                    allUsersTableName='EdxPrivate.UserGrade',
+                                    anonymize=True,
+                                    directBsonRead=True,
+                                    **forumOptions)
+        scrubber.runConversion()
+        seconds = time.time() - startTime
+    finally:
+        shutil.rmtree(logDir, ignore_errors=True)
+    stages = dict([(stage['stage'], stage['seconds']) for stage in scrubber.metrics.report()['stages']])
+    return trialResult(scrubber.counter, seconds, stages)
+
+def runPiazzaTrial(specDict, dumpDir, piazzaOptions):
+    '''
+    One PiazzaImporter trial; runs in a worker process.
+    '''
+    from piazza_etl import piazza_to_relation
+    spec = WorkloadSpec.fromDict(specDict)
+    roster = makeRoster(spec)
+    # PiazzaImporter opens its own MySQL connections:
+    piazza_to_relation.MySQLDB = lambda **kwargs: StandInMySQLDB(roster, **kwargs)
+    startTime = time.time()
+    importer = piazza_to_relation.PiazzaImporter('bench', '', 'Edx_Piazza', 'contents',
+                                                 os.path.join(dumpDir, 'class_content.json'),
+                                                 os.path.join(dumpDir, 'users.json'),
+                                                 logFile=os.devnull,
+                                                 mappingFileName=os.path.join(dumpDir, 'account_mapping.csv'),
+                                                 **piazzaOptions)
+    constructSeconds = time.time() - startTime
+    numRecords = 0
+    for topPost in importer:
+        pendingPosts = [topPost]
+        while len(pendingPosts) > 0:
+            post = pendingPosts.pop()
+            numRecords += 1 + len(post['change_log']) + len(post['history'] or [])
+            pendingPosts.extend(post['children'])
+    seconds = time.time() - startTime
+    return trialResult(numRecords, seconds, {'construct' : constructSeconds,
+                                             'materialize' : seconds - constructSeconds})
+
+def trialResult(numRecords, seconds, stages):
+    return {'records' : numRecords,
+            'seconds' : round(seconds, 4),
+            'recordsPerSec' : round(numRecords / seconds, 1) if seconds > 0 else None,
+            'peakRssMB' : round(peakRssMB(), 1),
+            'stages' : dict([(stageName, round(stageSeconds, 4)) for stageName, stageSeconds in stages.items()])}
+
+def runTrialInChild(resultConnection, trialFunc, args):
+    try:
+        resultConnection.send((True, trialFunc(*args)))
+    except:
+        resultConnection.send((False, traceback.format_exc()))
+    finally:
+        resultConnection.close()
+
+def runInFreshProcess(trialFunc, *args):
+    '''
+    Run one trial in a child process, and return its result.
+    Unlike pool workers, the child may start worker processes
+    of its own, as EdxForumScrubber does with numWorkers > 1.
+    '''
+    (resultConnection, childConnection) = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=runTrialInChild, args=(childConnection, trialFunc, args))
+    process.start()
+    childConnection.close()
+    try:
+        (succeeded, result) = resultConnection.recv()
+    except EOFError:
+        raise RuntimeError('Benchmark trial process died with exit code %s.' % process.exitcode)
+    finally:
+        process.join()
+    if not succeeded:
+        raise RuntimeError('Benchmark trial failed:\n%s' % result)
+    return result
+
+def median(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def summarize(trials):
+    '''
+    Medians of the trials' measures, and the relative spread
+    (max - min) / median of the throughput, which
+    compare_benchmarks uses as the noise level.
+    '''
+    throughputs = [trial['recordsPerSec'] for trial in trials if trial['recordsPerSec'] is not None]
+    medianThroughput = median(throughputs)
+    stageNames = sorted(set([stageName for trial in trials for stageName in trial['stages']]))
+    return {'trials' : len(trials),
+            'records' : median([trial['records'] for trial in trials]),
+            'recordsPerSec' : medianThroughput,
+            'recordsPerSecSpread' : round((max(throughputs) - min(throughputs)) / medianThroughput, 4) if medianThroughput else None,
+            'peakRssMB' : median([trial['peakRssMB'] for trial in trials]),
+            'stages' : dict([(stageName, round(median([trial['stages'].get(stageName, 0.0) for trial in trials]), 4))
+                             for stageName in stageNames])}
+
+def gitCommit():
+    try:
+        with open(os.devnull, 'w') as devNull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           cwd=os.path.dirname(os.path.abspath(__file__)),
+                                           stderr=devNull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmarks(spec, benchmarkNames=BENCHMARKS, numTrials=DEFAULT_TRIALS, dataDir=DEFAULT_DATA_DIR, forumOptions=None, piazzaOptions=None):
+    '''
+    Run numTrials trials of each named benchmark on the spec's dumps.
+
+    :return: the result document
+    :rtype: dict
+    '''
+    dumpDir = prepareDumps(spec, dataDir)
+    trialFuncs = {FORUM_BENCHMARK : (runForumTrial, forumOptions or {}),
+                  PIAZZA_BENCHMARK : (runPiazzaTrial, piazzaOptions or {})}
+    benchmarkResults = {}
+    for benchmarkName in benchmarkNames:
+        (trialFunc, options) = trialFuncs[benchmarkName]
+        trials = [runInFreshProcess(trialFunc, spec.toDict(), dumpDir, options) for _ in range(numTrials)]
+        benchmarkResults[benchmarkName] = {'options' : options,
+                                           'trials' : trials,
+                                           'summary' : summarize(trials)}
+    return {'formatVersion' : RESULT_FORMAT_VERSION,
+            'createdAt' : datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'host' : platform.node(),
+            'python' : platform.python_version(),
+            'gitCommit' : gitCommit(),
+            'workload' : spec.toDict(),
+            'benchmarks' : benchmarkResults}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--workload',
+                        help='named workload (%s), or custom, which takes its\n' % ', '.join(sorted(STANDARD_WORKLOADS.keys())) +
+                             'parameters from the options below. Default: small',
+                        choices=sorted(STANDARD_WORKLOADS.keys()) + ['custom'],
+                        default='small')
+    parser.add_argument('--posts', help='custom workload: number of posts', type=int, default=WorkloadSpec().numPosts)
+    parser.add_argument('--bodyLength', help='custom workload: mean body length in characters', type=int, default=WorkloadSpec().meanBodyLength)
+    parser.add_argument('--bodySigma', help='custom workload: sigma of the lognormal body lengths', type=float, default=WorkloadSpec().bodyLengthSigma)
+    parser.add_argument('--piiDensity', help='custom workload: PII items per 100 words', type=float, default=WorkloadSpec().piiDensity)
+    parser.add_argument('--threadDepth', help='custom workload: maximum reply depth', type=int, default=WorkloadSpec().threadDepth)
+    parser.add_argument('--roster', help='custom workload: number of users in the class', type=int, default=WorkloadSpec().rosterSize)
+    parser.add_argument('--seed', help='custom workload: random seed', type=int, default=WorkloadSpec().seed)
+    parser.add_argument('--only',
+                        help='run only this benchmark. Default: all',
+                        choices=BENCHMARKS,
+                        default=None)
+    parser.add_argument('--trials', help='trials per benchmark. Default: %d' % DEFAULT_TRIALS, type=int, default=DEFAULT_TRIALS)
+    parser.add_argument('--workers', help='EdxForumScrubber worker processes. Default: 1', type=int, default=1)
+    parser.add_argument('--pipelined', help='run EdxForumScrubber with its pipelined reader and writer threads', action='store_true', default=False)
+    parser.add_argument('--streamPiazza', help='run PiazzaImporter with streamContent', action='store_true', default=False)
+    parser.add_argument('--identityCache',
+                        help='SQLite identity cache file for both ETLs; trials after the first\n' +
+                             'then measure warm reruns. Default: none',
+                        default=None)
+    parser.add_argument('--dataDir', help='where generated dumps are kept for reuse. Default: %s' % DEFAULT_DATA_DIR, default=DEFAULT_DATA_DIR)
+    parser.add_argument('--output', help='file for the JSON results. Default: print to stdout', default=None)
+    args = parser.parse_args()
+
+    if args.workload == 'custom':
+        workloadSpec = WorkloadSpec('custom',
+                                    numPosts=args.posts,
+                                    meanBodyLength=args.bodyLength,
+                                    bodyLengthSigma=args.bodySigma,
+                                    piiDensity=args.piiDensity,
+                                    threadDepth=args.threadDepth,
+                                    rosterSize=args.roster,
+                                    seed=args.seed)
+    else:
+        workloadSpec = STANDARD_WORKLOADS[args.workload]
+    benchmarkNames = BENCHMARKS if args.only is None else (args.only,)
+    results = runBenchmarks(workloadSpec,
+                            benchmarkNames,
+                            args.trials,
+                            args.dataDir,
+                            forumOptions={'numWorkers' : args.workers, 'pipelined' : args.pipelined,
+                                          'identityCacheFile' : args.identityCache},
+                            piazzaOptions={'streamContent' : args.streamPiazza,
+                                           'identityCacheFile' : args.identityCache})
+    resultJson = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(resultJson)
+    else:
+        with open(args.output, 'w') as outFile:
+            outFile.write(resultJson + '\n')
+        for benchmarkName in benchmarkNames:
+            summary = results['benchmarks'][benchmarkName]['summary']
+            print('%s: %s records/s (spread %s), peak RSS %s MB' % \
+                  (benchmarkName, summary['recordsPerSec'], summary['recordsPerSecSpread'], summary['peakRssMB']))
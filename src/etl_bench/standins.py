@@ -0,0 +1,169 @@
+'''
+In-memory stand-in for the MySQL server, for benchmarking the
+ETL without a database.
+
+StandInMySQLDB offers the part of pymysql_utils' MySQLDB interface
+that EdxForumScrubber and PiazzaImporter use. Statements that write
+are counted and dropped. Queries are answered from a synthetic
+class roster: the user table (EdxPrivate.UserGrade), and the
+functions that map user_int_ids to forum uids and LTI ids to
+user_int_ids. Anything else yields no rows.
+
+Parameterized statements, sent through a cursor of the connection,
+are answered likewise; fetchall() returns their rows.
+
+Benchmarks thereby measure the ETL's own work, including the
+building of SQL statements, but not MySQL's.
+'''
+
+import hashlib
+import re
+
+
+USER_QUERY_PATTERN = re.compile(r'^select user_int_id,name,screen_name,anon_screen_name,(.+?) from \S+(?: where user_int_id in \((.*)\))?$', re.DOTALL)
+USER_MARKER_PATTERN = re.compile(r'^select count\(\*\), max\(user_int_id\) from ', re.IGNORECASE)
+FORUM_UID_PATTERN = re.compile(r'idInt2Forum\((\d+)\)')
+LTI_QUERY_PATTERN = re.compile(r"idExt2Anon\('([^']*)'\)")
+
+
+def forumUid(userIntId):
+    '''
+    Stand-in for MySQL function idInt2Forum().
+    '''
+    return hashlib.sha1('forum%d' % userIntId).hexdigest()
+
+
+class StandInCursor(object):
+
+    def __init__(self, standInDb):
+        self.standInDb = standInDb
+        self.rows = []
+
+    def execute(self, statement, params=None):
+        if params is None:
+            self.standInDb.execute(statement)
+            self.rows = []
+        else:
+            self.rows = self.standInDb.executeParameterized(statement, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class StandInConnection(object):
+
+    def __init__(self, standInDb):
+        self.standInDb = standInDb
+
+    def cursor(self):
+        return StandInCursor(self.standInDb)
+
+    def commit(self):
+        self.standInDb.numCommits += 1
+
+    def rollback(self):
+        pass
+
+
+class StandInMySQLDB(object):
+    '''
+    MySQLDB look-alike, backed by a list of generators.RosterUser.
+    '''
+
+    def __init__(self, roster=(), user='bench', passwd='', db='EdxForum', **kwargs):
+        '''
+        :param roster: class members the user table and id functions know
+        :type roster: [generators.RosterUser]
+        '''
+        self.usersById = dict([(rosterUser.userIntId, rosterUser) for rosterUser in roster])
+        self.userIntIdsByLti = dict([(rosterUser.lti, rosterUser.userIntId) for rosterUser in roster])
+        self.user = user
+        self.pwd = passwd
+        self.db = db
+        self.connection = StandInConnection(self)
+        self.numStatements = 0
+        self.numStatementBytes = 0
+        self.numCommits = 0
+
+    def dbName(self):
+        return self.db
+
+    def execute(self, statement):
+        self.numStatements += 1
+        self.numStatementBytes += len(statement)
+
+    def executeParameterized(self, statement, params):
+        '''
+        Count the statement, and return its result rows. Answers
+        the LTI lookup of PiazzaImporter.ltiLookupQuery() with one
+        (lti, user_int_id) row per parameter.
+        '''
+        self.execute(statement)
+        if 'idExt2Anon(' in statement:
+            return [(lti, self.userIntIdsByLti.get(lti)) for lti in params]
+        return []
+
+    def insert(self, tblName, colnameValueDict):
+        self.execute('INSERT INTO %s (%s) VALUES (%s)' % (tblName, ','.join(colnameValueDict.keys()), self.ensureSQLTyping(colnameValueDict.values())))
+
+    def bulkInsert(self, tblName, colNameTuple, valueTupleArray):
+        self.numStatements += 1
+
+    def createTable(self, tableName, schema):
+        self.numStatements += 1
+
+    def dropTable(self, tableName):
+        self.numStatements += 1
+
+    def truncateTable(self, tableName):
+        self.numStatements += 1
+
+    def close(self):
+        pass
+
+    def ensureSQLTyping(self, colVals):
+        '''
+        Same rendering of values as pymysql_utils' MySQLDB.
+        '''
+        resList = []
+        for value in colVals:
+            if isinstance(value, basestring):
+                resList.append('"%s"' % value)
+            elif value is None:
+                resList.append('null')
+            else:
+                resList.append(str(value))
+        return ','.join(resList)
+
+    def query(self, queryStr):
+        '''
+        Generator of result tuples for the queries the ETL issues.
+        '''
+        self.numStatements += 1
+        queryStr = queryStr.strip().rstrip(';')
+        userMatch = USER_QUERY_PATTERN.match(queryStr)
+        if userMatch is not None:
+            withForumUids = userMatch.group(1) != 'NULL'
+            if userMatch.group(2) is None:
+                userIntIds = sorted(self.usersById.keys())
+            else:
+                userIntIds = [int(idStr) for idStr in userMatch.group(2).split(',') if len(idStr.strip()) > 0]
+            for userIntId in userIntIds:
+                rosterUser = self.usersById.get(userIntId)
+                if rosterUser is not None:
+                    yield (rosterUser.userIntId, rosterUser.fullName, rosterUser.screenName, rosterUser.anonScreenName,
+                           forumUid(userIntId) if withForumUids else None)
+            return
+        if USER_MARKER_PATTERN.match(queryStr) is not None:
+            yield (len(self.usersById), max(self.usersById.keys()) if len(self.usersById) > 0 else None)
+            return
+        if queryStr.upper().startswith('SELECT') and 'idInt2Forum(' in queryStr and ' FROM ' not in queryStr.upper():
+            yield tuple([forumUid(int(idStr)) for idStr in FORUM_UID_PATTERN.findall(queryStr)])
+            return
+        if 'idExt2Anon(' in queryStr:
+            ltis = LTI_QUERY_PATTERN.findall(queryStr)
+            yield tuple([self.userIntIdsByLti.get(lti) for lti in ltis])
+            return
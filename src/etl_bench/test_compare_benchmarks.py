@@ -0,0 +1,71 @@
+'''
+Tests for the benchmark regression gate.
+'''
+import unittest
+
+from compare_benchmarks import IncomparableResults, compareResults, poolResults
+from run_benchmarks import RESULT_FORMAT_VERSION, summarize
+
+
+def makeResults(throughputs, peakRss, workloadName='small', numWorkers=0):
+    trials = [{'records' : 1000, 'recordsPerSec' : throughput, 'peakRssMB' : peakRss, 'stages' : {}}
+              for throughput in throughputs]
+    return {'formatVersion' : RESULT_FORMAT_VERSION,
+            'workload' : {'name' : workloadName},
+            'benchmarks' : {'EdxForumScrubber' : {'options' : {'numWorkers' : numWorkers},
+                                                  'trials' : trials,
+                                                  'summary' : summarize(trials)}}}
+
+
+class TestCompareBenchmarks(unittest.TestCase):
+
+    def testThroughputRegression(self):
+        baseline = makeResults([100.0, 100.0, 100.0], 50.0)
+        comparison = compareResults(baseline, makeResults([95.0, 95.0, 95.0], 50.0), 0.1, 0.1)['EdxForumScrubber']
+        self.assertEqual([], comparison['regressions'])
+        self.assertAlmostEqual(-0.05, comparison['recordsPerSecChange'])
+        comparison = compareResults(baseline, makeResults([80.0, 80.0, 80.0], 50.0), 0.1, 0.1)['EdxForumScrubber']
+        self.assertEqual(['recordsPerSec'], comparison['regressions'])
+
+    def testNoiseWidensThreshold(self):
+        # Baseline trials spread by 30%, so a 20% drop is within noise:
+        baseline = makeResults([85.0, 100.0, 115.0], 50.0)
+        comparison = compareResults(baseline, makeResults([80.0, 80.0, 80.0], 50.0), 0.1, 0.1)['EdxForumScrubber']
+        self.assertAlmostEqual(0.3, comparison['noise'])
+        self.assertEqual([], comparison['regressions'])
+        comparison = compareResults(baseline, makeResults([60.0, 60.0, 60.0], 50.0), 0.1, 0.1)['EdxForumScrubber']
+        self.assertEqual(['recordsPerSec'], comparison['regressions'])
+
+    def testMemoryRegression(self):
+        baseline = makeResults([100.0, 100.0, 100.0], 50.0)
+        comparison = compareResults(baseline, makeResults([120.0, 120.0, 120.0], 60.0), 0.1, 0.1)['EdxForumScrubber']
+        self.assertEqual(['peakRssMB'], comparison['regressions'])
+
+    def testPooledBaselines(self):
+        pooled = poolResults([makeResults([90.0, 100.0], 50.0), makeResults([110.0], 52.0)])
+        summary = pooled['benchmarks']['EdxForumScrubber']['summary']
+        self.assertEqual(3, summary['trials'])
+        self.assertEqual(100.0, summary['recordsPerSec'])
+        self.assertRaises(IncomparableResults, poolResults, [makeResults([100.0], 50.0), makeResults([100.0], 50.0, 'large')])
+
+    def testIncomparable(self):
+        self.assertRaises(IncomparableResults, compareResults, makeResults([100.0], 50.0), makeResults([100.0], 50.0, 'large'), 0.1, 0.1)
+
+    def testMissingBenchmark(self):
+        # A baseline benchmark that the candidate did not run cannot pass:
+        baseline = makeResults([100.0], 50.0)
+        baseline['benchmarks']['PiazzaImporter'] = baseline['benchmarks']['EdxForumScrubber']
+        self.assertRaises(IncomparableResults, compareResults, baseline, makeResults([100.0], 50.0), 0.1, 0.1)
+        # Extra candidate benchmarks are not compared:
+        self.assertEqual(['EdxForumScrubber'], compareResults(makeResults([100.0], 50.0), baseline, 0.1, 0.1).keys())
+
+    def testDifferentOptions(self):
+        # A benchmark run with other options measures something else:
+        self.assertRaises(IncomparableResults, compareResults, makeResults([100.0], 50.0), makeResults([100.0], 50.0, numWorkers=4), 0.1, 0.1)
+        self.assertRaises(IncomparableResults, poolResults, [makeResults([100.0], 50.0), makeResults([100.0], 50.0, numWorkers=4)])
+        pooled = poolResults([makeResults([100.0], 50.0, numWorkers=4), makeResults([110.0], 50.0, numWorkers=4)])
+        self.assertEqual({'numWorkers' : 4}, pooled['benchmarks']['EdxForumScrubber']['options'])
+        self.assertEqual([], compareResults(pooled, makeResults([100.0], 50.0, numWorkers=4), 0.1, 0.1)['EdxForumScrubber']['regressions'])
+
+if __name__ == "__main__":
+    unittest.main()
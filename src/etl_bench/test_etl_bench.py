@@ -0,0 +1,94 @@
+'''
+Tests for the synthetic dump generators, the MySQL stand-in,
+and the summaries of the benchmark runner.
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import bson
+
+from generators import WorkloadSpec, makeRoster, writeForumBson, writePiazzaDump
+from run_benchmarks import summarize
+from standins import StandInMySQLDB, forumUid
+
+
+class TestEtlBench(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = WorkloadSpec('test', numPosts=300, meanBodyLength=200, piiDensity=5.0, threadDepth=2, rosterSize=50)
+        self.roster = makeRoster(self.spec)
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testForumBson(self):
+        bsonPath = os.path.join(self.tmpDir, 'forum.bson')
+        writeForumBson(bsonPath, self.spec, self.roster)
+        with open(bsonPath, 'rb') as bsonFile:
+            docs = bson.decode_all(bsonFile.read())
+        self.assertEqual(300, len(docs))
+        self.assertEqual('CommentThread', docs[0]['_type'])
+        postsById = dict([(doc['_id'], doc) for doc in docs])
+        for doc in docs:
+            # Replies are at most threadDepth levels deep:
+            depth = 0
+            while doc.get('parent_id') is not None:
+                doc = postsById[doc['parent_id']]
+                depth += 1
+            self.assertTrue(depth < self.spec.threadDepth)
+        self.assertTrue(any(['@example.com' in doc['body'] for doc in docs]))
+        # Same spec, same dump:
+        otherPath = os.path.join(self.tmpDir, 'other.bson')
+        writeForumBson(otherPath, self.spec, makeRoster(self.spec))
+        with open(bsonPath, 'rb') as bsonFile, open(otherPath, 'rb') as otherFile:
+            self.assertEqual(bsonFile.read(), otherFile.read())
+
+    def testPiazzaDump(self):
+        (contentPath, usersPath, mappingPath) = writePiazzaDump(self.tmpDir, self.spec, self.roster)
+        with open(contentPath) as contentFile:
+            posts = json.load(contentFile)
+        numPosts = 0
+        pendingPosts = list(posts)
+        while len(pendingPosts) > 0:
+            post = pendingPosts.pop()
+            numPosts += 1
+            self.assertTrue(len(post['history']) > 0)
+            pendingPosts.extend(post['children'])
+        self.assertEqual(300, numPosts)
+        with open(usersPath) as usersFile:
+            self.assertEqual(50, len(json.load(usersFile)))
+        with open(mappingPath) as mappingFile:
+            self.assertEqual(51, len(mappingFile.readlines()))
+
+    def testStandInQueries(self):
+        standInDb = StandInMySQLDB(self.roster)
+        userRows = list(standInDb.query('select user_int_id,name,screen_name,anon_screen_name,EdxPrivate.idInt2Forum(user_int_id) ' +
+                                        'from EdxPrivate.UserGrade where user_int_id in (3,999)'))
+        self.assertEqual([(3, self.roster[2].fullName, self.roster[2].screenName, self.roster[2].anonScreenName, forumUid(3))], userRows)
+        self.assertEqual(50, len(list(standInDb.query('select user_int_id,name,screen_name,anon_screen_name,NULL from EdxPrivate.UserGrade'))))
+        self.assertEqual([(50, 50)], list(standInDb.query('select count(*), max(user_int_id) from EdxPrivate.UserGrade')))
+        self.assertEqual([(forumUid(3), forumUid(4))], list(standInDb.query('SELECT EdxPrivate.idInt2Forum(3),EdxPrivate.idInt2Forum(4);')))
+        self.assertEqual([(7,)], list(standInDb.query("SELECT Edx.idAnon2Int(idExt2Anon('%s'));" % self.roster[6].lti)))
+        cursor = standInDb.connection.cursor()
+        cursor.execute('SELECT ext.lti, Edx.idAnon2Int(idExt2Anon(ext.lti)) FROM (SELECT %s AS lti UNION ALL SELECT %s) AS ext;',
+                       [self.roster[6].lti, 'unknown'])
+        self.assertEqual([(self.roster[6].lti, 7), ('unknown', None)], cursor.fetchall())
+        self.assertEqual([], list(standInDb.query('SELECT * FROM ForumCheckpoints')))
+        self.assertEqual('"a",null,3', standInDb.ensureSQLTyping(['a', None, 3]))
+
+    def testSummarize(self):
+        trials = [{'records' : 100, 'recordsPerSec' : 90.0, 'peakRssMB' : 30.0, 'stages' : {'insert' : 0.2}},
+                  {'records' : 100, 'recordsPerSec' : 100.0, 'peakRssMB' : 31.0, 'stages' : {'insert' : 0.3}},
+                  {'records' : 100, 'recordsPerSec' : 110.0, 'peakRssMB' : 29.0, 'stages' : {'insert' : 0.1}}]
+        summary = summarize(trials)
+        self.assertEqual(100.0, summary['recordsPerSec'])
+        self.assertEqual(0.2, summary['recordsPerSecSpread'])
+        self.assertEqual(30.0, summary['peakRssMB'])
+        self.assertEqual({'insert' : 0.2}, summary['stages'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+'''
+Reads the documents of a mongodump .bson file directly,
+without first restoring the file into a MongoDB server.
+
+A .bson dump is nothing but a concatenation of BSON documents,
+each of which starts with its own total length as a little-endian
+int32. BsonFileReader walks the file one document at a time,
+decodes each into a dict, and counts the documents as it goes.
+The file offset after each document lets a later pass start right
+behind a document that was already processed.
+'''
+
+import struct
+
+import bson
+
+
+class BsonFileReader(object):
+    '''
+    Acts as a stand-in for the json_to_relation MongoDB wrapper
+    as far as EdxForumScrubber.forumMongoToRelational() is concerned:
+    query({}) returns a generator over all documents of the .bson file.
+    After a full pass, numDocs holds the number of documents read.
+    While a pass is under way, offset is the file offset just behind
+    the document most recently yielded. Setting startOffset to such
+    an offset makes the next pass begin there.
+    '''
+
+    # Each BSON document starts with its length in bytes,
+    # including the four bytes of the length field itself:
+    DOC_LEN_STRUCT = struct.Struct('<i')
+
+    def __init__(self, bsonFileName):
+        '''
+        :param bsonFileName: full path to a mongodump .bson file
+        :type bsonFileName: String
+        '''
+        self.bsonFileName = bsonFileName
+        self.numDocs = 0
+        self.startOffset = 0
+        self.offset = 0
+
+    def query(self, mongoQuery):
+        '''
+        Return a generator of all documents in the .bson file.
+        Only the match-all query {} is supported, since no
+        server is involved to evaluate anything else.
+
+        :param mongoQuery: must be an empty dict
+        :type mongoQuery: dict
+        :return: generator of decoded documents
+        :rtype: generator
+        :raise ValueError: if mongoQuery is not empty
+        '''
+        if len(mongoQuery) > 0:
+            raise ValueError('BsonFileReader only supports the match-all query {}; got %s' % str(mongoQuery))
+        return self.documents()
+
+    def documents(self):
+        '''
+        Generator that yields one decoded document after
+        the other, beginning at self.startOffset, and counting
+        them in self.numDocs.
+
+        :raise ValueError: if the file ends in the middle of a document
+        '''
+        self.numDocs = 0
+        docLenSize = BsonFileReader.DOC_LEN_STRUCT.size
+        with open(self.bsonFileName, 'rb') as bsonFd:
+            bsonFd.seek(self.startOffset)
+            self.offset = self.startOffset
+            while True:
+                docLenBytes = bsonFd.read(docLenSize)
+                if len(docLenBytes) == 0:
+                    # Clean end of file:
+                    return
+                if len(docLenBytes) < docLenSize:
+                    raise ValueError('Truncated BSON file %s after %d documents.' % (self.bsonFileName, self.numDocs))
+                docLen = BsonFileReader.DOC_LEN_STRUCT.unpack(docLenBytes)[0]
+                docRest = bsonFd.read(docLen - docLenSize)
+                if len(docRest) < docLen - docLenSize:
+                    raise ValueError('Truncated BSON file %s after %d documents.' % (self.bsonFileName, self.numDocs))
+                doc = bson.BSON(docLenBytes + docRest).decode()
+                self.numDocs += 1
+                self.offset += docLen
+                yield doc
+
+    def close(self):
+        '''
+        Nothing to release; the file is closed at the end
+        of each pass. Present so that callers can treat
+        BsonFileReader like a MongoDB object.
+        '''
+        pass
@@ -0,0 +1,215 @@
+'''
+Profiling support for the ETL command line entry points.
+
+EtlProfiler profiles one phase of a run, such as
+EdxForumScrubber.runConversion(), and writes two files:
+
+    - <outputPrefix>.pstats: statistics readable with the pstats
+      module, or with viewers such as snakeviz,
+    - <outputPrefix>.collapsed: one line per distinct call stack,
+      frames separated by ';', followed by a count, as taken by
+      flamegraph.pl and speedscope.
+
+Two modes are available:
+
+    - 'sample': a SIGPROF timer interrupts the process every
+      sampleInterval seconds of CPU time, and the handler records
+      the current Python stack. Overhead is low enough for
+      production-sized runs. Counts in the collapsed file are
+      samples; the pstats file is derived from the samples, so its
+      call counts are sample counts as well. Only the main thread
+      is sampled, and only on Unix.
+    - 'cprofile': the deterministic cProfile profiler. Exact call
+      counts, but a run takes considerably longer. The collapsed
+      stacks are reconstructed from cProfile's caller/callee
+      graph, with counts in microseconds.
+
+Usage:
+
+    with EtlProfiler('/tmp/forumRun', mode='sample'):
+        extractor.runConversion()
+'''
+
+from collections import defaultdict
+import cProfile
+import marshal
+import os
+import pstats
+import signal
+
+
+class EtlProfiler(object):
+    '''
+    Context manager that profiles the enclosed block, and
+    writes the pstats and collapsed stack files on exit.
+    '''
+
+    MODES = ('sample', 'cprofile')
+    # Seconds of CPU time between two stack samples:
+    DEFAULT_SAMPLE_INTERVAL = 0.005
+    # Reconstructed cProfile stacks whose time is below this
+    # fraction of the total are left out of the collapsed file:
+    MIN_STACK_FRACTION = 0.0001
+    MAX_STACK_DEPTH = 200
+
+    def __init__(self, outputPrefix, mode='sample', sampleInterval=DEFAULT_SAMPLE_INTERVAL):
+        '''
+        :param outputPrefix: path of the output files without their extensions
+        :type outputPrefix: String
+        :param mode: one of MODES
+        :type mode: String
+        :param sampleInterval: seconds of CPU time between stack samples in 'sample' mode
+        :type sampleInterval: float
+        '''
+        if mode not in EtlProfiler.MODES:
+            raise ValueError("Profiling mode must be one of %s; was '%s'." % (', '.join(EtlProfiler.MODES), mode))
+        self.outputPrefix = outputPrefix
+        self.mode = mode
+        self.sampleInterval = sampleInterval
+        self.profile = None
+        # Stack of (filename, firstLineNo, funcName), outermost
+        # first --> number of samples:
+        self.stackSamples = defaultdict(int)
+        self.prevHandler = None
+
+    @property
+    def pstatsPath(self):
+        return self.outputPrefix + '.pstats'
+
+    @property
+    def collapsedPath(self):
+        return self.outputPrefix + '.collapsed'
+
+    def start(self):
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return
+        self.prevHandler = signal.signal(signal.SIGPROF, self.takeSample)
+        # Have interrupted system calls, such as MySQL reads, resume:
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.sampleInterval, self.sampleInterval)
+
+    def stop(self):
+        '''
+        Stop profiling, and write the output files.
+        '''
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            self.profile.dump_stats(self.pstatsPath)
+            self.writeCollapsed(collapsedFromStats(pstats.Stats(self.profile).stats,
+                                                   EtlProfiler.MIN_STACK_FRACTION,
+                                                   EtlProfiler.MAX_STACK_DEPTH))
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.prevHandler or signal.SIG_DFL)
+        with open(self.pstatsPath, 'wb') as pstatsFile:
+            marshal.dump(statsFromSamples(self.stackSamples, self.sampleInterval), pstatsFile)
+        self.writeCollapsed(self.stackSamples)
+
+    def takeSample(self, signum, frame):
+        '''
+        SIGPROF handler: count the stack of the interrupted frame.
+        '''
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        self.stackSamples[tuple(stack)] += 1
+
+    def writeCollapsed(self, stackCounts):
+        '''
+        Write the given stack --> count dict in collapsed stack format.
+        '''
+        with open(self.collapsedPath, 'w') as collapsedFile:
+            for stack, count in sorted(stackCounts.items()):
+                if count > 0:
+                    collapsedFile.write('%s %d\n' % (';'.join([frameLabel(funcKey) for funcKey in stack]), count))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+        return False
+
+def frameLabel(funcKey):
+    '''
+    Render a pstats function key (filename, lineNo, funcName)
+    as one frame of a collapsed stack.
+    '''
+    (filename, lineNo, funcName) = funcKey
+    if filename == '~':
+        # Built-in function:
+        return funcName.replace(';', ':')
+    return ('%s (%s:%d)' % (funcName, os.path.basename(filename), lineNo)).replace(';', ':')
+
+def statsFromSamples(stackSamples, sampleInterval):
+    '''
+    Turn stack samples into the dict that pstats.Stats loads from a file:
+    function key --> (primitive calls, calls, own time, cumulative time,
+    {caller key --> (calls, primitive calls, own time, cumulative time)}).
+    Call counts are sample counts.
+    '''
+    ownSamples = defaultdict(int)
+    cumulativeSamples = defaultdict(int)
+    callerSamples = defaultdict(lambda: defaultdict(int))
+    for stack, count in stackSamples.items():
+        ownSamples[stack[-1]] += count
+        # Recursive functions count once per sample:
+        for funcKey in set(stack):
+            cumulativeSamples[funcKey] += count
+        for callerKey, funcKey in set(zip(stack[:-1], stack[1:])):
+            callerSamples[funcKey][callerKey] += count
+    stats = {}
+    for funcKey, cumulative in cumulativeSamples.items():
+        callers = dict([(callerKey, (count, count, 0.0, count * sampleInterval))
+                        for callerKey, count in callerSamples[funcKey].items()])
+        stats[funcKey] = (cumulative, cumulative, ownSamples[funcKey] * sampleInterval, cumulative * sampleInterval, callers)
+    return stats
+
+def collapsedFromStats(stats, minFraction, maxDepth):
+    '''
+    Reconstruct collapsed stacks from cProfile statistics. Each function's
+    time is split among its callees in proportion to the cumulative time
+    cProfile recorded for each caller/callee pair.
+
+    :param stats: as in pstats.Stats.stats
+    :type stats: dict
+    :param minFraction: stacks with less than this fraction of the total time are dropped
+    :type minFraction: float
+    :param maxDepth: stacks are cut off at this depth
+    :type maxDepth: int
+    :return: stack of function keys --> microseconds of own time
+    :rtype: {tuple : int}
+    '''
+    callees = defaultdict(list)
+    for funcKey, (_, _, _, _, callers) in stats.items():
+        for callerKey, callerStats in callers.items():
+            callees[callerKey].append((funcKey, callerStats[3]))
+    roots = [funcKey for funcKey, funcStats in stats.items()
+             if len([callerKey for callerKey in funcStats[4] if callerKey in stats]) == 0]
+    totalTime = sum([stats[funcKey][3] for funcKey in roots])
+    minTime = totalTime * minFraction
+    stackTimes = defaultdict(int)
+    # Work list of (stack, time spent in the stack's last function on this path):
+    pending = [((funcKey,), stats[funcKey][3]) for funcKey in roots]
+    while len(pending) > 0:
+        (stack, pathTime) = pending.pop()
+        funcKey = stack[-1]
+        (_, _, ownTime, cumulativeTime, _) = stats[funcKey]
+        if cumulativeTime <= 0:
+            continue
+        share = pathTime / cumulativeTime
+        stackTimes[stack] += int(ownTime * share * 1000000)
+        if len(stack) >= maxDepth:
+            continue
+        for calleeKey, edgeTime in callees[funcKey]:
+            calleeTime = edgeTime * share
+            if calleeTime < minTime or calleeKey in stack:
+                continue
+            pending.append((stack + (calleeKey,), calleeTime))
+    return stackTimes
@@ -1,19 +1,30 @@
 import MySQLdb
 from UserDict import DictMixin
 import argparse
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from datetime import datetime
 import getpass
 import logging
+import multiprocessing
 import os
 from pymongo import MongoClient
 import re
 import subprocess
 import sys
+import time
 import warnings
 
 from json_to_relation.mongodb import MongoDB
 
+from bson_reader import BsonFileReader
+from etl_profiler import EtlProfiler
+from identity_cache import IdentityCache
+from mysql_tsv import TsvSpoolFile
+from name_matcher import RosterNameMatcher
+from pipeline import BackgroundConsumer, BackgroundIterator
+from redaction import PosterRedactorCache, compiledPhonePattern, compiledZipPattern, redactBody
+from stage_metrics import StageMetrics
+from user_cache import CompactUserCache, loadSnapshot
 from pymysql_utils.pymysql_utils import MySQLDB
 
 
@@ -22,8 +33,9 @@ class EdxForumScrubber(object):
     
     Given a .bson file of OpenEdX Forum posts, load the file
     into a MongoDB. Then pull a post at a time, anonymize, and
-    insert a selection of fields into a MySQL db. The MongoDb
-    entries look like this::
+    insert a selection of fields into a MySQL db. Alternatively,
+    with directBsonRead=True, the .bson file is decoded directly,
+    and no MongoDB is involved. The MongoDb entries look like this::
     
     {   
     	"_id" : ObjectId("51b75a48f359c40a00000028"),
@@ -65,14 +77,6 @@ class EdxForumScrubber(object):
     
     LOG_DIR = '/home/dataman/Data/EdX/NonTransformLogs'
 
-    # Pattern for email id - strings of alphabets/numbers/dots/hyphens followed
-    # by an @ or at followed by combinations of dot/. followed by the edu/com
-    # also, allow for spaces
-    
-    emailPattern='(.*)\s+([a-zA-Z0-9\(\.\-]+)[@]([a-zA-Z0-9\.]+)(.)(edu|com)\\s*(.*)'
-    #emailPattern='(.*)\\s+([a-zA-Z0-9\\.]+)\\s*(\\(f.*b.*)?(@)\\s*([a-zA-Z0-9\\.\\s;]+)\\s*(\\.)\\s*(edu|com)\\s+(.*)'
-    compiledEmailPattern = re.compile(emailPattern);
-
     # Pattern for replacing embedded double quotes in post bodies,
     # unless they are already escaped w/ a backslash. The
     # {0,1} means a match if zero or one repetition. It's
@@ -81,6 +85,9 @@ class EdxForumScrubber(object):
     #doublQuoteReplPattern = re.compile(r'[^\\]{0,1}"')
     doublQuoteReplPattern = re.compile(r'[\\]{0,}"')
 
+    # The value in a forum schema column spec's DEFAULT clause:
+    columnDefaultPattern = re.compile(r"DEFAULT '([^']*)'")
+
     # Schema of EdxForum.contents: an ordered dict that is
     # used twice: the table creation MySQL command is constructed
     # from this dict, and the dict is used to ensure that
@@ -88,7 +95,9 @@ class EdxForumScrubber(object):
     # in each MongoDB object. See also createForumTable().
     # In createForumTable() either entry anon_screen_name,
     # or screen_name in the dict below will be deleted, based
-    # on whether we are asked to anonymize or not:
+    # on whether we are asked to anonymize or not. Each
+    # EdxForumScrubber instance works with its own copy
+    # of this dict:
 
     forumSchema = OrderedDict({})
     
@@ -116,6 +125,41 @@ class EdxForumScrubber(object):
     forumSchema['confusion'] =  "varchar(20) NOT NULL DEFAULT ''"
     forumSchema['happiness'] =  "varchar(20) NOT NULL DEFAULT ''"
    
+    # Number of forum rows sent to MySQL in one multi-row
+    # INSERT statement. Each batch is one commit. Keep
+    # batches well below the server's max_allowed_packet
+    # (bodies may be up to 2500 chars):
+    DEFAULT_INSERT_BATCH_SIZE = 200
+    
+    # Maximum number of records between reading and
+    # inserting in pipelined runs; half of them may wait
+    # to be prepared, the other half to be inserted:
+    DEFAULT_MAX_IN_FLIGHT = 2000
+    
+    # MySQL function that turns a user_int_id into the 
+    # forum_uid stored with each post, and the maximum
+    # number of user_int_ids converted per query:
+    FORUM_UID_FUNCTION = 'EdxPrivate.idInt2Forum'
+    FORUM_UID_LOOKUP_CHUNK_SIZE = 500
+    # Version of FORUM_UID_FUNCTION's mapping, under which its
+    # results are kept in the identity cache. Change it when
+    # the function starts to return different forum_uids:
+    FORUM_UID_FUNCTION_VERSION = '1'
+    
+    # Maximum number of user_int_ids in the IN list of one
+    # user cache query when only posters are loaded:
+    USER_LOOKUP_CHUNK_SIZE = 1000
+    
+    # Table that remembers, for incremental runs, the latest
+    # updated_at of the posts loaded into each forum table,
+    # per course:
+    WATERMARK_TABLE = 'ForumWatermarks'
+    
+    # Table with each forum table's progress: the last post
+    # committed to MySQL, the number of posts committed so far,
+    # and, for direct .bson reads, the file offset behind that
+    # post. Updated in the same transaction as each batch:
+    CHECKPOINT_TABLE = 'ForumCheckpoints'
     
     def __init__(self, 
                  bsonFileName, 
@@ -123,7 +167,24 @@ class EdxForumScrubber(object):
                  forumTableName='contents', 
                  allUsersTableName='EdxPrivate.UserGrade',
                  anonymize=True,
-                 allowAnonScreenName=False):
+                 allowAnonScreenName=False,
+                 directBsonRead=False,
+                 insertBatchSize=DEFAULT_INSERT_BATCH_SIZE,
+                 bulkLoad=False,
+                 numWorkers=1,
+                 orderedWorkers=True,
+                 nameCacheSize=PosterRedactorCache.DEFAULT_MAX_POSTERS,
+                 redactRosterNames=False,
+                 incremental=False,
+                 resume=False,
+                 loadPostersOnly=False,
+                 userCacheSnapshot=None,
+                 identityCacheFile=None,
+                 metricsFile=None,
+                 prometheusFile=None,
+                 metricsInterval=StageMetrics.DEFAULT_WRITE_INTERVAL,
+                 pipelined=False,
+                 maxInFlight=DEFAULT_MAX_IN_FLIGHT):
         '''
         Given a .bson file containing OpenEdX Forum entries, anonymize the entries (if desired),
         and place them into a MySQL table.  
@@ -145,6 +206,70 @@ class EdxForumScrubber(object):
             post bodies are replaced by <redacName_<anon_screen_name>>, where anon_screen_name
             is the hash used in other tables of the OpenEdX data.
         :type allow_anon_screen_name: Bool 
+        :param directBsonRead: if True, posts are decoded straight from the .bson
+            file, rather than being loaded into a temporary MongoDB via mongorestore.
+        :type directBsonRead: Bool
+        :param insertBatchSize: number of forum rows to insert into MySQL with
+            each multi-row INSERT statement.
+        :type insertBatchSize: int
+        :param bulkLoad: if True, records are written to a tab separated spool file,
+            which is loaded into the forum table with a single LOAD DATA LOCAL INFILE
+            at the end. Requires local_infile to be enabled on the MySQL server.
+        :type bulkLoad: Bool
+        :param numWorkers: number of processes that anonymize records in parallel.
+            With 1, all work is done in this process.
+        :type numWorkers: int
+        :param orderedWorkers: if True, records anonymized by worker processes
+            are inserted in the order in which they were read.
+        :type orderedWorkers: Bool
+        :param nameCacheSize: number of posters whose compiled name
+            redaction scanners are kept for their next post.
+        :type nameCacheSize: int
+        :param redactRosterNames: if True, the first names of everyone in
+            allUsersTableName are redacted from all posts, not just the
+            poster's own names. See trimnames().
+        :type redactRosterNames: Bool
+        :param incremental: if True, the forum table is not dropped. Only posts
+            created or updated since the previous incremental run are loaded, and
+            they replace earlier versions of themselves by forum_post_id. See
+            prepIncremental().
+        :type incremental: Bool
+        :param resume: if True, and the previous run on this forum table died,
+            the table is not dropped, and the run continues just after the last
+            post that the previous run committed. See prepDatabase().
+        :type resume: Bool
+        :param loadPostersOnly: if True, runConversion() first scans the posts
+            for their authors, and the user cache is loaded for those users only,
+            rather than for everyone in allUsersTableName. With redactRosterNames,
+            the roster is then made up of the forum's posters.
+        :type loadPostersOnly: Bool
+        :param userCacheSnapshot: path of a user cache snapshot file. If the file
+            was written for the current state of allUsersTableName, the user cache
+            is memory-mapped from it instead of being queried; else the cache is
+            queried, and saved to the file for later runs. Not used with
+            loadPostersOnly. See populateUserCache().
+        :type userCacheSnapshot: String
+        :param identityCacheFile: SQLite file in which the forum_uids of user_int_ids
+            are kept across runs, and shared with the Piazza importer. If given,
+            idInt2Forum() is only called for user_int_ids the file does not hold.
+            See identity_cache.IdentityCache.
+        :type identityCacheFile: String
+        :param metricsFile: file to which the per-stage counts, records per second,
+            and p50/p99 per-record latencies are written as JSON, periodically
+            during the run, and at its end. See StageMetrics.
+        :type metricsFile: String
+        :param prometheusFile: like metricsFile, but in the Prometheus text format,
+            for the node exporter's textfile collector.
+        :type prometheusFile: String
+        :param metricsInterval: seconds between two periodic writes of the metrics files
+        :type metricsInterval: float
+        :param pipelined: if True, posts are read and decoded in one thread, and
+            sent to MySQL in another, while this thread (or the worker processes)
+            prepares them. See forumMongoToRelational().
+        :type pipelined: Bool
+        :param maxInFlight: in pipelined runs, the maximum number of records that
+            are read but not yet handed to the insert buffer.
+        :type maxInFlight: int
         '''
         
         self.bsonFileName = bsonFileName
@@ -153,6 +278,40 @@ class EdxForumScrubber(object):
         self.allUsersTableName = allUsersTableName
         self.anonymize = anonymize
         self.allowAnonScreenName = allowAnonScreenName
+        self.directBsonRead = directBsonRead
+        self.insertBatchSize = max(1, insertBatchSize)
+        self.bulkLoad = bulkLoad
+        self.numWorkers = max(1, numWorkers)
+        self.orderedWorkers = orderedWorkers
+        self.redactRosterNames = redactRosterNames
+        self.incremental = incremental
+        self.resume = resume
+        self.loadPostersOnly = loadPostersOnly
+        self.userCacheSnapshot = userCacheSnapshot
+        if identityCacheFile is None:
+            self.identityCache = None
+        else:
+            self.identityCache = IdentityCache(identityCacheFile)
+        self.pipelined = pipelined
+        self.maxInFlight = max(2, maxInFlight)
+        # Time and record counts of each stage of the run. The dump
+        # label tells runs on different course dumps apart:
+        self.metrics = StageMetrics(metricsFile,
+                                    prometheusFile,
+                                    metricsInterval,
+                                    labels={'dump' : os.path.basename(bsonFileName or ''),
+                                            'table' : forumTableName})
+        
+        # Column name/type pairs of the forum table; one of the
+        # poster name columns is removed in createForumTable():
+        self.forumSchema = OrderedDict(EdxForumScrubber.forumSchema)
+        # Values of the columns that have a DEFAULT string; 
+        # records that lack such a column get the default:
+        self.columnDefaults = {}
+        for colName, colSpec in self.forumSchema.items():
+            defaultMatch = EdxForumScrubber.columnDefaultPattern.search(colSpec)
+            if defaultMatch is not None:
+                self.columnDefaults[colName] = defaultMatch.group(1)
         
         # If not unittest, but regular run, then mysqlDbObj is None
         if mysqlDbObj is None:
@@ -165,8 +324,34 @@ class EdxForumScrubber(object):
 
         self.counter=0
         
+        # Forum records waiting to be sent to MySQL in
+        # the next multi-row INSERT, or to be written to
+        # the spool file when bulk loading:
+        self.insertBuffer = []
+        self.spoolFile = None
+        # Set if LOAD DATA of the spool file failed; the
+        # watermarks are then not advanced:
+        self.bulkLoadFailed = False
+        
+        # user_int_id --> (full name, screen_name, anon_screen_name, forum_uid);
+        # a CompactUserCache once populateUserCache() has run:
         self.userCache = {}
+        # Forum_uids of posters who are not in the user cache:
+        self.forumUidCache = {}
+        # First names of all users; only collected for redactRosterNames:
         self.userSet   = set()
+        # Automaton over userSet; built in populateUserCache()
+        # if redactRosterNames is True:
+        self.rosterNameMatcher = None
+        # Compiled redaction scanners of recent posters:
+        self.posterRedactors = PosterRedactorCache(nameCacheSize)
+        # Incremental runs: course_display_name --> latest updated_at
+        # loaded by the previous run, and by this run:
+        self.watermarks = {}
+        self.newWatermarks = {}
+        # Progress of an earlier, unfinished run as 
+        # (lastPostId, counter, bsonOffset), if resuming:
+        self.checkpoint = None
 
         warnings.filterwarnings('ignore', category=MySQLdb.Warning)        
         self.setupLogging()
@@ -181,21 +366,52 @@ class EdxForumScrubber(object):
         so that unittests can create an EdxForumScrubber instance without
         doing the actual work. Instead, unittests call individual methods. 
         '''
-        self.populateUserCache();
-
         self.mongo_database_name = 'TmpForum'
         self.collection_name = 'contents'
 
-        # Load bson file into Mongodb:
-        self.loadForumIntoMongoDb(self.bsonFileName)
-        self.mongodb = MongoDB(dbName=self.mongo_database_name, collection=self.collection_name)
+        if self.directBsonRead:
+            # Decode the posts straight from the bson file;
+            # the reader counts the documents as it goes:
+            self.mongodb = BsonFileReader(self.bsonFileName)
+        else:
+            # Load bson file into Mongodb:
+            self.loadForumIntoMongoDb(self.bsonFileName)
+            self.mongodb = MongoDB(dbName=self.mongo_database_name, collection=self.collection_name)
+        
+        with self.metrics.timed('userCacheLoad'):
+            if self.loadPostersOnly:
+                self.populateUserCache(self.collectAuthorIds(self.mongodb))
+            else:
+                self.populateUserCache()
         
         # Anonymize each forum record, and transfer to MySQL db:
         self.forumMongoToRelational(self.mongodb, self.mydb,'contents' )
+        if self.incremental:
+            self.saveWatermarks()
+        if self.anonymize and self.numWorkers == 1:
+            # With worker processes, each worker has its own cache:
+            self.logInfo('Poster redactor cache: %d hits, %d misses, %d posters cached' %\
+                         (self.posterRedactors.hits, self.posterRedactors.misses, len(self.posterRedactors)))
         
+        if self.directBsonRead:
+            self.numMongoItems = self.mongodb.numDocs
+            self.logInfo('Available Forum posts %s' % self.numMongoItems)
+
         self.mydb.close()
         self.mongodb.close()
+        if self.identityCache is not None:
+            self.identityCache.close()
         self.logInfo('Entered %d records into %s' % (self.counter, self.forumDbName + '.' + self.forumTableName))
+        self.reportMetrics()
+
+    def reportMetrics(self):
+        '''
+        Log the final per-stage metrics, and write the metrics files.
+        '''
+        for stage in self.metrics.report()['stages']:
+            self.logInfo('Stage %s: %d records in %.3fs (%s records/s), p50 %.3fms, p99 %.3fms' % \
+                         (stage['stage'], stage['records'], stage['seconds'], stage['recordsPerSec'], stage['p50Ms'], stage['p99Ms']))
+        self.metrics.write()
 
     def loadForumIntoMongoDb(self, bsonFilename):
 
@@ -240,6 +456,14 @@ class EdxForumScrubber(object):
         and a MySQL db object and table name, anonymize each mongo record,
         and insert it into the MySQL table.
         
+        If self.pipelined is True, the three stages overlap: a reader
+        thread fetches and decodes posts, this thread (or the worker
+        processes) prepares them, and a writer thread queues them for
+        insert, and sends the batches to MySQL. The stages are connected
+        by bounded queues that together hold at most self.maxInFlight
+        records, so a stage that gets ahead waits for the next one.
+        Only the writer thread talks to MySQL until all records are in.
+        
         :param collection: collection object obtained via a mangoclient object
         :type collection: Collection
         :param mysqlDbObj: wrapper to MySQL db. See pymysql_utils.py
@@ -254,8 +478,80 @@ class EdxForumScrubber(object):
     
         self.logInfo('Will start inserting from mongo collection to MySQL')
 
-        for mongoForumRec in mongodb.query({}):
+        mongoRecordObjs = self.mongoRecords(mongodb)
+        insertRecords = lambda preparedRecs: self.queueRecordsForInsert(mysqlDbObj, mysqlTable, preparedRecs)
+        reader = writer = None
+        if self.pipelined:
+            self.logInfo('Pipelined run with at most %d records in flight' % self.maxInFlight)
+            reader = BackgroundIterator(mongoRecordObjs, self.maxInFlight // 2, 'forumReader')
+            writer = BackgroundConsumer(lambda mongoRecordObj: self.queueRecordsForInsert(mysqlDbObj, mysqlTable, [mongoRecordObj]),
+                                        self.maxInFlight - self.maxInFlight // 2,
+                                        'forumWriter')
+            mongoRecordObjs = reader
+            def insertRecords(preparedRecs):
+                for mongoRecordObj in preparedRecs:
+                    writer.put(mongoRecordObj)
+        try:
+            if self.numWorkers > 1:
+                self.prepareRecordsInWorkers(mongoRecordObjs, insertRecords)
+            else:
+                for mongoRecordObj in mongoRecordObjs:
+                    startTime = time.time()
+                    mongoRecordObj = self.prepareRecord(mongoRecordObj)
+                    self.metrics.record('prepareRecord', time.time() - startTime)
+                    insertRecords([mongoRecordObj])
+            if writer is not None:
+                writer.finish()
+        finally:
+            if reader is not None:
+                reader.close()
+            if writer is not None:
+                writer.close()
+        
+        # Send the final, partially filled batch:
+        self.flushInsertBuffer(mysqlDbObj, mysqlTable)
+        
+        if self.bulkLoad:
+            self.loadSpoolFile(mysqlDbObj, mysqlTable)
+        
+        # All posts are in; the next run starts afresh:
+        self.clearCheckpoint(mysqlDbObj)
+        
+    def mongoRecords(self, mongodb):
+        '''
+        Generator that turns each post from the given source
+        into a MongoRecord that has all forum schema fields.
+        
+        :param mongodb: source of forum posts; a MongoDB or BsonFileReader
+        :type mongodb: {MongoDB | BsonFileReader}
+        :raise ValueError: if resuming, and the source does not hold the
+            checkpoint's post
+        '''
+        # When resuming, a .bson file is read from just behind the
+        # last committed post. Other sources are skipped through
+        # to that post:
+        skipThroughPostId = None
+        if self.checkpoint is not None:
+            (lastPostId, counter, bsonOffset) = self.checkpoint
+            if isinstance(mongodb, BsonFileReader) and bsonOffset > 0:
+                mongodb.startOffset = bsonOffset
+            else:
+                skipThroughPostId = lastPostId
+        metrics = self.metrics
+        for mongoForumRec in metrics.timedIter('read', mongodb.query({})):
+            if self.incremental and not self.isNewOrUpdated(mongoForumRec):
+                continue
+            if skipThroughPostId is not None:
+                if str(mongoForumRec.get('_id')) == skipThroughPostId:
+                    skipThroughPostId = None
+                continue
+            startTime = time.time()
             mongoRecordObj = MongoRecord(mongoForumRec)
+            metrics.record('makeDict', time.time() - startTime)
+            if isinstance(mongodb, BsonFileReader):
+                # Remember where in the file the record ended,
+                # for checkpoints:
+                mongoRecordObj.sourceOffset = mongodb.offset
 
             try:
                 # Check whether 'up' can be converted to a list
@@ -266,15 +562,93 @@ class EdxForumScrubber(object):
             
             # Make sure the MongoDB object has all fields that will
             # be needed for the forum schema:
+            startTime = time.time()
             self.ensureSchemaAdherence(mongoRecordObj)
-
-            self.insert_content_record(mysqlDbObj, mysqlTable, mongoRecordObj);
+            metrics.record('ensureSchemaAdherence', time.time() - startTime)
+            yield mongoRecordObj
+        if skipThroughPostId is not None:
+            # The checkpoint's post is gone from the source, so there is
+            # no telling which posts are already in the forum table:
+            raise ValueError('Cannot resume: post %s of the checkpoint on %s is not in the source, and the table holds %d posts of the interrupted run. Rerun without --resume.' %\
+                             (skipThroughPostId, self.forumTableName, self.checkpoint[1]))
+
+    def prepareRecordsInWorkers(self, mongoRecordObjs, insertRecords):
+        '''
+        Hand batches of MongoRecords to a pool of self.numWorkers processes,
+        which run prepareRecord() (i.e. anonymization) on them. The anonymized
+        batches come back to this process, which alone talks to MySQL. The
+        workers are forked after this scrubber is published in workerScrubber,
+        so each inherits a read-only copy of the user cache. At most two
+        batches per worker are outstanding at any time, which bounds memory.
+        
+        :param mongoRecordObjs: records as produced by mongoRecords()
+        :type mongoRecordObjs: iterable
+        :param insertRecords: function that takes a list of prepared records
+            on their way to MySQL
+        :type insertRecords: callable
+        '''
+        global workerScrubber
+        workerScrubber = self
+        self.logInfo('Anonymizing with %d worker processes' % self.numWorkers)
+        pool = multiprocessing.Pool(processes=self.numWorkers)
+        try:
+            pendingBatches = deque()
+            maxPendingBatches = 2 * self.numWorkers
+            recordBatch = []
+            for mongoRecordObj in mongoRecordObjs:
+                recordBatch.append(mongoRecordObj)
+                if len(recordBatch) < self.insertBatchSize:
+                    continue
+                pendingBatches.append(pool.apply_async(prepareRecordBatch, (recordBatch,)))
+                recordBatch = []
+                if len(pendingBatches) >= maxPendingBatches:
+                    insertRecords(self.nextPreparedBatch(pendingBatches))
+            if len(recordBatch) > 0:
+                pendingBatches.append(pool.apply_async(prepareRecordBatch, (recordBatch,)))
+            while len(pendingBatches) > 0:
+                insertRecords(self.nextPreparedBatch(pendingBatches))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            workerScrubber = None
+
+    def nextPreparedBatch(self, pendingBatches):
+        '''
+        Remove one finished batch from the given queue of worker 
+        results, and return its records. If self.orderedWorkers
+        is True, that is always the oldest batch. Else it is the
+        oldest batch that is already done, if any.
+        
+        The metrics the worker collected for the batch are
+        added to self.metrics.
         
+        :param pendingBatches: AsyncResult instances of prepareRecordBatch() calls
+        :type pendingBatches: deque
+        :return: prepared records
+        :rtype: [MongoRecord]
+        '''
+        readyBatch = None
+        if not self.orderedWorkers:
+            for batchIndex, asyncBatch in enumerate(pendingBatches):
+                if asyncBatch.ready():
+                    del pendingBatches[batchIndex]
+                    readyBatch = asyncBatch
+                    break
+        if readyBatch is None:
+            readyBatch = pendingBatches.popleft()
+        (mongoRecordObjs, (stageTotals, stageSamples)) = readyBatch.get()
+        self.metrics.merge(stageTotals, stageSamples)
+        return mongoRecordObjs
+
     def prepDatabase(self):
         '''
         Declare variables and execute statements preparing the database to 
         configure options - e.g.: setting char set to utf, connection type to utf
-        truncating the already existing table.
+        truncating the already existing table. When resuming an unfinished
+        run, the table is kept, and the run's checkpoint is loaded instead.
         '''
         try:
             self.logDebug("Setting and assigning char set for mysqld. will truncate old values")
@@ -286,6 +660,21 @@ class EdxForumScrubber(object):
             # which self.mydb is connected, and the forum table name
             # that was established in __init__():
             fullTblName = self.mydb.dbName() + '.' + self.forumTableName
+            self.mydb.execute('CREATE TABLE IF NOT EXISTS %s (' % EdxForumScrubber.CHECKPOINT_TABLE +\
+                              'forum_table varchar(100) NOT NULL PRIMARY KEY,' +\
+                              'last_post_id varchar(40) NOT NULL,' +\
+                              'counter int(11) NOT NULL,' +\
+                              'bson_offset bigint NOT NULL,' +\
+                              'run_time datetime NOT NULL);')
+            if self.resume:
+                self.loadCheckpoint()
+            if self.incremental:
+                self.prepIncremental(fullTblName)
+                return
+            if self.checkpoint is not None:
+                # Keep the posts committed before the crash:
+                self.createForumTable(self.anonymize, keepExisting=True)
+                return
             # Clear old forum data out of the table:
             try:
                 self.mydb.dropTable(fullTblName)
@@ -302,6 +691,119 @@ class EdxForumScrubber(object):
             # print e
             sys.exit(1)
     
+    def loadCheckpoint(self):
+        '''
+        Load the checkpoint that the previous run on this forum
+        table left behind, if it did not finish. Sets self.checkpoint
+        and self.counter.
+        '''
+        checkpointRows = list(self.mydb.query("SELECT last_post_id, counter, bson_offset FROM %s WHERE forum_table = '%s'" %\
+                                              (EdxForumScrubber.CHECKPOINT_TABLE, self.forumTableName)))
+        if len(checkpointRows) == 0:
+            self.logInfo('No checkpoint of an unfinished run on %s; starting from scratch.' % self.forumTableName)
+            return
+        (lastPostId, counter, bsonOffset) = checkpointRows[0]
+        self.checkpoint = (lastPostId, int(counter), int(bsonOffset))
+        self.counter = int(counter)
+        self.logInfo('Resuming after post %s; %d posts were committed before.' % (lastPostId, self.counter))
+
+    def checkpointing(self):
+        '''
+        Return True if batches are to be checkpointed. When worker
+        processes return batches out of order, the last record of a
+        batch does not mark how far the run has come, so no
+        checkpoints are written, and such runs start afresh.
+        '''
+        return self.numWorkers == 1 or self.orderedWorkers
+
+    def checkpointCmd(self, mongoRecordObj, counter):
+        '''
+        Return the statement that records the given record as the
+        last one committed, together with the number of records
+        committed by then.
+        
+        :param mongoRecordObj: last record of a batch
+        :type mongoRecordObj: MongoRecord
+        :param counter: number of records committed, including the batch
+        :type counter: int
+        '''
+        bsonOffset = mongoRecordObj.sourceOffset if mongoRecordObj.sourceOffset is not None else 0
+        return "REPLACE INTO %s (forum_table, last_post_id, counter, bson_offset, run_time) VALUES (%s)" %\
+               (EdxForumScrubber.CHECKPOINT_TABLE,
+                self.mydb.ensureSQLTyping([self.forumTableName, 
+                                           mongoRecordObj['forum_post_id'],
+                                           counter,
+                                           bsonOffset,
+                                           datetime.now().strftime('%Y-%m-%d %H:%M:%S')]))
+
+    def clearCheckpoint(self, mysqlDbObj):
+        '''
+        Remove the checkpoint of a finished run.
+        '''
+        mysqlDbObj.execute("DELETE FROM %s WHERE forum_table = '%s'" % (EdxForumScrubber.CHECKPOINT_TABLE, self.forumTableName))
+
+    def prepIncremental(self, fullTblName):
+        '''
+        Prepare an incremental run: create the forum table and the
+        watermark table if they don't exist yet, make sure the forum
+        table has a unique key on forum_post_id, and load the
+        watermarks of the previous run.
+        
+        :param fullTblName: db-qualified name of the forum table. Ex: 'EdxForum.contents'
+        :type fullTblName: String
+        '''
+        self.createForumTable(self.anonymize, uniquePostIds=True, keepExisting=True)
+        # A table created by a full run lacks the unique key:
+        keyRows = list(self.mydb.query("SHOW INDEX FROM %s WHERE Column_name = 'forum_post_id' AND Non_unique = 0" % fullTblName))
+        if len(keyRows) == 0:
+            self.logInfo('Adding unique key on forum_post_id to %s' % fullTblName)
+            self.mydb.execute('ALTER TABLE %s ADD UNIQUE KEY forum_post_id (forum_post_id)' % fullTblName)
+        self.mydb.execute('CREATE TABLE IF NOT EXISTS %s (' % EdxForumScrubber.WATERMARK_TABLE +\
+                          'forum_table varchar(100) NOT NULL,' +\
+                          'course_display_name varchar(100) NOT NULL,' +\
+                          'watermark varchar(40) NOT NULL,' +\
+                          'run_time datetime NOT NULL,' +\
+                          'PRIMARY KEY (forum_table, course_display_name));')
+        self.watermarks = {}
+        for (courseName, watermark) in self.mydb.query("SELECT course_display_name, watermark FROM %s WHERE forum_table = '%s'" %\
+                                                       (EdxForumScrubber.WATERMARK_TABLE, self.forumTableName)):
+            self.watermarks[courseName] = watermark
+        self.logInfo('Incremental run; %d courses loaded before' % len(self.watermarks))
+        
+    def isNewOrUpdated(self, mongoForumRec):
+        '''
+        Return True if the given raw post was created or updated
+        at or after its course's watermark. Posts stamped exactly
+        at the watermark are loaded again, which is harmless, since
+        they replace their earlier version. Also advances the course's
+        watermark for this run.
+        
+        :param mongoForumRec: post as read from MongoDB or the .bson file
+        :type mongoForumRec: dict
+        '''
+        courseName = str(mongoForumRec.get('course_id'))
+        postWatermark = watermarkValue(mongoForumRec)
+        if postWatermark > self.newWatermarks.get(courseName, ''):
+            self.newWatermarks[courseName] = postWatermark
+        return postWatermark >= self.watermarks.get(courseName, '')
+    
+    def saveWatermarks(self):
+        '''
+        Record the latest updated_at of each course seen in this
+        run, once all its posts are in the forum table. If the run
+        dies before, the next run starts from the old watermarks.
+        '''
+        if self.bulkLoadFailed:
+            # The posts are not in the forum table; keep the old watermarks:
+            self.logErr('Bulk load failed; watermarks not saved')
+            return
+        runTime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for courseName, watermark in self.newWatermarks.items():
+            self.mydb.execute("REPLACE INTO %s (forum_table, course_display_name, watermark, run_time) VALUES (%s)" %\
+                              (EdxForumScrubber.WATERMARK_TABLE,
+                               self.mydb.ensureSQLTyping([self.forumTableName, courseName, watermark, runTime])))
+        self.logInfo('Saved watermarks of %d courses' % len(self.newWatermarks))
+
     def getMySQLPasswd(self):
         homeDir=os.path.expanduser('~'+getpass.getuser())
         f_name = homeDir + '/.ssh/mysql'
@@ -312,51 +814,157 @@ class EdxForumScrubber(object):
             return ''
         return password
 
-    def populateUserCache (self) : 
+    def collectAuthorIds(self, mongodb):
         '''
-        Populate the User Cache and preload information on mySQLUser id int, screen name
-        and the actual name
+        Scan the given source of forum posts for the 
+        distinct user_int_ids of their authors. MongoDB
+        only returns the author_id field of each post; a
+        BsonFileReader has to decode the posts in full.
+        
+        :param mongodb: source of forum posts; a MongoDB or BsonFileReader
+        :type mongodb: {MongoDB | BsonFileReader}
+        :return: the authors' user_int_ids
+        :rtype: set
+        '''
+        if isinstance(mongodb, BsonFileReader):
+            mongoForumRecs = mongodb.query({})
+        else:
+            mongoForumRecs = mongodb.query({}, ('author_id',))
+        authorIds = set()
+        for mongoForumRec in mongoForumRecs:
+            try:
+                authorIds.add(int(mongoForumRec.get('author_id')))
+            except (TypeError, ValueError):
+                pass
+        self.logInfo("Found %d distinct post authors" % len(authorIds))
+        return authorIds
+    
+    def userRows(self, forumUidCol, authorIds=None):
+        '''
+        Generator of user table rows (user_int_id,name,screen_name,anon_screen_name,forum_uid),
+        either of all users, or of the given users only.
+        
+        :param forumUidCol: select expression for the forum_uid column
+        :type forumUidCol: String
+        :param authorIds: user_int_ids of the users to retrieve, or None for all
+        :type authorIds: {set | None}
+        '''
+        userQuery = 'select user_int_id,name,screen_name,anon_screen_name,%s from %s' % (forumUidCol, self.allUsersTableName)
+        if authorIds is None:
+            for userRow in self.mydb.query(userQuery):
+                yield userRow
+            return
+        authorIds = sorted(authorIds)
+        chunkSize = EdxForumScrubber.USER_LOOKUP_CHUNK_SIZE
+        for chunkStart in range(0, len(authorIds), chunkSize):
+            idList = ','.join([str(authorId) for authorId in authorIds[chunkStart:chunkStart + chunkSize]])
+            for userRow in self.mydb.query(userQuery + ' where user_int_id in (%s)' % idList):
+                yield userRow
+
+    def populateUserCache (self, authorIds=None) : 
+        '''
+        Populate the User Cache and preload information on mySQLUser id int, screen name,
+        the actual name, and, if anonymizing, the forum_uid. The forum_uids are computed
+        in the same query, so that anonymizeRecord() needs no per-post idInt2Forum() call.
+        With an identity cache, they are instead taken from the cache, and only the
+        missing ones are computed; see withCachedForumUids().
+        The cache is a CompactUserCache, which holds all names in one shared buffer.
+        
+        If all users are loaded, and self.userCacheSnapshot names a snapshot
+        file that was written for the current userTableMarker(), the cache
+        is mapped from that file instead. Otherwise, the snapshot is rewritten
+        from the freshly loaded cache.
+        
+        :param authorIds: if None, all users are loaded. Else only the users with 
+            these user_int_ids are loaded, USER_LOOKUP_CHUNK_SIZE at a time. The 
+            forum_uids of authors who are not in the user table are looked up too.
+        :type authorIds: {set | None}
         '''
         try:
             self.logInfo("Beginning to populate mySQLUser cache");
             # Cache all in-the-clear mySQLUser names of participants who
             # might post posts. We get those from the EdxPrivate.UserGrade table
-            # Result tuple positions:                  0        1        2            3
-            for userRow in self.mydb.query('select user_int_id,name,screen_name,anon_screen_name from %s' % self.allUsersTableName):
-                userCacheEntry=[]
-                userCacheEntry.append(userRow[1]) # full name
-                userCacheEntry.append(userRow[2]) # screen_name
-                userCacheEntry.append(userRow[3]) # anon_screen_name
-    
-                # Get poster's full name as firstName/lastName array:
-                posterName=userRow[1].split()
-            
-                if len(posterName)>0:
-                    # Collect the first name:
-                    self.userSet.add(posterName[0])
-    
-                """for word in posterName:
-                    if(len(word)>2 and '\\'    not in repr(word) ):
-                        self.userSet.add(word)
-                        if '-' in word:
-                            l2=word.split('-')
-                            for data in l2:
-                                self.userSet.add(data)"""
-                """if(len(userRow[1])>0):
-                    self.userSet|=set([userRow[1]])
-                    self.userSet|=set(userRow[2])"""
-                # Add a cache entry mapping user_int_id
-                # to the triplet full name/screen_name/anon_screen_name
-                self.userCache[int(userRow[0])] = userCacheEntry;    
+            if self.anonymize and self.identityCache is None:
+                forumUidCol = '%s(user_int_id)' % EdxForumScrubber.FORUM_UID_FUNCTION
+            else:
+                forumUidCol = 'NULL'
+            useSnapshot = self.userCacheSnapshot is not None and authorIds is None
+            userCache = None
+            if useSnapshot:
+                marker = self.userTableMarker()
+                userCache = loadSnapshot(self.userCacheSnapshot, marker)
+                if userCache is not None:
+                    self.logInfo("Mapped user cache snapshot %s" % self.userCacheSnapshot)
+            if userCache is None:
+                # Result tuple positions: user_int_id,name,screen_name,anon_screen_name,forum_uid
+                userCache = CompactUserCache()
+                userRows = self.userRows(forumUidCol, authorIds)
+                if self.anonymize and self.identityCache is not None:
+                    userRows = self.withCachedForumUids(userRows)
+                for userRow in userRows:
+                    # Add a cache entry mapping user_int_id to 
+                    # full name/screen_name/anon_screen_name/forum_uid
+                    userCache.add(int(userRow[0]), userRow[1:5])
+                userCache.finish()
+                if useSnapshot:
+                    try:
+                        userCache.saveSnapshot(self.userCacheSnapshot, marker)
+                        self.logInfo("Saved user cache snapshot %s" % self.userCacheSnapshot)
+                    except (IOError, OSError) as e:
+                        self.logWarn("Could not save user cache snapshot %s: %s" % (self.userCacheSnapshot, `e`))
+            self.userCache = userCache
             self.logInfo("loaded objects in usercache %d"%(len(self.userCache)))
-            # Save the mySQLUser cache in Python pickled format:
-            #pickle.dump( self.userSet, open( "mySQLUser.p", "wb" ) )
-    
-            #print self.userSet
+            if authorIds is not None and self.anonymize:
+                # Authors missing from the user table still need forum_uids:
+                missingIds = [authorId for authorId in authorIds if authorId not in self.userCache]
+                self.forumUidCache.update(self.lookupForumUids(missingIds))
+            if self.identityCache is not None:
+                self.logInfo("Identity cache: %d forum_uids found, %d computed" % (self.identityCache.numHits, self.identityCache.numMisses))
+            if self.redactRosterNames:
+                # Collect the first names of everyone:
+                self.userSet = set(self.userCache.firstNames())
+                self.rosterNameMatcher = RosterNameMatcher(self.userSet)
+                self.logInfo("Roster name matcher holds %d names" % len(self.rosterNameMatcher))
         except MySQLdb.Error,e:
             self.logInfo("MySql Error while mySQLUser cache exiting %d: %s" % (e.args[0],e.args[1]))
             sys.exit(1)
     
+    def withCachedForumUids(self, userRows):
+        '''
+        Generator of the given user table rows, with their forum_uid
+        column filled in by lookupForumUids(), USER_LOOKUP_CHUNK_SIZE
+        rows at a time.
+        
+        :param userRows: rows (user_int_id,name,screen_name,anon_screen_name,forum_uid)
+        :type userRows: iterable
+        '''
+        rowChunk = []
+        for userRow in userRows:
+            rowChunk.append(userRow)
+            if len(rowChunk) >= EdxForumScrubber.USER_LOOKUP_CHUNK_SIZE:
+                for filledRow in self.fillForumUids(rowChunk):
+                    yield filledRow
+                rowChunk = []
+        for filledRow in self.fillForumUids(rowChunk):
+            yield filledRow
+    
+    def fillForumUids(self, userRows):
+        forumUids = self.lookupForumUids([int(userRow[0]) for userRow in userRows])
+        return [tuple(userRow[:4]) + (forumUids.get(int(userRow[0])),) for userRow in userRows]
+
+    def userTableMarker(self):
+        '''
+        Return a string that changes whenever users are added to, or removed
+        from allUsersTableName: its row count and highest user_int_id. Whether
+        forum_uids are computed is part of the marker as well, since snapshots
+        taken without anonymization hold no forum_uids.
+        
+        :return: change marker of the user table
+        :rtype: String
+        '''
+        for (rowCount, maxUserIntId) in self.mydb.query('select count(*), max(user_int_id) from %s' % self.allUsersTableName):
+            return '%s rows=%s maxId=%s forumUids=%s' % (self.allUsersTableName, rowCount, maxUserIntId, self.anonymize)
+    
     def prune_numbers(self, body):
         '''
         Prunes phone numbers from a given string and returns the string with
@@ -367,12 +975,8 @@ class EdxForumScrubber(object):
         :returns: body with all phone number-like substrings replaced by <phoneRedac>
         :rtype: String
         '''
-        #re from stackoverflow. seems to do an awesome job at capturing all phone nos :)
-        s='((?:(?:\+?1\s*(?:[.-]\s*)?)?(?:\(\s*([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9])\s*\)|([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9]))\s*(?:[.-]\s*)?)?([2-9]1[02-9]|[2-9][02-9]1|[2-9][02-9]{2})\s*(?:[.-]\s*)?([0-9]{4})(?:\s*(?:#|x\.?|ext\.?|extension)\s*(\d+))?)'
-        match=re.findall(s,body)
-        for phoneMatchHit in match:
-            body=body.replace(phoneMatchHit[0],"<phoneRedac>")
-        return body    
+        # anonymizeRecord() does this as part of redaction.redactBody():
+        return compiledPhonePattern.sub("<phoneRedac>", body)
     
     def prune_zipcode(self, body):
         '''
@@ -382,40 +986,27 @@ class EdxForumScrubber(object):
         :param body: forum post
         :type body: String
         '''
-        s='\d{5}(?:[-\s]\d{4})?'
-        match=re.findall(s,body)
-        for zipcodeMatchHit in match:
-            body=body.replace(zipcodeMatchHit[0],"<zipRedac>")
-        return body
+        # anonymizeRecord() does this as part of redaction.redactBody():
+        return compiledZipPattern.sub("<zipRedac>", body)
 
     def trimnames(self, body):
         '''
-        UNTESTED:
-        Removes all person names known in the forum from the given
-        post. We currently return the body unchanged, because we
-        found that too many names match regular English words.  
+        Removes the first names of all users in the class roster
+        from the given post, if redactRosterNames was requested.
+        Otherwise the body is returned unchanged, because too many
+        names are regular English words.
+        
+        A re.sub() per roster name that occurs in the body was too
+        slow and removed too much. Instead, the RosterNameMatcher that
+        populateUserCache() builds finds all roster names in one pass,
+        and only redacts capitalized whole words.
+        
         :param body: forum post
         :type body: String
         '''
-        return body
-        #Trims all firstnames and last names from the body of the post.
-        
-        #print 'processing body %s' %(body)
-        #print 'en %s' %(len(self.userSet))
-        s3=set(body.split())
-        s4=s3&self.userSet
-        #print 's4 is %s' %(s4)
-        
-        for s in s4:
-            if len(s)>1 and s[0].isupper():
-                body = re.sub(r"\b%s\b" % s , "NAME_REMOVED", body)
-    
-                #body=body.replace(s,"NAME_REMOVED")
-        
-     
-        return body
-
-
+        if self.rosterNameMatcher is None:
+            return body
+        return self.rosterNameMatcher.redact(body, '<nameRedac>')
 
     def anonymizeRecord(self, mongoRecordObj):
         '''
@@ -436,77 +1027,134 @@ class EdxForumScrubber(object):
         :type mongoRecordObj:
         '''
         
-        body = mongoRecordObj['body']
-        body = self.prune_numbers(body)
-        body = self.prune_zipcode(body)
-
-        if EdxForumScrubber.compiledEmailPattern.match(body) is not None:
-            #print 'BODY before EMAIL STRIPING %posterNamePart \n'%(body);
-            match = re.findall(EdxForumScrubber.emailPattern, body)
-            new_body = " "
-            for emailMatchHit in match:
-                new_body += emailMatchHit[0] + " <emailRedac> " + emailMatchHit[-1] #print 'NEW BODY AFTER EMAIL STRIPING %posterNamePart \n'%(new_body);
-            
-            body = new_body
-
-        # Redact poster'posterNamePart fullName from the post;
-        # get tuple (fullUserName, screenName, anon_screen_name) from
+        # Get tuple (fullUserName, screenName, anon_screen_name, forum_uid) from
         # the fullName cache (which is keyed off user_int_id):
-        fullName, screen_name, anon_screen_name = self.userCache.get(int(mongoRecordObj['forum_int_id']), ('', '', ''))
-            # If not allowed to use hash of other db parts,
-            # then drop anon_screen_name:
+        posterIntId = int(mongoRecordObj['forum_int_id'])
+        fullName, screen_name, anon_screen_name, forum_uid = self.userCache.get(posterIntId, ('', '', '', None))
+        # If not allowed to use hash of other db parts,
+        # then drop anon_screen_name:
         if not self.allowAnonScreenName:
             anon_screen_name = '<anon_screen_name_redacted>'
+        # The user cache returns Unicode, while bodies are UTF-8:
+        if isinstance(anon_screen_name, unicode):
+            anon_screen_name = anon_screen_name.encode('UTF-8')
+
+        # Redact phone numbers, zipcodes, email addresses, and
+        # the poster's name parts and screen name in one scan
+        # of the body. Name parts are only redacted as whole words:
+        # e.g. name "Theo" shouldn't match "Theology". The poster's
+        # scanners are compiled once, and cached for later posts:
+        startTime = time.time()
         try:
-        # Check whether any part of the poster's
-        # name is in the body, and redact if needed:
-            bodyLowerCase = body.lower()
-            for posterNamePart in fullName.split():
-                if len(posterNamePart) >= 3:
-                    posterNameLowered = posterNamePart.lower().encode('UTF-8', 'replace')
-                    if posterNameLowered in bodyLowerCase: # Look for this loop iteration's part of the name
-                        # the poster's name. The '\b' ensures that
-                        # partial matches don't happen: e.g. name
-                        # "Theo" shouldn't match "Theology"
-                        pat = re.compile(r'\b%s\b' % posterNamePart, re.IGNORECASE)
-                        body = pat.sub("<nameRedac_" + anon_screen_name + ">", body)
-                    
+            posterRedactor = self.posterRedactors.get(posterIntId, (fullName or '').split(), screen_name)
+            body = posterRedactor.redact(mongoRecordObj['body'], "<nameRedac_" + anon_screen_name + ">")
         except Exception as e:
-            self.logInfo("Error while redacting poster name in forum post body: %s: %s" % (body, `e`))
-
-        if len(screen_name) > 0:
-            screenNamePattern = re.compile(screen_name, re.IGNORECASE)
-            body = screenNamePattern.sub("<nameRedac_" + anon_screen_name + ">", body)
+            # Still redact everything but the poster's names:
+            self.logInfo("Error while redacting poster name in forum post body: %s: %s" % (mongoRecordObj['body'], `e`))
+            body = redactBody(mongoRecordObj['body'])
+        self.metrics.record('posterRedaction', time.time() - startTime)
 
         # Trim the name of anyone in the class from the
-        # post. This method currently does nothing, b/c
-        # some of the names people give are very common
-        # English words: This method currently does nothing.
-        # Its implementation removes too much:
-        body = self.trimnames(body)
+        # post. This does nothing unless redactRosterNames
+        # is True, b/c some of the names people give are
+        # very common English words:
+        if self.rosterNameMatcher is not None:
+            startTime = time.time()
+            body = self.trimnames(body)
+            self.metrics.record('rosterNameRedaction', time.time() - startTime)
         
         # Update the record instance with the modified body:
         mongoRecordObj['body'] = body
         mongoRecordObj['anon_screen_name'] = anon_screen_name
         
         # Scramble user_int_id to be different, but recoverable from
-        # the true user_int_id:
+        # the true user_int_id. The forum_uid usually comes with the
+        # user cache entry. If the poster is not in the cache, the record
+        # keeps its forum_int_id, and resolveForumUids() converts all such
+        # records of an insert batch with one query:
         try:
             user_int_id = int(mongoRecordObj['forum_int_id'])
-            forum_uid = self.mydb.query('SELECT EdxPrivate.idInt2Forum(%s);' % str(user_int_id)).next()[0]
-            mongoRecordObj['forum_uid'] = forum_uid;
-            del mongoRecordObj['forum_int_id']
+            if forum_uid is None:
+                forum_uid = self.forumUidCache.get(user_int_id)
+            if forum_uid is not None:
+                mongoRecordObj['forum_uid'] = forum_uid;
+                del mongoRecordObj['forum_int_id']
         except KeyError:
             self.logInfo("Expected a value in mongo record field 'forum_int_id', but that field not found.")
-        except IndexError:
-            self.logInfo("In conversion user_int_id to forum_uid via idInt2Forum(), did not obtain expected one-tuple.")
         
         return mongoRecordObj
 
+    def resolveForumUids(self, mongoRecordObjs):
+        '''
+        Set the forum_uid of all given records that still carry
+        a forum_int_id, because their poster was not in the user
+        cache. The user_int_ids are converted in bulk by 
+        lookupForumUids(), and the results are remembered in 
+        self.forumUidCache.
+        
+        :param mongoRecordObjs: anonymized forum records
+        :type mongoRecordObjs: [MongoRecord]
+        '''
+        pendingRecs = [mongoRecordObj for mongoRecordObj in mongoRecordObjs if 'forum_int_id' in mongoRecordObj]
+        if len(pendingRecs) == 0:
+            return
+        unknownIds = set([int(mongoRecordObj['forum_int_id']) for mongoRecordObj in pendingRecs]) - set(self.forumUidCache.keys())
+        self.forumUidCache.update(self.lookupForumUids(unknownIds))
+        for mongoRecordObj in pendingRecs:
+            user_int_id = int(mongoRecordObj['forum_int_id'])
+            try:
+                mongoRecordObj['forum_uid'] = self.forumUidCache[user_int_id]
+                del mongoRecordObj['forum_int_id']
+            except KeyError:
+                self.logInfo("In conversion user_int_id %s to forum_uid via idInt2Forum(), did not obtain a result." % user_int_id)
+
+    def lookupForumUids(self, userIntIds):
+        '''
+        Convert user_int_ids to forum_uids, from the identity cache
+        where possible, else via queryForumUids().
+        
+        :param userIntIds: user_int_ids to convert
+        :type userIntIds: {int}
+        :return: dict mapping each user_int_id to its forum_uid
+        :rtype: {int : String}
+        '''
+        if self.identityCache is None:
+            return self.queryForumUids(userIntIds)
+        return self.identityCache.lookup(EdxForumScrubber.FORUM_UID_FUNCTION,
+                                         EdxForumScrubber.FORUM_UID_FUNCTION_VERSION,
+                                         userIntIds,
+                                         self.queryForumUids)
+
+    def queryForumUids(self, userIntIds):
+        '''
+        Convert user_int_ids to forum_uids via MySQL, using one query
+        per FORUM_UID_LOOKUP_CHUNK_SIZE ids. Each query is of the form
+        SELECT idInt2Forum(id1), idInt2Forum(id2), ...
+        
+        :param userIntIds: user_int_ids to convert
+        :type userIntIds: {int}
+        :return: dict mapping each user_int_id to its forum_uid
+        :rtype: {int : String}
+        '''
+        forumUids = {}
+        userIntIds = list(userIntIds)
+        chunkSize = EdxForumScrubber.FORUM_UID_LOOKUP_CHUNK_SIZE
+        for chunkStart in range(0, len(userIntIds), chunkSize):
+            idChunk = userIntIds[chunkStart:chunkStart + chunkSize]
+            selectList = ','.join(['%s(%d)' % (EdxForumScrubber.FORUM_UID_FUNCTION, user_int_id) for user_int_id in idChunk])
+            try:
+                resultRow = self.mydb.query('SELECT %s;' % selectList).next()
+            except StopIteration:
+                self.logInfo("In conversion of %d user_int_ids to forum_uids via idInt2Forum(), did not obtain a result row." % len(idChunk))
+                continue
+            forumUids.update(zip(idChunk, resultRow))
+        return forumUids
+
     def insert_content_record(self, mysqlDbObj, mysqlTableName, mongoRecordObj):
         '''
         Given all fields of one forum post record, anonymize the post, if self.anonymize is True,
-        and insert the result into EdxForum.contents.
+        and queue the result for insertion into EdxForum.contents. Records are sent
+        to MySQL in batches of self.insertBatchSize rows; see flushInsertBuffer().
         
         :param mysqlDbObj: MySQLDB instance into which to place transformed forum posts (see pymysql_utils)
         :type mysqlDbObj: MySQLDB
@@ -516,6 +1164,23 @@ class EdxForumScrubber(object):
             These instances behave like dicts.
         :type _type: MongoRecord
         '''
+        startTime = time.time()
+        mongoRecordObj = self.prepareRecord(mongoRecordObj)
+        self.metrics.record('prepareRecord', time.time() - startTime)
+        self.queueRecordsForInsert(mysqlDbObj, mysqlTableName, [mongoRecordObj])
+
+    def prepareRecord(self, mongoRecordObj):
+        '''
+        Turn one forum record into what goes into the forum table:
+        clean up the body, rename _id to forum_post_id, and anonymize
+        if self.anonymize is True. Needs no database access, and is
+        therefore safe to run in worker processes.
+        
+        :param mongoRecordObj: a Python object that contains the Forum record fields we export. 
+        :type _type: MongoRecord
+        :return: the prepared record
+        :rtype: MongoRecord
+        '''
 
         # Ensure body is UTF-8 only (again!).
         # I don't know why the encoding we do 
@@ -532,25 +1197,189 @@ class EdxForumScrubber(object):
     
         if self.anonymize:    
             mongoRecordObj = self.anonymizeRecord(mongoRecordObj)
-     
+        else:
+            # The poster column is screen_name, which
+            # holds the poster's name in the clear:
+            mongoRecordObj['screen_name'] = mongoRecordObj.getUserNameClear()
+        return mongoRecordObj
+
+    def queueRecordsForInsert(self, mysqlDbObj, mysqlTableName, mongoRecordObjs):
+        '''
+        Add prepared records to the insert buffer, and send
+        the buffer to MySQL each time it holds a full batch.
+        
+        :param mysqlDbObj: MySQLDB instance into which to place transformed forum posts (see pymysql_utils)
+        :type mysqlDbObj: MySQLDB
+        :param mysqlTableName: Name of table into which records are to be inserted. Ex: 'contents'
+        :type mysqlTalbeName: String
+        :param mongoRecordObjs: prepared records
+        :type mongoRecordObjs: [MongoRecord]
+        '''
+        for mongoRecordObj in mongoRecordObjs:
+            self.insertBuffer.append(mongoRecordObj)
+            if len(self.insertBuffer) >= self.insertBatchSize:
+                self.flushInsertBuffer(mysqlDbObj, mysqlTableName)
+
+    def flushInsertBuffer(self, mysqlDbObj, mysqlTableName):
+        '''
+        Send all records in self.insertBuffer to MySQL as a single
+        multi-row INSERT, whose values are in forum schema column order.
+        The statement is committed as one transaction, together with
+        the checkpoint that records the batch's last post. If MySQL
+        rejects the batch, its records are inserted one by one, so
+        that only the offending records are lost and logged.
+        
+        :param mysqlDbObj: MySQLDB instance into which to place transformed forum posts (see pymysql_utils)
+        :type mysqlDbObj: MySQLDB
+        :param mysqlTableName: Name of table into which records are to be inserted. Ex: 'contents'
+        :type mysqlTalbeName: String
+        '''
+        if len(self.insertBuffer) == 0:
+            return
+        numRecords = len(self.insertBuffer)
+        
+        if self.anonymize:
+            with self.metrics.timed('forumUidResolution', numRecords):
+                self.resolveForumUids(self.insertBuffer)
+        
+        if self.bulkLoad:
+            with self.metrics.timed('spool', numRecords):
+                self.spoolInsertBuffer()
+            self.metrics.maybeWrite()
+            return
+        
+        fullTblName = mysqlDbObj.dbName() + '.' + mysqlTableName
+        cursor = mysqlDbObj.connection.cursor()
+        startTime = time.time()
         try:
-            fullTblName = mysqlDbObj.dbName() + '.' + mysqlTableName
-            self.mydb.insert(fullTblName, mongoRecordObj)            
-            
+            valueTuples = ['(%s)' % mysqlDbObj.ensureSQLTyping(self.schemaOrderedValues(mongoRecordObj))
+                           for mongoRecordObj in self.insertBuffer]
+            cursor.execute(self.insertCmd(fullTblName, valueTuples))
+            if self.checkpointing():
+                cursor.execute(self.checkpointCmd(self.insertBuffer[-1], self.counter + len(self.insertBuffer)))
+            mysqlDbObj.connection.commit()
+            self.counter += len(self.insertBuffer)
+        except MySQLdb.Error as e:
+            mysqlDbObj.connection.rollback()
+            self.logErr("MySql error while inserting batch of %d records after record %d (retrying one by one): %s" % \
+                         (len(self.insertBuffer), self.counter, `e`))
+            for mongoRecordObj in self.insertBuffer:
+                self.insertSingleRecord(mysqlDbObj, fullTblName, mongoRecordObj)
+            if self.checkpointing():
+                mysqlDbObj.execute(self.checkpointCmd(self.insertBuffer[-1], self.counter))
+        finally:
+            cursor.close()
+            self.insertBuffer = []
+            self.metrics.record('insert', time.time() - startTime, numRecords)
+        self.metrics.maybeWrite()
+
+    def spoolInsertBuffer(self):
+        '''
+        Append all records in self.insertBuffer to the bulk load
+        spool file, creating that file on first use.
+        '''
+        if self.spoolFile is None:
+            self.spoolFile = TsvSpoolFile()
+            self.logInfo('Spooling forum records to %s' % self.spoolFile.name)
+        try:
+            for mongoRecordObj in self.insertBuffer:
+                self.spoolFile.writeRow(self.schemaOrderedValues(mongoRecordObj))
+        finally:
+            self.insertBuffer = []
+
+    def loadSpoolFile(self, mysqlDbObj, mysqlTableName):
+        '''
+        Load the spool file into the forum table with one
+        LOAD DATA LOCAL INFILE, and remove the file. As in 
+        pymysql_utils' bulkInsert(), the statement is run
+        through the mysql command line client, because 
+        MySQLDB connections are not opened with local_infile.
+        
+        :param mysqlDbObj: MySQLDB instance into which to place transformed forum posts (see pymysql_utils)
+        :type mysqlDbObj: MySQLDB
+        :param mysqlTableName: Name of table into which records are to be loaded. Ex: 'contents'
+        :type mysqlTalbeName: String
+        '''
+        if self.spoolFile is None:
+            # No records at all:
+            return
+        self.spoolFile.close()
+        fullTblName = mysqlDbObj.dbName() + '.' + mysqlTableName
+        loadCmd = TsvSpoolFile.loadDataCmd(self.spoolFile.name, fullTblName, self.forumSchema.keys(), replace=self.incremental)
+        self.logInfo('Bulk loading %d records into %s' % (self.spoolFile.numRows, fullTblName))
+        startTime = time.time()
+        if len(mysqlDbObj.pwd) > 0:
+            ret = subprocess.call(['mysql', '--local_infile=1', '-u', mysqlDbObj.user, '-p%s' % mysqlDbObj.pwd, '-e', loadCmd])
+        else:
+            ret = subprocess.call(['mysql', '--local_infile=1', '-u', mysqlDbObj.user, '-e', loadCmd])
+        self.metrics.record('bulkLoad', time.time() - startTime, self.spoolFile.numRows)
+        if ret != 0:
+            # Keep the spool file, so the load can be repeated by hand:
+            self.bulkLoadFailed = True
+            self.logErr('Bulk load into %s failed (mysql returned %s); spool file kept: %s' % (fullTblName, ret, self.spoolFile.name))
+        else:
+            self.counter += self.spoolFile.numRows
+            self.spoolFile.remove()
+        self.spoolFile = None
+
+    def insertSingleRecord(self, mysqlDbObj, fullTblName, mongoRecordObj):
+        '''
+        Insert just one forum record. Used when a batch of
+        records was rejected by MySQL.
+        
+        :param mysqlDbObj: MySQLDB instance into which to place transformed forum posts (see pymysql_utils)
+        :type mysqlDbObj: MySQLDB
+        :param fullTblName: db-qualified name of the table into which to insert. Ex: 'EdxForum.contents'
+        :type fullTblName: String
+        :param mongoRecordObj: the forum record to insert
+        :type mongoRecordObj: MongoRecord
+        '''
+        try:
+            if self.incremental:
+                valueTuple = '(%s)' % mysqlDbObj.ensureSQLTyping(self.schemaOrderedValues(mongoRecordObj))
+                mysqlDbObj.execute(self.insertCmd(fullTblName, [valueTuple]))
+            else:
+                mysqlDbObj.insert(fullTblName, OrderedDict(zip(self.forumSchema.keys(), self.schemaOrderedValues(mongoRecordObj))))
         except MySQLdb.Error as e:
             self.logErr("MySql error while inserting record %d: author name %s created_at %s: %s" % \
                          (self.counter, mongoRecordObj.getUserNameClear(), mongoRecordObj['created_at'], `e`))
             self.logErr("   Corresponding column values: %s" % str(mongoRecordObj.items()))
             return
+        self.counter += 1
 
-        self.counter += 1;
-        if(self.counter%100 == 0):
-            #self.logInfo('inserted record %d'%( self.counter))
-            # print '_type,anonymous,anonymous_to_peers,at_position_list,author_id,body,course_id,created_at,votes
-            #print '%d value \n'%(self.counter);
-            pass
+    def insertCmd(self, fullTblName, valueTuples):
+        '''
+        Return the INSERT statement for the given rows. In incremental
+        mode, rows whose forum_post_id is already in the table replace
+        the existing row's values.
+        
+        :param fullTblName: db-qualified name of the table into which to insert. Ex: 'EdxForum.contents'
+        :type fullTblName: String
+        :param valueTuples: one '(val1,val2,...)' string per row, in forum schema column order
+        :type valueTuples: [String]
+        '''
+        colNames = self.forumSchema.keys()
+        insertCmd = 'INSERT INTO %s (%s) VALUES %s' % (fullTblName, ','.join(colNames), ','.join(valueTuples))
+        if self.incremental:
+            insertCmd += ' ON DUPLICATE KEY UPDATE ' + ','.join(['%s=VALUES(%s)' % (colName, colName) for colName in colNames])
+        return insertCmd
+
+    def schemaOrderedValues(self, mongoRecordObj):
+        '''
+        Return the values of the given record in the column
+        order of the forum table. Record fields that are not
+        table columns, such as forum_int_id, are left out.
+        Columns that the record lacks, such as confusion, get
+        their DEFAULT value from the forum schema.
+        
+        :param mongoRecordObj: the forum record
+        :type mongoRecordObj: MongoRecord
+        :return: list of column values
+        :rtype: [<any>]
+        '''
+        return [mongoRecordObj.get(colName, self.columnDefaults.get(colName)) for colName in self.forumSchema.keys()]
 
-    def createForumTable(self, anonymize):
+    def createForumTable(self, anonymize, uniquePostIds=False, keepExisting=False):
         '''
         Create an empty EdxForum.contents table. Requires
         CREATE privileges;
@@ -558,21 +1387,32 @@ class EdxForumScrubber(object):
         :param anonymize: if true, column header for forum poster
             will be 'anon_screen_name', else it will be 'screen_name'
         :type anonymize: Boolean
+        :param uniquePostIds: if true, the table gets a unique key on forum_post_id,
+            which incremental runs need to update posts in place.
+        :type uniquePostIds: Boolean
+        :param keepExisting: if true, the table is only created if it does not
+            exist yet. The forum schema is adjusted either way.
+        :type keepExisting: Boolean
         '''
 
         # Either 'anon_screen_name' or 'screen_name' are removed
         # from the schema, depending on whether we are to anonymize
         # or not:
         if anonymize:
-            del EdxForumScrubber.forumSchema['screen_name']
+            self.forumSchema.pop('screen_name', None)
         else:
-            del EdxForumScrubber.forumSchema['anon_screen_name']
+            self.forumSchema.pop('anon_screen_name', None)
 
         # Construct a MySQL CREATE TABLE command, using the 
-        # forum schema in EdxForumScrubber.forumSchema:        
-        createCmd = "CREATE TABLE contents ("
-        for colName in EdxForumScrubber.forumSchema.keys():
-            createCmd += colName + ' ' + EdxForumScrubber.forumSchema.get(colName) + ','
+        # forum schema in self.forumSchema:        
+        if keepExisting:
+            createCmd = "CREATE TABLE IF NOT EXISTS %s (" % self.forumTableName
+        else:
+            createCmd = "CREATE TABLE %s (" % self.forumTableName
+        for colName in self.forumSchema.keys():
+            createCmd += colName + ' ' + self.forumSchema.get(colName) + ','
+        if uniquePostIds:
+            createCmd += 'UNIQUE KEY forum_post_id (forum_post_id),'
         
         # Remove the trailing comma:
         createCmd = createCmd[:-1]
@@ -594,7 +1434,7 @@ class EdxForumScrubber(object):
         :type mongoObj:
         '''
         
-        for colName in EdxForumScrubber.forumSchema.keys():
+        for colName in self.forumSchema.keys():
             # Default value: empty string:
             mongoObj.setdefault(colName, '')
 
@@ -650,6 +1490,8 @@ class MongoRecord(DictMixin):
         self.nameValueDict = self.makeDict(rawMongoStruct)
         # Get the screen name in the clear:
         self.user_name_clear = rawMongoStruct.get('author_username')
+        # Source file offset behind this record, if known:
+        self.sourceOffset = None
 
     def getUserNameClear(self):
         return self.user_name_clear
@@ -714,6 +1556,49 @@ class MongoRecord(DictMixin):
     def keys(self):
         return self.nameValueDict.keys()
         
+def watermarkValue(mongoForumRec):
+    '''
+    Return the time of the given post's last change, updated_at or
+    else created_at, as a string that sorts chronologically. BSON
+    dates are datetimes; in JSON exports they are already strings 
+    of the form 2013-05-16T04:32:21.022Z.
+    
+    :param mongoForumRec: post as read from MongoDB or the .bson file
+    :type mongoForumRec: dict
+    :rtype: String
+    '''
+    changeTime = mongoForumRec.get('updated_at', mongoForumRec.get('created_at'))
+    if changeTime is None:
+        return ''
+    if isinstance(changeTime, datetime):
+        return changeTime.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (changeTime.microsecond / 1000)
+    return str(changeTime)
+
+# Scrubber used by worker processes of prepareRecordsInWorkers().
+# Set before the pool is forked, so workers inherit it:
+workerScrubber = None
+
+def prepareRecordBatch(mongoRecordObjs):
+    '''
+    Worker process side of EdxForumScrubber.prepareRecordsInWorkers():
+    prepare (i.e. anonymize) a batch of records.
+    Each batch is timed with fresh StageMetrics, whose totals
+    and samples go back to the parent along with the records.
+    
+    :param mongoRecordObjs: records as produced by EdxForumScrubber.mongoRecords()
+    :type mongoRecordObjs: [MongoRecord]
+    :return: prepared records, in the same order, and the (totals, samples)
+        of the batch's metrics
+    :rtype: ([MongoRecord], ({String : list}, {String : [float]}))
+    '''
+    workerScrubber.metrics = metrics = StageMetrics()
+    preparedRecs = []
+    for mongoRecordObj in mongoRecordObjs:
+        startTime = time.time()
+        preparedRecs.append(workerScrubber.prepareRecord(mongoRecordObj))
+        metrics.record('prepareRecord', time.time() - startTime)
+    return (preparedRecs, (metrics.totals, metrics.samples))
+
 #        ObjectId("519461545924670200000005")
 #    ],
 """collectionObject=collection.find_one();
@@ -742,6 +1627,113 @@ if __name__ == '__main__':
                         action='store_true',
                         default=False
                         );
+    parser.add_argument('-d', '--direct', 
+                        help='decode the .bson file directly, instead of first loading it\n' +
+                             'into a temporary MongoDB via mongorestore. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('-b', '--batchSize', 
+                        help='number of forum rows sent to MySQL with each INSERT statement. Default: %d' % \
+                             EdxForumScrubber.DEFAULT_INSERT_BATCH_SIZE,
+                        type=int,
+                        default=EdxForumScrubber.DEFAULT_INSERT_BATCH_SIZE
+                        );
+    parser.add_argument('--bulk-load', 
+                        help='write the records to a spool file, and load that file into MySQL\n' +
+                             'with a single LOAD DATA LOCAL INFILE. Default: False',
+                        dest='bulkLoad',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('-w', '--workers', 
+                        help='number of processes that anonymize posts in parallel. Default: 1',
+                        type=int,
+                        default=1
+                        );
+    parser.add_argument('--unordered', 
+                        help='with --workers > 1, insert posts in the order in which workers finish them,\n' +
+                             'rather than in the order in which they were read. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--pipelined', 
+                        help='read posts, prepare them, and insert them in overlapping threads. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--maxInFlight', 
+                        help='with --pipelined, maximum number of posts between reading and inserting. Default: %d' % \
+                             EdxForumScrubber.DEFAULT_MAX_IN_FLIGHT,
+                        type=int,
+                        default=EdxForumScrubber.DEFAULT_MAX_IN_FLIGHT
+                        );
+    parser.add_argument('--nameCacheSize', 
+                        help='number of posters whose compiled name redaction patterns are cached. Default: %d' % \
+                             PosterRedactorCache.DEFAULT_MAX_POSTERS,
+                        type=int,
+                        default=PosterRedactorCache.DEFAULT_MAX_POSTERS
+                        );
+    parser.add_argument('--rosterNames', 
+                        help='with -a, also redact the first names of everyone in the class\n' +
+                             'from all posts; only capitalized whole words are redacted. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('-i', '--incremental', 
+                        help='keep the forum table, and only load posts created or updated since\n' +
+                             'the previous incremental run; they replace their old versions. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--resume', 
+                        help='if the previous run on the forum table died, keep the posts it\n' +
+                             'committed, and continue just after the last of them. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('-p', '--postersOnly', 
+                        help='scan the posts for their authors first, and only load those users\n' +
+                             'into the user cache, instead of everyone in UserGrade. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--userCacheSnapshot', 
+                        help='file in which to keep a snapshot of the user cache; later runs map it\n' +
+                             'instead of querying UserGrade, until UserGrade changes. Default: none',
+                        default=None
+                        );
+    parser.add_argument('--identityCache', 
+                        help='SQLite file that keeps forum_uids across runs; shared with the Piazza\n' +
+                             'importer. Only user_int_ids it lacks are sent to idInt2Forum(). Default: none',
+                        default=None
+                        );
+    parser.add_argument('--metrics', 
+                        help='write per-stage records/s and p50/p99 latencies to this JSON file,\n' +
+                             'every --metricsInterval seconds and at the end. Default: none',
+                        default=None
+                        );
+    parser.add_argument('--prometheus', 
+                        help='also write the stage metrics to this Prometheus textfile collector\n' +
+                             'file (name must end in .prom). Default: none',
+                        default=None
+                        );
+    parser.add_argument('--metricsInterval', 
+                        help='seconds between periodic writes of the metrics files. Default: %d' % \
+                             StageMetrics.DEFAULT_WRITE_INTERVAL,
+                        type=float,
+                        default=StageMetrics.DEFAULT_WRITE_INTERVAL
+                        );
+    parser.add_argument('--profile', 
+                        help='profile the conversion: sample (low overhead) or cprofile (exact call counts).\n' +
+                             'Writes <profileOutput>.pstats and <profileOutput>.collapsed (for flamegraphs). Default: off',
+                        choices=EtlProfiler.MODES,
+                        default=None
+                        );
+    parser.add_argument('--profileOutput', 
+                        help='path prefix of the --profile output files. Default: ./forum_etl_profile',
+                        default='forum_etl_profile'
+                        );
     parser.add_argument('bson_filename',
                         help='Full path to MongoDB dump of Forum in .bson format.',
                         ) 
@@ -751,5 +1743,27 @@ if __name__ == '__main__':
 #     print('Anonymize: %s. Relatable: %s. File: %s' % (args.anonymize, args.relatable, args.bson_filename))
 #     sys.exit(0)
 
-    extractor = EdxForumScrubber(args.bson_filename, allowAnonScreenName=args.relatable)
-    extractor.runConversion()
+    extractor = EdxForumScrubber(args.bson_filename, 
+                                 allowAnonScreenName=args.relatable,
+                                 directBsonRead=args.direct,
+                                 insertBatchSize=args.batchSize,
+                                 bulkLoad=args.bulkLoad,
+                                 numWorkers=args.workers,
+                                 orderedWorkers=not args.unordered,
+                                 nameCacheSize=args.nameCacheSize,
+                                 redactRosterNames=args.rosterNames,
+                                 incremental=args.incremental,
+                                 resume=args.resume,
+                                 loadPostersOnly=args.postersOnly,
+                                 userCacheSnapshot=args.userCacheSnapshot,
+                                 identityCacheFile=args.identityCache,
+                                 metricsFile=args.metrics,
+                                 prometheusFile=args.prometheus,
+                                 metricsInterval=args.metricsInterval,
+                                 pipelined=args.pipelined,
+                                 maxInFlight=args.maxInFlight)
+    if args.profile is None:
+        extractor.runConversion()
+    else:
+        with EtlProfiler(args.profileOutput, mode=args.profile):
+            extractor.runConversion()
@@ -0,0 +1,196 @@
+'''
+Persistent cache of the identity mappings that the ETLs obtain
+from MySQL functions: the forum extractor's user_int_id --> forum_uid
+(EdxPrivate.idInt2Forum()), and the Piazza importer's LTI uid -->
+user_int_id (Edx.idAnon2Int(idExt2Anon())). The mappings are
+deterministic, so a nightly rerun over the same courses would
+otherwise ask MySQL the same questions again.
+
+IdentityCache keeps the mappings in an SQLite file that both
+importers can share. Entries are keyed by
+
+    - a namespace: the mapping, such as 'EdxPrivate.idInt2Forum',
+    - the key, as text,
+    - the version of the mapping function that produced the value.
+
+When a mapping function changes, for instance because its salt
+does, the consumer bumps its version constant; the entries of
+older versions are then no longer found, and are eventually
+replaced by fresh ones.
+
+lookup() answers from the file what it can, and hands only the
+misses, in one call, to the consumer's bulk MySQL query. The
+values found are stored for later runs. Keys that MySQL does not
+map are not stored, so that they are asked again next time, when
+the user may exist. prefill() loads many entries at once, such as
+a dump of the mapping made with MySQL.
+
+The SQLite connection is opened on first use, so that processes
+forked before then do not share it. One IdentityCache may be used
+by several threads.
+
+Usage, to prefill from a tab separated file of key/value lines:
+
+    identity_cache.py --prefill EdxPrivate.idInt2Forum 1 forumUids.tsv cache.sqlite
+'''
+
+import argparse
+import sqlite3
+import sys
+import threading
+
+
+# Keys per SELECT; SQLite allows at most 999 parameters:
+LOOKUP_CHUNK_SIZE = 500
+# Entries per transaction when storing:
+STORE_CHUNK_SIZE = 10000
+
+
+class IdentityCache(object):
+    '''
+    On-disk cache of (namespace, key, version) --> value.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: SQLite file; created if it does not exist
+        :type path: String
+        '''
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+        # Hits and misses of lookup(), for the logs:
+        self.numHits = 0
+        self.numMisses = 0
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.text_factory = str
+            self.connection.execute('CREATE TABLE IF NOT EXISTS Identities ' +
+                                    '(namespace TEXT NOT NULL, key TEXT NOT NULL, version TEXT NOT NULL, value, ' +
+                                    'PRIMARY KEY (namespace, key, version))')
+            self.connection.commit()
+        return self.connection
+
+    def getMany(self, namespace, version, keys):
+        '''
+        Return the cached values of the given keys.
+
+        :param namespace: name of the mapping
+        :type namespace: String
+        :param version: version of the mapping function
+        :type version: String
+        :param keys: keys to look up
+        :type keys: iterable
+        :return: dict mapping each key that was found to its value
+        :rtype: dict
+        '''
+        keysByText = dict([(keyText(key), key) for key in keys])
+        keyTexts = keysByText.keys()
+        values = {}
+        with self.lock:
+            connection = self.connect()
+            for chunkStart in range(0, len(keyTexts), LOOKUP_CHUNK_SIZE):
+                textChunk = keyTexts[chunkStart:chunkStart + LOOKUP_CHUNK_SIZE]
+                query = 'SELECT key, value FROM Identities WHERE namespace = ? AND version = ? AND key IN (%s)' % \
+                        ','.join(['?'] * len(textChunk))
+                for (key, value) in connection.execute(query, [namespace, version] + textChunk):
+                    values[keysByText[key]] = value
+        return values
+
+    def putMany(self, namespace, version, keyValuePairs):
+        '''
+        Store the given entries, replacing entries of the same
+        keys and version.
+
+        :param namespace: name of the mapping
+        :type namespace: String
+        :param version: version of the mapping function
+        :type version: String
+        :param keyValuePairs: entries to store
+        :type keyValuePairs: iterable of (key, value)
+        :return: number of entries stored
+        :rtype: int
+        '''
+        numStored = 0
+        rows = []
+        with self.lock:
+            connection = self.connect()
+            for (key, value) in keyValuePairs:
+                rows.append((namespace, keyText(key), version, value))
+                if len(rows) >= STORE_CHUNK_SIZE:
+                    numStored += self.storeRows(connection, rows)
+                    rows = []
+            numStored += self.storeRows(connection, rows)
+        return numStored
+
+    # Bulk loading is storing:
+    prefill = putMany
+
+    def storeRows(self, connection, rows):
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO Identities (namespace, key, version, value) VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def lookup(self, namespace, version, keys, queryMisses):
+        '''
+        Return the values of the given keys, from the cache where
+        possible. The misses are passed to queryMisses() in one call;
+        the values it finds are stored.
+
+        :param namespace: name of the mapping
+        :type namespace: String
+        :param version: version of the mapping function
+        :type version: String
+        :param keys: keys to look up
+        :type keys: iterable
+        :param queryMisses: function that takes a list of keys, and returns
+            a dict of their values, in which a value may be None
+        :type queryMisses: callable
+        :return: dict mapping keys to values; as queryMisses() would return it
+        :rtype: dict
+        '''
+        keys = set(keys)
+        values = self.getMany(namespace, version, keys)
+        misses = [key for key in keys if key not in values]
+        self.numHits += len(values)
+        self.numMisses += len(misses)
+        if len(misses) > 0:
+            missValues = queryMisses(misses)
+            self.putMany(namespace, version, [(key, value) for (key, value) in missValues.items() if value is not None])
+            values.update(missValues)
+        return values
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+def keyText(key):
+    '''
+    Keys are stored as text: int user_int_ids and string LTI
+    uids alike.
+    '''
+    if isinstance(key, unicode):
+        return key.encode('UTF-8')
+    return str(key)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument('--prefill',
+                        help='load entries of mapping NAMESPACE, produced by mapping function version VERSION,\n' +
+                             'from TSVFILE, which holds one tab separated key and value per line',
+                        nargs=3,
+                        metavar=('NAMESPACE', 'VERSION', 'TSVFILE'),
+                        required=True)
+    parser.add_argument('cacheFile', help='SQLite file of the identity cache')
+    args = parser.parse_args()
+    (namespace, version, tsvFileName) = args.prefill
+    identityCache = IdentityCache(args.cacheFile)
+    with open(tsvFileName) as tsvFile:
+        numStored = identityCache.prefill(namespace, version,
+                                          (line.rstrip('\r\n').split('\t', 1) for line in tsvFile if '\t' in line))
+    identityCache.close()
+    print('Stored %d entries of %s version %s in %s' % (numStored, namespace, version, args.cacheFile))
@@ -0,0 +1,160 @@
+'''
+Spool file support for loading forum rows into MySQL with
+LOAD DATA LOCAL INFILE.
+
+Values destined for the INSERT path are prepared as MySQL string
+literals: pymysql_utils.ensureSQLTyping() wraps them in double
+quotes, and MongoRecord.makeDict() backslash-escapes embedded double
+quotes in post bodies. The server removes that escaping when it
+parses the literal. LOAD DATA does not parse literals, so values
+are first unescaped the way the server would have done it, and then
+escaped for LOAD DATA's default field format (tab separated,
+backslash escapes, \N for NULL). Rows loaded from a spool file are
+thereby identical to rows inserted with INSERT statements.
+'''
+
+import os
+import re
+import tempfile
+
+
+# Escape sequences MySQL recognizes inside string literals.
+# \% and \_ keep their backslash; any other escaped character
+# stands for itself:
+SQL_LITERAL_ESCAPES = {'0'  : '\0',
+                       "'"  : "'",
+                       '"'  : '"',
+                       'b'  : '\b',
+                       'n'  : '\n',
+                       'r'  : '\r',
+                       't'  : '\t',
+                       'Z'  : '\x1a',
+                       '\\' : '\\',
+                       '%'  : '\\%',
+                       '_'  : '\\_'
+                       }
+SQL_LITERAL_ESCAPE_PATTERN = re.compile(r'\\(.)', re.DOTALL)
+
+# Characters that must be escaped in LOAD DATA fields with
+# FIELDS TERMINATED BY '\t' ESCAPED BY '\\' LINES TERMINATED BY '\n':
+TSV_ESCAPES = {'\\' : '\\\\',
+               '\t' : '\\t',
+               '\n' : '\\n',
+               '\r' : '\\r',
+               '\0' : '\\0'
+               }
+TSV_ESCAPE_PATTERN = re.compile(r'[\\\t\n\r\0]')
+
+TSV_NULL = '\\N'
+
+def sqlLiteralUnescape(value):
+    '''
+    Return the string MySQL stores when it parses
+    the given value as the body of a string literal.
+
+    :param value: content of a string literal, without the enclosing quotes
+    :type value: {str | unicode}
+    :return: value with MySQL escape sequences resolved
+    :rtype: {str | unicode}
+    '''
+    if '\\' not in value:
+        return value
+    return SQL_LITERAL_ESCAPE_PATTERN.sub(lambda match: SQL_LITERAL_ESCAPES.get(match.group(1), match.group(1)), value)
+
+def tsvEscape(value):
+    '''
+    Escape a string for one field of a LOAD DATA file in
+    MySQL's default field format.
+
+    :param value: string to escape
+    :type value: {str | unicode}
+    :return: escaped string
+    :rtype: {str | unicode}
+    '''
+    return TSV_ESCAPE_PATTERN.sub(lambda match: TSV_ESCAPES[match.group(0)], value)
+
+def tsvField(value):
+    '''
+    Turn one column value into a UTF-8 encoded LOAD DATA field that
+    loads into the same cell content as pymysql_utils.ensureSQLTyping()
+    would have produced for an INSERT statement.
+
+    :param value: column value
+    :type value: <any>
+    :return: UTF-8 encoded field
+    :rtype: str
+    '''
+    if value is None:
+        return TSV_NULL
+    if isinstance(value, basestring):
+        try:
+            # If value is not already Unicode, decode it:
+            value = unicode(value, 'UTF-8', 'replace')
+        except TypeError:
+            # Value was already in Unicode:
+            pass
+        value = sqlLiteralUnescape(value)
+    elif isinstance(value, (list, dict, set)):
+        value = sqlLiteralUnescape(unicode(str(value), 'UTF-8', 'replace'))
+    else: # e.g. numbers
+        value = unicode(value)
+    return tsvEscape(value).encode('UTF-8')
+
+
+class TsvSpoolFile(object):
+    '''
+    Temporary file to which rows are appended in LOAD DATA
+    format. The file survives close(), so that MySQL can
+    read it; call remove() once it has been loaded.
+    '''
+
+    def __init__(self, spoolDir=None):
+        '''
+        :param spoolDir: directory for the spool file. None: system temp dir.
+        :type spoolDir: String
+        '''
+        self.spoolFd = tempfile.NamedTemporaryFile(dir=spoolDir, prefix='forumSpool', suffix='.tsv', delete=False)
+        self.name = self.spoolFd.name
+        self.numRows = 0
+
+    def writeRow(self, values):
+        '''
+        Append one row.
+
+        :param values: column values in table column order
+        :type values: [<any>]
+        '''
+        self.spoolFd.write('\t'.join([tsvField(value) for value in values]) + '\n')
+        self.numRows += 1
+
+    def close(self):
+        self.spoolFd.close()
+
+    def remove(self):
+        '''
+        Close and delete the spool file.
+        '''
+        self.close()
+        try:
+            os.remove(self.name)
+        except OSError:
+            pass
+
+    @classmethod
+    def loadDataCmd(cls, spoolFileName, fullTblName, colNames, replace=False):
+        '''
+        Return the LOAD DATA LOCAL INFILE statement that loads
+        a spool file into the given table.
+
+        :param spoolFileName: path to the spool file
+        :type spoolFileName: String
+        :param fullTblName: db-qualified table name. Ex: 'EdxForum.contents'
+        :type fullTblName: String
+        :param colNames: table columns in the order of the spool file fields
+        :type colNames: [String]
+        :param replace: if True, rows replace existing rows with the same unique key
+        :type replace: Boolean
+        '''
+        return ("LOAD DATA LOCAL INFILE '%s' %sINTO TABLE %s CHARACTER SET utf8 " +\
+                "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (%s);") %\
+                (spoolFileName, 'REPLACE ' if replace else '', fullTblName, ','.join(colNames))
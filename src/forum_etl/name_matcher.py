@@ -0,0 +1,205 @@
+'''
+Finds the names of a class roster in forum post bodies with an
+Aho-Corasick automaton. The automaton is built once from all
+roster names; a body is then scanned in one pass, in time linear
+in the body length plus the number of candidate hits, however
+many names the roster holds.
+
+Names are matched regardless of case. Whether a candidate hit is
+redacted is decided at match time: it must be a whole word, i.e.
+neither preceded nor followed by a letter, digit, or underscore,
+and its first character in the body (decoded from UTF-8 if it is
+not ASCII) must be upper case, so that roster names that are also
+common English words ('Will', 'Rose') are left alone when used as
+words in mid-sentence.
+'''
+
+from array import array
+from collections import deque
+
+
+class RosterNameMatcher(object):
+    '''
+    Aho-Corasick automaton over the UTF-8 encoded, lower-cased
+    roster names. Transitions are kept in one dict keyed by
+    (state << 8) | byte, which is far more compact for 100k+ names
+    than one dict per state.
+    '''
+
+    def __init__(self, names=(), minNameLength=2):
+        '''
+        :param names: roster names, such as the posters' first names
+        :type names: [{str | unicode}]
+        :param minNameLength: names shorter than this are ignored
+        :type minNameLength: int
+        '''
+        self.minNameLength = minNameLength
+        # State 0 is the root:
+        self.goto = {}
+        self.numStates = 1
+        # Per state: length of the name that ends in this state, or 0:
+        self.nameLen = array('i', [0])
+        self.numNames = 0
+        for name in names:
+            self.addName(name)
+        self.buildFailureLinks()
+
+    def addName(self, name):
+        '''
+        Add one name to the trie. Only to be called before
+        buildFailureLinks(), i.e. from __init__().
+        '''
+        if isinstance(name, unicode):
+            name = name.encode('UTF-8', 'replace')
+        if len(name) < self.minNameLength:
+            return
+        state = 0
+        for byte in name.lower():
+            key = (state << 8) | ord(byte)
+            nextState = self.goto.get(key)
+            if nextState is None:
+                nextState = self.numStates
+                self.goto[key] = nextState
+                self.nameLen.append(0)
+                self.numStates += 1
+            state = nextState
+        if self.nameLen[state] == 0:
+            self.numNames += 1
+        self.nameLen[state] = len(name)
+
+    def buildFailureLinks(self):
+        '''
+        Compute, breadth first, each state's failure link (the state
+        of the longest proper suffix that is a trie path), and its
+        output link (the nearest state along the failure links at
+        which a name ends).
+        '''
+        self.fail = array('i', [0]) * self.numStates
+        self.outLink = array('i', [-1]) * self.numStates
+        children = [[] for _ in xrange(self.numStates)]
+        for key, childState in self.goto.iteritems():
+            children[key >> 8].append((key & 0xFF, childState))
+        queue = deque([childState for _, childState in children[0]])
+        while len(queue) > 0:
+            state = queue.popleft()
+            for byte, childState in children[state]:
+                failState = self.fail[state]
+                while failState != 0 and ((failState << 8) | byte) not in self.goto:
+                    failState = self.fail[failState]
+                self.fail[childState] = self.goto.get((failState << 8) | byte, 0)
+                failTarget = self.fail[childState]
+                if self.nameLen[failTarget] > 0:
+                    self.outLink[childState] = failTarget
+                else:
+                    self.outLink[childState] = self.outLink[failTarget]
+                queue.append(childState)
+
+    def findNames(self, body):
+        '''
+        Return the (start, end) offsets of the roster names in body that
+        pass the word boundary and capitalization rules. Where hits overlap,
+        the leftmost, and then the longest wins.
+
+        :param body: forum post
+        :type body: str
+        :return: non-overlapping hits in body order
+        :rtype: [(int, int)]
+        '''
+        if self.numNames == 0:
+            return []
+        goto = self.goto
+        fail = self.fail
+        nameLen = self.nameLen
+        outLink = self.outLink
+        candidates = []
+        state = 0
+        for pos, byte in enumerate(body.lower()):
+            byte = ord(byte)
+            while True:
+                nextState = goto.get((state << 8) | byte)
+                if nextState is not None or state == 0:
+                    break
+                state = fail[state]
+            state = nextState if nextState is not None else 0
+            hitState = state if nameLen[state] > 0 else outLink[state]
+            while hitState > 0:
+                start = pos + 1 - nameLen[hitState]
+                if self.acceptHit(body, start, pos + 1):
+                    candidates.append((start, pos + 1))
+                hitState = outLink[hitState]
+
+        # Leftmost, then longest first:
+        candidates.sort(key=lambda hit: (hit[0], -hit[1]))
+        hits = []
+        end = 0
+        for hit in candidates:
+            if hit[0] >= end:
+                hits.append(hit)
+                end = hit[1]
+        return hits
+
+    def acceptHit(self, body, start, end):
+        '''
+        Apply the match time rules to a candidate hit body[start:end].
+        '''
+        if not startsUpperCase(body, start):
+            return False
+        if start > 0 and isWordByte(body[start - 1]):
+            return False
+        if end < len(body) and isWordByte(body[end]):
+            return False
+        return True
+
+    def redact(self, body, nameToken='<nameRedac>'):
+        '''
+        Replace all roster names in body by nameToken.
+
+        :param body: forum post
+        :type body: str
+        :param nameToken: replacement for each name
+        :type nameToken: str
+        :return: redacted body
+        :rtype: str
+        '''
+        hits = self.findNames(body)
+        if len(hits) == 0:
+            return body
+        pieces = []
+        prevEnd = 0
+        for start, end in hits:
+            pieces.append(body[prevEnd:start])
+            pieces.append(nameToken)
+            prevEnd = end
+        pieces.append(body[prevEnd:])
+        return ''.join(pieces)
+
+    def __len__(self):
+        return self.numNames
+
+def startsUpperCase(body, start):
+    '''
+    True if the character that starts at body[start] is upper
+    case. Non-ASCII characters are decoded from their UTF-8 bytes
+    for the test, so that names that start with an accented
+    capital letter count as capitalized.
+    '''
+    leadByte = body[start]
+    if leadByte < '\x80':
+        return leadByte.isupper()
+    if leadByte >= '\xf0':
+        charLen = 4
+    elif leadByte >= '\xe0':
+        charLen = 3
+    else:
+        charLen = 2
+    try:
+        return body[start:start + charLen].decode('UTF-8').isupper()
+    except UnicodeDecodeError:
+        return False
+
+def isWordByte(byte):
+    '''
+    True for letters, digits, and underscore, and for the bytes
+    of non-ASCII UTF-8 characters, which are taken to be letters.
+    '''
+    return byte.isalnum() or byte == '_' or byte >= '\x80'
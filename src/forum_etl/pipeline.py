@@ -0,0 +1,236 @@
+'''
+Threads that overlap the stages of an ETL run.
+
+BackgroundIterator runs a producer, such as the generator that reads
+and decodes posts, in a thread of its own, and hands its items to the
+consumer through a bounded queue. BackgroundConsumer runs a consumer
+function, such as the one that sends records to MySQL, in a thread of
+its own, fed through a bounded queue. Between them, the calling thread
+does the CPU bound work. While one stage waits for the network (Mongo
+cursor, MySQL socket) or the disk, the others keep working, since
+those waits release the GIL.
+
+The queues bound the number of items in flight: a producer that gets
+ahead blocks until the consumer catches up, so memory use does not
+grow with the size of the input. Items cross between threads in
+chunks of CHUNK_SIZE, since handing them over one by one costs more
+in locking and thread switches than a cheap stage does per item.
+
+An exception in a background thread is raised again in the calling
+thread, at its next interaction with the pipeline. If the calling
+thread gives up, close() makes the background threads stop.
+
+Both threads start on first use, not when constructed, so that
+processes forked in between (e.g. a multiprocessing.Pool) do not
+inherit running threads.
+'''
+
+import Queue
+import sys
+import threading
+
+
+# How long a blocked put or get waits before checking
+# whether the other side has gone away:
+POLL_SECONDS = 0.5
+# Items handed from one thread to the other at a time:
+CHUNK_SIZE = 50
+
+
+class PipelineStopped(Exception):
+    '''
+    Raised in a background thread when the pipeline was closed.
+    '''
+    pass
+
+
+class StageFailure(object):
+    '''
+    End marker carrying the exception of a failed background thread.
+    '''
+    def __init__(self, excInfo):
+        self.excInfo = excInfo
+
+    def reraise(self):
+        raise self.excInfo[0], self.excInfo[1], self.excInfo[2]
+
+# End marker of a stage that finished normally:
+END_OF_STAGE = object()
+
+
+class BackgroundIterator(object):
+    '''
+    Iterates over an iterable in a background thread, and
+    yields its items in the calling thread.
+    '''
+
+    def __init__(self, iterable, maxItems, threadName='pipelineReader'):
+        '''
+        :param iterable: source of items; only ever touched by the background thread
+        :type iterable: iterable
+        :param maxItems: number of items the background thread may get ahead by
+        :type maxItems: int
+        :param threadName: name of the background thread, for logs and debuggers
+        :type threadName: String
+        '''
+        self.iterable = iterable
+        self.chunkSize = max(1, min(CHUNK_SIZE, maxItems // 2))
+        self.queue = Queue.Queue(max(1, maxItems // self.chunkSize))
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.produce, name=threadName)
+        self.thread.daemon = True
+
+    def produce(self):
+        chunk = []
+        try:
+            for item in self.iterable:
+                chunk.append(item)
+                if len(chunk) >= self.chunkSize:
+                    self.put(chunk)
+                    chunk = []
+            if len(chunk) > 0:
+                self.put(chunk)
+            self.put(END_OF_STAGE)
+        except PipelineStopped:
+            pass
+        except:
+            # Items read before the failure still go through:
+            failure = StageFailure(sys.exc_info())
+            try:
+                if len(chunk) > 0:
+                    self.put(chunk)
+                self.put(failure)
+            except PipelineStopped:
+                pass
+
+    def put(self, item):
+        while True:
+            if self.stopEvent.is_set():
+                raise PipelineStopped()
+            try:
+                self.queue.put(item, True, POLL_SECONDS)
+                return
+            except Queue.Full:
+                pass
+
+    def __iter__(self):
+        if self.thread.ident is None:
+            self.thread.start()
+        while True:
+            chunk = self.queue.get()
+            if chunk is END_OF_STAGE:
+                return
+            if isinstance(chunk, StageFailure):
+                chunk.reraise()
+            for item in chunk:
+                yield item
+
+    def close(self):
+        '''
+        Make the background thread stop, and wait for it.
+        '''
+        self.stopEvent.set()
+        if self.thread.ident is not None:
+            self.thread.join()
+
+
+class BackgroundConsumer(object):
+    '''
+    Calls a function on each item put(), in a background thread.
+    '''
+
+    def __init__(self, consume, maxItems, threadName='pipelineWriter'):
+        '''
+        :param consume: function of one item; only ever called by the background thread
+        :type consume: callable
+        :param maxItems: number of items put() may get ahead of consume() by
+        :type maxItems: int
+        :param threadName: name of the background thread, for logs and debuggers
+        :type threadName: String
+        '''
+        self.consume = consume
+        self.chunkSize = max(1, min(CHUNK_SIZE, maxItems // 2))
+        self.queue = Queue.Queue(max(1, maxItems // self.chunkSize))
+        # Items put() since the last chunk was queued:
+        self.chunk = []
+        self.failure = None
+        self.thread = threading.Thread(target=self.run, name=threadName)
+        self.thread.daemon = True
+
+    def run(self):
+        try:
+            while True:
+                chunk = self.queue.get()
+                if chunk is END_OF_STAGE:
+                    return
+                for item in chunk:
+                    self.consume(item)
+        except:
+            self.failure = StageFailure(sys.exc_info())
+
+    def put(self, item):
+        '''
+        Queue an item for consume(); blocks while the queue is full.
+        Raises the exception of consume(), if it failed.
+        '''
+        self.chunk.append(item)
+        if len(self.chunk) >= self.chunkSize:
+            self.queueChunk()
+
+    def queueChunk(self):
+        chunk = self.chunk
+        self.chunk = []
+        self.enqueue(chunk)
+
+    def enqueue(self, chunk):
+        if self.thread.ident is None:
+            self.thread.start()
+        while True:
+            # The thread records its failure before it ends; look
+            # at it after is_alive(), so that a failure between the
+            # two checks is not reported as a mere stop:
+            isAlive = self.thread.is_alive()
+            if self.failure is not None:
+                self.failure.reraise()
+            if not isAlive:
+                raise PipelineStopped('Consumer thread %s is no longer running.' % self.thread.name)
+            try:
+                self.queue.put(chunk, True, POLL_SECONDS)
+                return
+            except Queue.Full:
+                pass
+
+    def finish(self):
+        '''
+        Wait until all queued items are consumed. Raises the
+        exception of consume(), if it failed.
+        '''
+        if len(self.chunk) > 0:
+            self.queueChunk()
+        if self.thread.ident is None:
+            return
+        if self.thread.is_alive():
+            self.enqueue(END_OF_STAGE)
+            self.thread.join()
+        if self.failure is not None:
+            self.failure.reraise()
+
+    def close(self):
+        '''
+        Make the background thread stop after the item it is
+        consuming, dropping the queued items, and wait for it.
+        '''
+        self.chunk = []
+        if self.thread.ident is None:
+            return
+        while self.thread.is_alive():
+            try:
+                while True:
+                    self.queue.get_nowait()
+            except Queue.Empty:
+                pass
+            try:
+                self.queue.put(END_OF_STAGE, True, POLL_SECONDS)
+            except Queue.Full:
+                continue
+            self.thread.join()
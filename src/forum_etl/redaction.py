@@ -0,0 +1,357 @@
+'''
+Detectors that redact personal information from forum post bodies.
+
+The email detector recognizes the same addresses as the original
+EdxForumScrubber.emailPattern: a run of letters, digits, dots,
+hyphens, or opening parentheses that starts after whitespace,
+followed by '@', a run of letters, digits, and dots, any one
+character, and 'edu' or 'com'.
+
+The original pattern wrapped the address in leading and trailing
+(.*) groups. Applied with match() and findall() that made the regex
+engine retry every whitespace position against the rest of the line,
+which takes time quadratic in the line length. Here the address
+itself is the pattern. An address may only start at the beginning
+of the body or right after whitespace, and none of its character
+runs can contain whitespace or a second '@'. Each character of a
+body is therefore examined a bounded number of times, and a body is
+scanned in one left-to-right pass.
+
+redactBody() combines the email, phone number, and zipcode detectors
+into one compiled scanner, so that each body is scanned once instead
+of once per detector. These scanners are compiled once per process
+and shared by all posters. Poster names go into a small scanner of
+their own, and subEither() interleaves the matches of both as a
+single alternation would. Cheap prefilters leave out the detectors
+that cannot match: no digit in the body means no phone or zipcode
+scan, no '@' means no email scan, and poster names are only scanned
+for if they occur in the body at all. A PosterRedactorCache keeps
+each recent poster's name scanner compiled across that poster's
+posts; it costs a few kilobytes per poster.
+'''
+
+from collections import OrderedDict
+import re
+
+
+EMAIL_REDACTION_TOKEN = '<emailRedac>'
+PHONE_REDACTION_TOKEN = '<phoneRedac>'
+ZIP_REDACTION_TOKEN   = '<zipRedac>'
+
+# The optional leading whitespace character and all trailing
+# whitespace up to the end of the line are consumed, so that the
+# address and its surrounding whitespace turn into ' <emailRedac> ',
+# as they did with the original pattern. The (?<!\S) lets an address
+# start at the beginning of the body, or after whitespace that a
+# preceding match already consumed:
+EMAIL_PATTERN = r'[^\S\n]?(?<!\S)[a-zA-Z0-9\(\.\-]+@[a-zA-Z0-9\.]+[^\n](?:edu|com)[^\S\n]*'
+compiledEmailPattern = re.compile(EMAIL_PATTERN)
+
+def redactEmails(body):
+    '''
+    Replace every email address in the given post body by
+    <emailRedac>. As with the original EdxForumScrubber.emailPattern
+    the result begins with a space if any address was found. Unlike
+    the original, text on lines without an address, and text between
+    several addresses on one line, is kept.
+
+    :param body: forum post
+    :type body: {str | unicode}
+    :return: body with email addresses replaced by <emailRedac>
+    :rtype: {str | unicode}
+    '''
+    # Quick exit for the great majority of posts:
+    if '@' not in body:
+        return body
+    (body, numRedactions) = compiledEmailPattern.subn(' %s ' % EMAIL_REDACTION_TOKEN, body)
+    if numRedactions > 0:
+        body = ' ' + body
+    return body
+
+# US phone numbers, with optional country code, area code, and
+# extension (from stackoverflow, via the original prune_numbers()):
+PHONE_PATTERN = r'(?:(?:\+?1\s*(?:[.-]\s*)?)?(?:\(\s*(?:[2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9])\s*\)|(?:[2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9]))\s*(?:[.-]\s*)?)?(?:[2-9]1[02-9]|[2-9][02-9]1|[2-9][02-9]{2})\s*(?:[.-]\s*)?[0-9]{4}(?:\s*(?:#|x\.?|ext\.?|extension)\s*\d+)?'
+compiledPhonePattern = re.compile(PHONE_PATTERN)
+
+# Five-digit zipcodes, optionally followed by the four-digit extension:
+ZIP_PATTERN = r'\d{5}(?:[-\s]\d{4})?'
+compiledZipPattern = re.compile(ZIP_PATTERN)
+
+DIGIT_PATTERN = re.compile(r'\d')
+
+# Scanners without name detection, keyed by (withNumbers, withEmail):
+staticScanners = {}
+
+def scannerPattern(withNumbers, withEmail):
+    '''
+    Return the combined pattern of the fixed detectors. Each
+    detector is one named alternative. Where several detectors
+    match at the same position, the earlier alternative wins:
+    email before phone before zipcode. The detectors are case
+    sensitive.
+
+    :param withNumbers: whether to include the phone and zipcode detectors
+    :type withNumbers: Boolean
+    :param withEmail: whether to include the email detector
+    :type withEmail: Boolean
+    :return: regular expression
+    :rtype: str
+    '''
+    alternatives = []
+    if withEmail:
+        alternatives.append('(?P<email>%s)' % EMAIL_PATTERN)
+    if withNumbers:
+        alternatives.append('(?P<phone>%s)' % PHONE_PATTERN)
+        alternatives.append('(?P<zip>%s)' % ZIP_PATTERN)
+    return '|'.join(alternatives)
+
+def namePattern(posterNames=(), screenName=None):
+    '''
+    Return the pattern of the name detector, as one named group.
+    The names match regardless of case (see caseInsensitive()).
+
+    :param posterNames: name parts to redact as whole words
+    :type posterNames: [str]
+    :param screenName: screen name to redact wherever it occurs
+    :type screenName: {str | None}
+    :return: regular expression, or None if there are no names
+    :rtype: {str | None}
+    '''
+    nameAlternatives = []
+    if screenName:
+        nameAlternatives.append(caseInsensitive(screenName))
+    # Longest names first, so that a name is not
+    # cut short by another name that is its prefix:
+    for posterName in sorted(posterNames, key=len, reverse=True):
+        nameAlternatives.append(r'\b%s\b' % caseInsensitive(posterName))
+    if len(nameAlternatives) == 0:
+        return None
+    return '(?P<name>%s)' % '|'.join(nameAlternatives)
+
+def caseInsensitive(text):
+    '''
+    Return a pattern that matches the given text regardless of
+    the case of its ASCII letters, as re.IGNORECASE does for str
+    patterns. Python 2 has no scoped (?i:...) flag, so each letter
+    becomes a character class, such as [oO] for 'o'.
+
+    :param text: literal text
+    :type text: str
+    :return: regular expression
+    :rtype: str
+    '''
+    pieces = []
+    for char in text:
+        if char.isalpha() and char.lower() != char.upper():
+            pieces.append('[%s%s]' % (char.lower(), char.upper()))
+        else:
+            pieces.append(re.escape(char))
+    return ''.join(pieces)
+
+def getStaticScanner(withNumbers, withEmail):
+    '''
+    Return the compiled scanner for the given fixed
+    detectors, compiling it on first use.
+    '''
+    try:
+        return staticScanners[(withNumbers, withEmail)]
+    except KeyError:
+        scanner = re.compile(scannerPattern(withNumbers, withEmail))
+        staticScanners[(withNumbers, withEmail)] = scanner
+        return scanner
+
+def subEither(preferredScanner, otherScanner, replace, text):
+    '''
+    Replace the matches of two compiled scanners in text, with the
+    same result as sub() with a scanner compiled from the alternation
+    of both patterns, preferredScanner's first. That is, the leftmost
+    match wins; preferredScanner's if both match at the same position.
+    Neither scanner may match the empty string.
+
+    :param preferredScanner: scanner that wins ties
+    :type preferredScanner: compiled regular expression
+    :param otherScanner: the other scanner
+    :type otherScanner: compiled regular expression
+    :param replace: function from a match to its replacement
+    :type replace: function
+    :param text: the text to scan
+    :type text: str
+    :return: text with the matches replaced
+    :rtype: str
+    '''
+    pieces = []
+    pos = 0
+    preferredMatch = preferredScanner.search(text)
+    otherMatch = otherScanner.search(text)
+    while preferredMatch is not None or otherMatch is not None:
+        if otherMatch is None or (preferredMatch is not None and preferredMatch.start() <= otherMatch.start()):
+            match = preferredMatch
+        else:
+            match = otherMatch
+        pieces.append(text[pos:match.start()])
+        pieces.append(replace(match))
+        pos = match.end()
+        # A match that starts at or after pos is still the leftmost
+        # one of its scanner; only overlapped matches are searched anew:
+        if preferredMatch is not None and preferredMatch.start() < pos:
+            preferredMatch = preferredScanner.search(text, pos)
+        if otherMatch is not None and otherMatch.start() < pos:
+            otherMatch = otherScanner.search(text, pos)
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+def redactBody(body, posterNames=(), screenName=None, nameToken='<nameRedac>'):
+    '''
+    Redact email addresses, phone numbers, zipcodes, and the
+    poster's names from a post body in one scan. Emits the same
+    tokens as the individual detectors. Names are matched
+    regardless of case; name parts only as whole words, the
+    screen name also inside other words. As with redactEmails(),
+    the result begins with a space if an email address was found.
+
+    :param body: forum post
+    :type body: str
+    :param posterNames: parts of the poster's full name
+    :type posterNames: [{str | unicode}]
+    :param screenName: poster's screen name, or None
+    :type screenName: {str | unicode | None}
+    :param nameToken: replacement for name occurrences
+    :type nameToken: str
+    :return: redacted body
+    :rtype: str
+    '''
+    return PosterRedactor(posterNames, screenName).redact(body, nameToken)
+
+
+class PosterRedactor(object):
+    '''
+    Redacts the posts of one poster. Holds the poster's names, and
+    compiles the poster's name scanner when first needed, so that
+    a PosterRedactor kept across the poster's posts builds it only
+    once. The fixed detectors use the shared static scanners.
+    '''
+
+    def __init__(self, posterNames=(), screenName=None):
+        '''
+        :param posterNames: parts of the poster's full name; parts
+            shorter than three characters are never redacted
+        :type posterNames: [{str | unicode}]
+        :param screenName: poster's screen name, or None
+        :type screenName: {str | unicode | None}
+        '''
+        self.posterNames = []
+        for posterName in posterNames:
+            if isinstance(posterName, unicode):
+                posterName = posterName.encode('UTF-8', 'replace')
+            if len(posterName) >= 3:
+                self.posterNames.append(posterName)
+        if isinstance(screenName, unicode):
+            screenName = screenName.encode('UTF-8', 'replace')
+        self.screenName = screenName if screenName else None
+        self.loweredNames = [posterName.lower() for posterName in self.posterNames]
+        if self.screenName is not None:
+            self.loweredNames.append(self.screenName.lower())
+        # Compiled name detector, or None until first needed:
+        self.compiledNames = None
+
+    def nameScanner(self):
+        '''
+        Return the compiled name scanner, compiling it on first use.
+        '''
+        if self.compiledNames is None:
+            self.compiledNames = re.compile(namePattern(self.posterNames, self.screenName))
+        return self.compiledNames
+
+    def redact(self, body, nameToken='<nameRedac>'):
+        '''
+        Redact one of the poster's posts; see redactBody().
+
+        :param body: forum post
+        :type body: str
+        :param nameToken: replacement for name occurrences
+        :type nameToken: str
+        :return: redacted body
+        :rtype: str
+        '''
+        withNumbers = DIGIT_PATTERN.search(body) is not None
+        withEmail   = '@' in body
+        withNames   = False
+        if len(self.loweredNames) > 0:
+            bodyLowerCase = body.lower()
+            for loweredName in self.loweredNames:
+                if loweredName in bodyLowerCase:
+                    withNames = True
+                    break
+        if not (withNumbers or withEmail or withNames):
+            return body
+
+        replacements = {'email' : ' %s ' % EMAIL_REDACTION_TOKEN,
+                        'phone' : PHONE_REDACTION_TOKEN,
+                        'zip'   : ZIP_REDACTION_TOKEN,
+                        'name'  : nameToken
+                        }
+        emailFound = []
+        def replace(match):
+            if match.lastgroup == 'email':
+                emailFound.append(True)
+            return replacements[match.lastgroup]
+        if not withNames:
+            body = getStaticScanner(withNumbers, withEmail).sub(replace, body)
+        elif not (withNumbers or withEmail):
+            body = self.nameScanner().sub(replace, body)
+        else:
+            # Where a fixed detector and a name match at the
+            # same position, the fixed detector wins:
+            body = subEither(getStaticScanner(withNumbers, withEmail), self.nameScanner(), replace, body)
+        if len(emailFound) > 0:
+            body = ' ' + body
+        return body
+
+
+class PosterRedactorCache(object):
+    '''
+    Bounded least-recently-used cache of PosterRedactor instances,
+    keyed by user_int_id. The hits and misses counters show how
+    well the cache size fits a forum's posting pattern.
+    '''
+
+    DEFAULT_MAX_POSTERS = 10000
+
+    def __init__(self, maxPosters=DEFAULT_MAX_POSTERS):
+        '''
+        :param maxPosters: number of posters whose redactors are kept
+        :type maxPosters: int
+        '''
+        self.maxPosters = maxPosters
+        self.redactors = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, posterId, posterNames=(), screenName=None):
+        '''
+        Return the PosterRedactor of the given poster, creating it
+        from posterNames and screenName if it is not cached.
+
+        :param posterId: the poster's user_int_id
+        :type posterId: int
+        :param posterNames: parts of the poster's full name
+        :type posterNames: [{str | unicode}]
+        :param screenName: poster's screen name, or None
+        :type screenName: {str | unicode | None}
+        :rtype: PosterRedactor
+        '''
+        try:
+            # Re-insert to mark as most recently used:
+            redactor = self.redactors.pop(posterId)
+            self.hits += 1
+        except KeyError:
+            redactor = PosterRedactor(posterNames, screenName)
+            self.misses += 1
+        self.redactors[posterId] = redactor
+        if len(self.redactors) > self.maxPosters:
+            # Evict the least recently used poster:
+            self.redactors.popitem(last=False)
+        return redactor
+
+    def __len__(self):
+        return len(self.redactors)
@@ -0,0 +1,97 @@
+'''
+Times the email detector of the redaction module on adversarial
+post bodies of growing size, and reports the cost per KB of body.
+For a detector that runs in linear time the per-KB figure stays
+flat as the bodies grow. With --legacy, the original
+EdxForumScrubber.emailPattern procedure (match(), then findall())
+is timed on the same bodies for comparison; its per-KB figure
+grows with the body size.
+
+Usage: redaction_benchmark.py [-h] [--legacy] [--maxKB MAXKB]
+'''
+
+import argparse
+import re
+import sys
+import time
+
+from redaction import redactEmails
+
+
+# The pattern that redaction.EMAIL_PATTERN replaced:
+LEGACY_EMAIL_PATTERN = '(.*)\s+([a-zA-Z0-9\(\.\-]+)[@]([a-zA-Z0-9\.]+)(.)(edu|com)\\s*(.*)'
+compiledLegacyEmailPattern = re.compile(LEGACY_EMAIL_PATTERN)
+
+def legacyRedactEmails(body):
+    '''
+    The email redaction as EdxForumScrubber.anonymizeRecord()
+    originally did it.
+    '''
+    if compiledLegacyEmailPattern.match(body) is not None:
+        new_body = " "
+        for emailMatchHit in re.findall(LEGACY_EMAIL_PATTERN, body):
+            new_body += emailMatchHit[0] + " <emailRedac> " + emailMatchHit[-1]
+        body = new_body
+    return body
+
+# Generators of adversarial bodies. Each takes the body size in
+# bytes, and returns a body of about that size. The short first
+# line holds an address, so that the legacy procedure goes on to
+# run findall() over the long second line, which holds none:
+ADVERSARIAL_BODIES = {
+    # Pasted code: many whitespace runs:
+    'whitespaceRuns' : lambda size: 'Mail me at joe@comcast.com today\n' + ('x  =  y ;  ' * (size / 11)),
+    # Many '@' signs that never lead to an edu/com domain:
+    'danglingAts'    : lambda size: 'See jo@comcast.com today\n' + ('a@b.c ' * (size / 6)),
+    # One enormous local part and domain candidate without whitespace:
+    'longToken'      : lambda size: 'Token jo@comcast.com today\n ' + ('a.' * (size / 4)) + '@' + ('b.' * (size / 4)),
+    }
+
+def timePerKB(redactFunc, body, repeats=3):
+    '''
+    Return the best of several runs of redactFunc over body,
+    in milliseconds per KB of body.
+    '''
+    bestTime = None
+    for _ in range(repeats):
+        startTime = time.time()
+        redactFunc(body)
+        elapsed = time.time() - startTime
+        if bestTime is None or elapsed < bestTime:
+            bestTime = elapsed
+    return 1000.0 * bestTime / (len(body) / 1024.0)
+
+def runBenchmark(maxKB=256, legacy=False, outFd=sys.stdout):
+    '''
+    Time the email detector on each kind of adversarial
+    body, doubling the body size from 1KB to maxKB.
+
+    :param maxKB: largest body size in KB
+    :type maxKB: int
+    :param legacy: if True, also time the original pattern
+    :type legacy: Boolean
+    :param outFd: where to write the report
+    :type outFd: file
+    '''
+    for bodyKind in sorted(ADVERSARIAL_BODIES.keys()):
+        sizeKB = 1
+        while sizeKB <= maxKB:
+            body = ADVERSARIAL_BODIES[bodyKind](sizeKB * 1024)
+            report = '%-15s %6dKB  redactEmails: %8.4f ms/KB' % (bodyKind, sizeKB, timePerKB(redactEmails, body))
+            if legacy:
+                report += '  legacy: %8.4f ms/KB' % timePerKB(legacyRedactEmails, body, repeats=1)
+            outFd.write(report + '\n')
+            sizeKB *= 2
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument('--legacy',
+                        help='also time the original email pattern; slow for large --maxKB',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--maxKB',
+                        help='largest adversarial body in KB; default: 256',
+                        type=int,
+                        default=256)
+    args = parser.parse_args()
+    runBenchmark(args.maxKB, args.legacy)
@@ -0,0 +1,260 @@
+'''
+Per-stage throughput and latency metrics for ETL runs.
+
+Each stage of a run (reading the source, building records, redaction,
+inserting, ...) reports how long it took for how many records. For
+every stage, StageMetrics keeps the totals, from which it computes
+records per second, and a bounded random sample of per-record
+latencies, from which it computes the 50th and 99th percentiles.
+
+The metrics can be written as a JSON document, and as a file for the
+Prometheus node exporter's textfile collector. Both files are written
+under a temporary name and then renamed, so that readers never see a
+partial file. maybeWrite() rewrites them at most once per interval
+during a run; write() rewrites them at the end.
+'''
+
+from contextlib import contextmanager
+import json
+import math
+import os
+import random
+import threading
+import time
+
+
+class StageMetrics(object):
+    '''
+    Counts, total time, and latency samples of named stages.
+    Stages appear in reports in the order in which they were
+    first recorded. Threads may record into the same instance.
+    '''
+
+    # Per-record latencies kept per stage for the percentiles:
+    DEFAULT_SAMPLE_SIZE = 10000
+    # Seconds between two periodic writes of the metrics files:
+    DEFAULT_WRITE_INTERVAL = 60
+
+    def __init__(self,
+                 jsonPath=None,
+                 prometheusPath=None,
+                 writeInterval=DEFAULT_WRITE_INTERVAL,
+                 labels=None,
+                 sampleSize=DEFAULT_SAMPLE_SIZE):
+        '''
+        :param jsonPath: file to which write() saves the metrics as JSON, or None
+        :type jsonPath: String
+        :param prometheusPath: file to which write() saves the metrics in Prometheus
+            text format, or None. To be picked up by the node exporter, the file
+            name must end in .prom, and be in the textfile collector's directory.
+        :type prometheusPath: String
+        :param writeInterval: minimum seconds between two writes by maybeWrite()
+        :type writeInterval: float
+        :param labels: label name/value pairs that are added to every Prometheus
+            metric, and to the JSON document, such as {'dump' : 'course.bson'}
+        :type labels: {String : String}
+        :param sampleSize: number of per-record latencies kept per stage
+        :type sampleSize: int
+        '''
+        self.jsonPath = jsonPath
+        self.prometheusPath = prometheusPath
+        self.writeInterval = writeInterval
+        self.labels = labels if labels is not None else {}
+        self.sampleSize = sampleSize
+        self.stageNames = []
+        # Stage name --> [numRecords, totalSeconds, numSamplesOffered]:
+        self.totals = {}
+        # Stage name --> per-record latencies in seconds:
+        self.samples = {}
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+        self.lastWriteTime = self.startTime
+
+    def record(self, stageName, seconds, numRecords=1):
+        '''
+        Account for one execution of a stage.
+
+        :param stageName: name of the stage, such as 'insert'
+        :type stageName: String
+        :param seconds: time the stage took
+        :type seconds: float
+        :param numRecords: number of records the stage handled in that time;
+            each is taken to have had an equal share of the time
+        :type numRecords: int
+        '''
+        if numRecords <= 0:
+            return
+        with self.lock:
+            totals = self.totals.get(stageName)
+            if totals is None:
+                self.stageNames.append(stageName)
+                totals = self.totals[stageName] = [0, 0.0, 0]
+                self.samples[stageName] = []
+            totals[0] += numRecords
+            totals[1] += seconds
+            self.addSample(stageName, totals, seconds / numRecords)
+
+    def addSample(self, stageName, totals, latency):
+        '''
+        Reservoir sampling: after n offers, each of them is
+        in the sample with equal probability.
+        '''
+        totals[2] += 1
+        samples = self.samples[stageName]
+        if len(samples) < self.sampleSize:
+            samples.append(latency)
+            return
+        slot = self.random.randint(0, totals[2] - 1)
+        if slot < self.sampleSize:
+            samples[slot] = latency
+
+    @contextmanager
+    def timed(self, stageName, numRecords=1):
+        '''
+        Context manager that records the time spent in its block:
+
+            with metrics.timed('insert', len(batch)):
+                ...
+        '''
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            self.record(stageName, time.time() - startTime, numRecords)
+
+    def timedIter(self, stageName, iterable):
+        '''
+        Generator that passes on the items of iterable, and records
+        the time each item took to produce as one record of stageName.
+        Time spent by the consumer between items is not counted.
+        '''
+        iterator = iter(iterable)
+        while True:
+            startTime = time.time()
+            try:
+                item = iterator.next()
+            except StopIteration:
+                return
+            self.record(stageName, time.time() - startTime)
+            yield item
+
+    def merge(self, stageTotals, stageSamples):
+        '''
+        Add metrics collected elsewhere, such as in a worker process.
+
+        :param stageTotals: stage name --> [numRecords, totalSeconds, numSamplesOffered],
+            as in another instance's totals
+        :type stageTotals: {String : [int, float, int]}
+        :param stageSamples: stage name --> latencies, as in another instance's samples
+        :type stageSamples: {String : [float]}
+        '''
+        with self.lock:
+            for stageName, (numRecords, seconds, _) in stageTotals.items():
+                totals = self.totals.get(stageName)
+                if totals is None:
+                    self.stageNames.append(stageName)
+                    totals = self.totals[stageName] = [0, 0.0, 0]
+                    self.samples[stageName] = []
+                totals[0] += numRecords
+                totals[1] += seconds
+                for latency in stageSamples.get(stageName, []):
+                    self.addSample(stageName, totals, latency)
+
+    def report(self):
+        '''
+        Return the current metrics.
+
+        :return: dict with the labels, the seconds since the metrics were
+            created, and per stage: records, seconds, records per second,
+            and the p50 and p99 per-record latencies in milliseconds
+        :rtype: dict
+        '''
+        stages = []
+        with self.lock:
+            stageTotals = [(stageName, self.totals[stageName][0], self.totals[stageName][1], list(self.samples[stageName]))
+                           for stageName in self.stageNames]
+        for stageName, numRecords, seconds, latencies in stageTotals:
+            latencies.sort()
+            stages.append({'stage' : stageName,
+                           'records' : numRecords,
+                           'seconds' : round(seconds, 6),
+                           'recordsPerSec' : round(numRecords / seconds, 1) if seconds > 0 else None,
+                           'p50Ms' : round(percentile(latencies, 50) * 1000, 4),
+                           'p99Ms' : round(percentile(latencies, 99) * 1000, 4),
+                           })
+        return {'labels' : self.labels,
+                'elapsedSeconds' : round(time.time() - self.startTime, 3),
+                'stages' : stages}
+
+    def prometheusText(self):
+        '''
+        Return the current metrics in Prometheus text exposition format.
+        '''
+        metricsReport = self.report()
+        lines = []
+        metricDefs = [('forum_etl_stage_records_total', 'counter', 'Records handled by the stage.', 'records', None),
+                      ('forum_etl_stage_seconds_total', 'counter', 'Time spent in the stage.', 'seconds', None),
+                      ('forum_etl_stage_records_per_second', 'gauge', 'Records per second of stage time.', 'recordsPerSec', None),
+                      ('forum_etl_stage_record_latency_seconds', 'gauge', 'Per-record latency quantiles of the stage.', 'p50Ms', '0.5'),
+                      ('forum_etl_stage_record_latency_seconds', 'gauge', None, 'p99Ms', '0.99'),
+                      ]
+        for metricName, metricType, metricHelp, key, quantile in metricDefs:
+            if metricHelp is not None:
+                lines.append('# HELP %s %s' % (metricName, metricHelp))
+                lines.append('# TYPE %s %s' % (metricName, metricType))
+            for stage in metricsReport['stages']:
+                value = stage[key]
+                if value is None:
+                    continue
+                if key.endswith('Ms'):
+                    value = value / 1000.0
+                labels = dict(self.labels)
+                labels['stage'] = stage['stage']
+                if quantile is not None:
+                    labels['quantile'] = quantile
+                lines.append('%s{%s} %s' % (metricName, prometheusLabels(labels), repr(float(value))))
+        lines.append('# HELP forum_etl_elapsed_seconds Seconds since the run started.')
+        lines.append('# TYPE forum_etl_elapsed_seconds gauge')
+        lines.append('forum_etl_elapsed_seconds{%s} %s' % (prometheusLabels(self.labels), repr(float(metricsReport['elapsedSeconds']))))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        '''
+        Write the metrics to the JSON and Prometheus files, where given.
+        '''
+        self.lastWriteTime = time.time()
+        if self.jsonPath is not None:
+            replaceFile(self.jsonPath, json.dumps(self.report(), indent=2, sort_keys=True) + '\n')
+        if self.prometheusPath is not None:
+            replaceFile(self.prometheusPath, self.prometheusText())
+
+    def maybeWrite(self):
+        '''
+        Write the metrics files if writeInterval seconds have
+        passed since they were last written.
+        '''
+        if time.time() - self.lastWriteTime >= self.writeInterval:
+            self.write()
+
+def percentile(sortedValues, percent):
+    '''
+    Return the nearest-rank percentile of the given sorted values, or 0.0.
+    '''
+    if len(sortedValues) == 0:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(sortedValues))) - 1
+    return sortedValues[max(0, min(rank, len(sortedValues) - 1))]
+
+def prometheusLabels(labels):
+    '''
+    Render label name/value pairs as name="value",... in name order.
+    '''
+    return ','.join(['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for name, value in sorted(labels.items())])
+
+def replaceFile(path, content):
+    tmpPath = '%s.tmp%d' % (path, os.getpid())
+    with open(tmpPath, 'w') as outFile:
+        outFile.write(content)
+    os.rename(tmpPath, path)
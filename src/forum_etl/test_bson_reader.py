@@ -0,0 +1,64 @@
+'''
+Tests for BsonFileReader, which decodes mongodump .bson
+files without a MongoDB server.
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import bson
+
+from bson_reader import BsonFileReader
+
+
+class TestBsonReader(unittest.TestCase):
+
+    def setUp(self):
+        # Turn the tinyForum test posts into a .bson file,
+        # the way mongodump would have written them:
+        self.tmpDir = tempfile.mkdtemp(prefix='bsonReaderTest')
+        self.bsonFileName = os.path.join(self.tmpDir, 'tinyForum.bson')
+        currDir = os.path.dirname(__file__)
+        self.forumPosts = []
+        with open(os.path.join(currDir, 'data/tinyForum.json'), 'r') as jsonFd:
+            for line in jsonFd:
+                self.forumPosts.append(json.loads(line))
+        with open(self.bsonFileName, 'wb') as bsonFd:
+            for forumPost in self.forumPosts:
+                bsonFd.write(bson.BSON.encode(forumPost))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testReadAll(self):
+        reader = BsonFileReader(self.bsonFileName)
+        docs = list(reader.query({}))
+        self.assertEqual(self.forumPosts, docs)
+        self.assertEqual(len(self.forumPosts), reader.numDocs)
+
+    def testStartOffset(self):
+        # Stop after two documents, and continue
+        # from there with a new reader:
+        reader = BsonFileReader(self.bsonFileName)
+        docs = reader.query({})
+        docs.next()
+        docs.next()
+        resumedReader = BsonFileReader(self.bsonFileName)
+        resumedReader.startOffset = reader.offset
+        self.assertEqual(self.forumPosts[2:], list(resumedReader.query({})))
+
+    def testNonEmptyQuery(self):
+        reader = BsonFileReader(self.bsonFileName)
+        self.assertRaises(ValueError, reader.query, {'author_id' : '5'})
+
+    def testTruncatedFile(self):
+        with open(self.bsonFileName, 'ab') as bsonFd:
+            bsonFd.write(bson.BSON.encode({'body' : 'Cut off'})[:10])
+        reader = BsonFileReader(self.bsonFileName)
+        self.assertRaises(ValueError, list, reader.query({}))
+        self.assertEqual(len(self.forumPosts), reader.numDocs)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+Tests for the ETL profiler.
+'''
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from etl_profiler import EtlProfiler
+
+
+def busyInner(numRounds):
+    total = 0
+    for i in xrange(numRounds):
+        total += i * i % 7
+    return total
+
+def busyOuter():
+    return sum([busyInner(20000) for _ in range(30)])
+
+
+class TestEtlProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def checkOutputs(self, profiler):
+        stats = pstats.Stats(profiler.pstatsPath)
+        self.assertIn('busyInner', [funcKey[2] for funcKey in stats.stats.keys()])
+        with open(profiler.collapsedPath) as collapsedFile:
+            stackLines = collapsedFile.read().splitlines()
+        innerStacks = [line for line in stackLines if line.split(' ')[0].startswith('busyInner') or ';busyInner' in line]
+        self.assertTrue(len(innerStacks) > 0)
+        for line in innerStacks:
+            (stack, count) = line.rsplit(' ', 1)
+            self.assertIn('busyOuter (test_etl_profiler.py:', stack)
+            self.assertTrue(int(count) > 0)
+
+    def testCProfile(self):
+        with EtlProfiler(os.path.join(self.tmpDir, 'run'), mode='cprofile') as profiler:
+            busyOuter()
+        self.checkOutputs(profiler)
+
+    def testSampling(self):
+        with EtlProfiler(os.path.join(self.tmpDir, 'run'), mode='sample', sampleInterval=0.001) as profiler:
+            busyOuter()
+        self.checkOutputs(profiler)
+
+    def testBadMode(self):
+        self.assertRaises(ValueError, EtlProfiler, 'run', 'trace')
+
+if __name__ == "__main__":
+    unittest.main()
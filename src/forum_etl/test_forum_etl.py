@@ -7,11 +7,18 @@ from collections import OrderedDict
 import datetime
 import json
 import os
+import re
+import shutil
+import tempfile
 import unittest
 
+import bson
+
 from json_to_relation.mongodb import MongoDB
 
-from extractor import EdxForumScrubber
+from bson_reader import BsonFileReader
+import extractor
+from extractor import EdxForumScrubber, MongoRecord
 from pymysql_utils.pymysql_utils import MySQLDB
 
 # To run just one selected test method,
@@ -21,8 +28,8 @@ RUN_ALL_TESTS = True
 
 class TestForumEtl(unittest.TestCase):
 
-    # Forum rows have the following columns:
-    #  type, anonymous, anonymous_to_peers, at_position_list, user_int_id, body, course_display_name, created_at, votes, count, down_count, up_count, up, down, comment_thread_id, parent_id, parent_ids, sk   
+    # Forum rows have the following columns; the gold tuples leave out forum_uid (see forumRows()):
+    #  forum_post_id, {anon_screen_name | screen_name}, type, anonymous, anonymous_to_peers, at_position_list, forum_uid, body, course_display_name, created_at, votes, count, down_count, up_count, up, down, comment_thread_id, parent_id, parent_ids, sk, confusion, happiness
 
     # Correct result for relationization of tinyForum.json
     # (in <projDir>/src/forum_etl/data). This result is anonymized and not relatable,
@@ -30,51 +37,51 @@ class TestForumEtl(unittest.TestCase):
     tinyForumGoldAnonymized = \
     [
     # poster Otto van Homberg: body is clean to start with:
-    ('anon_screen_name_redacted','CommentThread', 'False', 'False', '[]', 5L, 'Harmless body', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 20), "{u'count': 10, u'point': -6, u'down_count': 8, u'up': [u'2', u'10'], u'down': [u'1', u'3', u'4', u'5', u'6', u'7', u'8', u'9'], u'up_count': 2}", 10L, 8L, 2L, "['2', '10']", "['1', '3', '4', '5', '6', '7', '8', '9']", None, None, None, None),
+    ('519461545924670200000001', '<anon_screen_name_redacted>', 'CommentThread', 'False', 'False', '[]', 'Harmless body', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 20), "{u'count': 10, u'point': -6, u'down_count': 8, u'up': [u'2', u'10'], u'down': [u'1', u'3', u'4', u'5', u'6', u'7', u'8', u'9'], u'up_count': 2}", 10L, 8L, 2L, "['2', '10']", "['1', '3', '4', '5', '6', '7', '8', '9']", 'None', 'None', 'None', 'None', '', ''),
     # poster Andreas Fritz: body has someone's email:
-    ('anon_screen_name_redacted','Comment', 'False', 'False', '[]', 7L, ' Body with <emailRedac> email.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 10, u'point': -4, u'down_count': 7, u'up': [u'6', u'8', u'10'], u'down': [u'1', u'2', u'3', u'4', u'5', u'7', u'9'], u'up_count': 3}", 10L, 7L, 3L, "['6', '8', '10']", "['1', '2', '3', '4', '5', '7', '9']", '519461545924670200000001', None, '[]', '519461555924670200000006'),
+    ('519461555924670200000006', '<anon_screen_name_redacted>', 'Comment', 'False', 'False', '[]', ' Body with <emailRedac> email.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 10, u'point': -4, u'down_count': 7, u'up': [u'6', u'8', u'10'], u'down': [u'1', u'2', u'3', u'4', u'5', u'7', u'9'], u'up_count': 3}", 10L, 7L, 3L, "['6', '8', '10']", "['1', '2', '3', '4', '5', '7', '9']", '519461545924670200000001', 'None', '[]', '519461555924670200000006', '', ''),
     # poster Otto van Homberg: body has 'Otto':
-    ('anon_screen_name_redacted','Comment', 'False', 'False', '[]', 5L, 'Body with poster name <nameRedac_anon_screen_name_redacted> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007'),
+    ('519461555924670200000007', '<anon_screen_name_redacted>', 'Comment', 'False', 'False', '[]', 'Body with poster name <nameRedac_<anon_screen_name_redacted>> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', ''),
     # poster Andreas Fritz: body has a phone number:
-    ('anon_screen_name_redacted','Comment', 'False', 'False', '[]', 10L, 'Body with <phoneRedac> a phone number.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461545924670200000005', "[u'519461545924670200000005']", '519461545924670200000005-519461555924670200000008'),
+    ('519461555924670200000008', '<anon_screen_name_redacted>', 'Comment', 'False', 'False', '[]', 'Body with <phoneRedac> a phone number.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461545924670200000005', "[u'519461545924670200000005']", '519461545924670200000005-519461555924670200000008', '', ''),
     # poster Otto van Homberg: body has his screen name (otto_king):
-    ('anon_screen_name_redacted','Comment', 'False', 'False', '[]', 5L, 'Body with poster screen name <nameRedac_anon_screen_name_redacted> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007'),    
+    ('519461555924670200000009', '<anon_screen_name_redacted>', 'Comment', 'False', 'False', '[]', 'Body with poster screen name <nameRedac_<anon_screen_name_redacted>> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', ''),
     # poster Otto van Homberg: body has his full name (Otto van Homberg):
-    ('anon_screen_name_redacted','Comment', 'False', 'False', '[]', 5L, 'Body with poster screen name <nameRedac_anon_screen_name_redacted> <nameRedac_anon_screen_name_redacted> <nameRedac_anon_screen_name_redacted> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007')    
+    ('519461555924670200000010', '<anon_screen_name_redacted>', 'Comment', 'False', 'False', '[]', 'Body with poster screen name <nameRedac_<anon_screen_name_redacted>> <nameRedac_<anon_screen_name_redacted>> <nameRedac_<anon_screen_name_redacted>> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', '')
     ]
     
     # Gold result for anonymization that allows relating to other tables (i.e. hashes are constant)
     tinyForumGoldRelatable = \
     [
     # poster Otto van Homberg: body is clean to start with:
-    ('abc','CommentThread', 'False', 'False', '[]', 5L, 'Harmless body', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 20), "{u'count': 10, u'point': -6, u'down_count': 8, u'up': [u'2', u'10'], u'down': [u'1', u'3', u'4', u'5', u'6', u'7', u'8', u'9'], u'up_count': 2}", 10L, 8L, 2L, "['2', '10']", "['1', '3', '4', '5', '6', '7', '8', '9']", None, None, None, None),
+    ('519461545924670200000001', 'abc', 'CommentThread', 'False', 'False', '[]', 'Harmless body', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 20), "{u'count': 10, u'point': -6, u'down_count': 8, u'up': [u'2', u'10'], u'down': [u'1', u'3', u'4', u'5', u'6', u'7', u'8', u'9'], u'up_count': 2}", 10L, 8L, 2L, "['2', '10']", "['1', '3', '4', '5', '6', '7', '8', '9']", 'None', 'None', 'None', 'None', '', ''),
     # poster Andreas Fritz: body has someone's email:
-    ('def','Comment', 'False', 'False', '[]', 7L, ' Body with <emailRedac> email.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 10, u'point': -4, u'down_count': 7, u'up': [u'6', u'8', u'10'], u'down': [u'1', u'2', u'3', u'4', u'5', u'7', u'9'], u'up_count': 3}", 10L, 7L, 3L, "['6', '8', '10']", "['1', '2', '3', '4', '5', '7', '9']", '519461545924670200000001', None, '[]', '519461555924670200000006'),
+    ('519461555924670200000006', 'def', 'Comment', 'False', 'False', '[]', ' Body with <emailRedac> email.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 10, u'point': -4, u'down_count': 7, u'up': [u'6', u'8', u'10'], u'down': [u'1', u'2', u'3', u'4', u'5', u'7', u'9'], u'up_count': 3}", 10L, 7L, 3L, "['6', '8', '10']", "['1', '2', '3', '4', '5', '7', '9']", '519461545924670200000001', 'None', '[]', '519461555924670200000006', '', ''),
     # poster Otto van Homberg: body has 'Otto':
-    ('abc','Comment', 'False', 'False', '[]', 5L, 'Body with poster name <nameRedac_abc> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007'),
+    ('519461555924670200000007', 'abc', 'Comment', 'False', 'False', '[]', 'Body with poster name <nameRedac_abc> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', ''),
     # poster Andreas Fritz: body has a phone number:
-    ('ghi','Comment', 'False', 'False', '[]', 10L, 'Body with <phoneRedac> a phone number.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461545924670200000005', "[u'519461545924670200000005']", '519461545924670200000005-519461555924670200000008'),
+    ('519461555924670200000008', 'ghi', 'Comment', 'False', 'False', '[]', 'Body with <phoneRedac> a phone number.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461545924670200000005', "[u'519461545924670200000005']", '519461545924670200000005-519461555924670200000008', '', ''),
     # poster Otto van Homberg: body has his screen name (otto_king):
-    ('abc','Comment', 'False', 'False', '[]', 5L, 'Body with poster screen name <nameRedac_abc> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007'),    
+    ('519461555924670200000009', 'abc', 'Comment', 'False', 'False', '[]', 'Body with poster screen name <nameRedac_abc> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', ''),
     # poster Otto van Homberg: body has his full name (Otto van Homberg):
-    ('abc','Comment', 'False', 'False', '[]', 5L, 'Body with poster screen name <nameRedac_abc> <nameRedac_abc> <nameRedac_abc> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007')    
+    ('519461555924670200000010', 'abc', 'Comment', 'False', 'False', '[]', 'Body with poster screen name <nameRedac_abc> <nameRedac_abc> <nameRedac_abc> embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', '')
     ]
     
     # Gold result for non-anonymized forum:
     tinyForumGoldClear = \
     [
     # poster Otto van Homberg: body is clean to start with:
-    ('otto_king','CommentThread', 'False', 'False', '[]', 5L, 'Harmless body', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 20), "{u'count': 10, u'point': -6, u'down_count': 8, u'up': [u'2', u'10'], u'down': [u'1', u'3', u'4', u'5', u'6', u'7', u'8', u'9'], u'up_count': 2}", 10L, 8L, 2L, "['2', '10']", "['1', '3', '4', '5', '6', '7', '8', '9']", None, None, None, None),
+    ('519461545924670200000001', 'Otto', 'CommentThread', 'False', 'False', '[]', 'Harmless body', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 20), "{u'count': 10, u'point': -6, u'down_count': 8, u'up': [u'2', u'10'], u'down': [u'1', u'3', u'4', u'5', u'6', u'7', u'8', u'9'], u'up_count': 2}", 10L, 8L, 2L, "['2', '10']", "['1', '3', '4', '5', '6', '7', '8', '9']", 'None', 'None', 'None', 'None', '', ''),
     # poster Andreas Fritz: body has someone's email:
-    ('fritzL','Comment', 'False', 'False', '[]', 7L, ' Body with joe@comcast.com email.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 10, u'point': -4, u'down_count': 7, u'up': [u'6', u'8', u'10'], u'down': [u'1', u'2', u'3', u'4', u'5', u'7', u'9'], u'up_count': 3}", 10L, 7L, 3L, "['6', '8', '10']", "['1', '2', '3', '4', '5', '7', '9']", '519461545924670200000001', None, '[]', '519461555924670200000006'),
+    ('519461555924670200000006', 'Fritz', 'Comment', 'False', 'False', '[]', 'Body with joe@comcast.com email.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 10, u'point': -4, u'down_count': 7, u'up': [u'6', u'8', u'10'], u'down': [u'1', u'2', u'3', u'4', u'5', u'7', u'9'], u'up_count': 3}", 10L, 7L, 3L, "['6', '8', '10']", "['1', '2', '3', '4', '5', '7', '9']", '519461545924670200000001', 'None', '[]', '519461555924670200000006', '', ''),
     # poster Otto van Homberg: body has 'Otto':
-    ('otto_king','Comment', 'False', 'False', '[]', 5L, 'Body with poster name Otto embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007'),
+    ('519461555924670200000007', 'Otto', 'Comment', 'False', 'False', '[]', 'Body with poster name Otto embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', ''),
     # poster Andreas Fritz: body has a phone number:
-    ('bebeW','Comment', 'False', 'False', '[]', 10L, 'Body with 650-333-4567 a phone number.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461545924670200000005', "[u'519461545924670200000005']", '519461545924670200000005-519461555924670200000008'),
+    ('519461555924670200000008', 'Bebe', 'Comment', 'False', 'False', '[]', 'Body with 650-333-4567 a phone number.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461545924670200000005', "[u'519461545924670200000005']", '519461545924670200000005-519461555924670200000008', '', ''),
     # poster Otto van Homberg: body has his screen name (otto_king):
-    ('otto_king','Comment', 'False', 'False', '[]', 5L, 'Body with poster screen name otto_king embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007'),    
+    ('519461555924670200000009', 'Otto', 'Comment', 'False', 'False', '[]', 'Body with poster screen name otto_king embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', ''),
     # poster Otto van Homberg: body has his full name (Otto van Homberg):
-    ('otto_king','Comment', 'False', 'False', '[]', 5L, 'Body with poster screen name Otto van Homberg embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007')    
+    ('519461555924670200000010', 'Otto', 'Comment', 'False', 'False', '[]', 'Body with poster screen name Otto van Homberg embedded.', 'MITx/6.002x/2012_Fall', datetime.datetime(2013, 5, 16, 4, 32, 21), "{u'count': 0, u'point': 0, u'down_count': 0, u'up': [], u'down': [], u'up_count': 0}", 0L, 0L, 0L, '[]', '[]', '519461545924670200000001', '519461555924670200000006', "[u'519461555924670200000006']", '519461555924670200000006-519461555924670200000007', '', '')
     ]    
 
     def setUp(self):
@@ -106,7 +113,7 @@ class TestForumEtl(unittest.TestCase):
     def testAnonymized(self):
         self.forumScrubberAnonymized.populateUserCache()
         self.forumScrubberAnonymized.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')  
-        for rowNum, forumPost in enumerate(self.mysqldb.query('SELECT * FROM unittest.contents')):
+        for rowNum, forumPost in enumerate(self.forumRows(self.forumScrubberAnonymized)):
             # print(str(rowNum) + ':' + str(forumPost))
             self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
             
@@ -115,7 +122,7 @@ class TestForumEtl(unittest.TestCase):
     def testNonAnonymizedRelatable(self):
         self.forumScrubberRelatable.populateUserCache()
         self.forumScrubberRelatable.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')  
-        for rowNum, forumPost in enumerate(self.mysqldb.query('SELECT * FROM unittest.contents')):
+        for rowNum, forumPost in enumerate(self.forumRows(self.forumScrubberRelatable)):
             # print(str(rowNum) + ':' + str(forumPost))
             self.assertEqual(TestForumEtl.tinyForumGoldRelatable[rowNum], forumPost)
 
@@ -124,12 +131,250 @@ class TestForumEtl(unittest.TestCase):
     def testNonAnonymized(self):
         self.forumScrubberClear.populateUserCache()
         self.forumScrubberClear.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')  
-        for rowNum, forumPost in enumerate(self.mysqldb.query('SELECT * FROM unittest.contents')):
+        for rowNum, forumPost in enumerate(self.forumRows(self.forumScrubberClear)):
             # print(str(rowNum) + ':' + str(forumPost))
             self.assertEqual(TestForumEtl.tinyForumGoldClear[rowNum], forumPost)
 
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testNonAsciiBodyNamesPoster(self):
+        # The user cache holds Unicode names; the body is UTF-8 once prepared:
+        self.forumScrubberRelatable.populateUserCache()
+        mongoRecordObj = MongoRecord({'_id' : '519461555924670200000011', 'author_id' : '5', 'author_username' : 'Otto',
+                                      'body' : u'Gr\xfc\xdfe von Otto van Homberg, caf\xe9 650-333-4567'})
+        mongoRecordObj = self.forumScrubberRelatable.prepareRecord(mongoRecordObj)
+        self.assertEqual('Gr\xc3\xbc\xc3\x9fe von <nameRedac_abc> <nameRedac_abc> <nameRedac_abc>, caf\xc3\xa9 <phoneRedac>',
+                         mongoRecordObj['body'])
+        self.assertEqual('abc', mongoRecordObj['anon_screen_name'])
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testAnonymizedBatched(self):
+        # Six tinyForum posts with a batch size of four: one full
+        # batch, plus the partial batch flushed at the end:
+        forumScrubberBatched = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', insertBatchSize=4)
+        forumScrubberBatched.populateUserCache()
+        forumScrubberBatched.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        self.assertEqual(len(TestForumEtl.tinyForumGoldAnonymized), forumScrubberBatched.counter)
+        for rowNum, forumPost in enumerate(self.forumRows(forumScrubberBatched)):
+            self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testAnonymizedWorkers(self):
+        # Two worker processes, three batches of two posts each;
+        # rows must arrive in the original order:
+        forumScrubberWorkers = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', insertBatchSize=2, numWorkers=2)
+        forumScrubberWorkers.populateUserCache()
+        forumScrubberWorkers.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        self.assertEqual(len(TestForumEtl.tinyForumGoldAnonymized), forumScrubberWorkers.counter)
+        for rowNum, forumPost in enumerate(self.forumRows(forumScrubberWorkers)):
+            self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testAnonymizedPipelined(self):
+        # Reader and writer threads, with room for only two
+        # posts in flight; rows must arrive in the original order:
+        forumScrubberPipelined = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', 
+                                                  insertBatchSize=4, pipelined=True, maxInFlight=2)
+        forumScrubberPipelined.populateUserCache()
+        forumScrubberPipelined.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        self.assertEqual(len(TestForumEtl.tinyForumGoldAnonymized), forumScrubberPipelined.counter)
+        for rowNum, forumPost in enumerate(self.forumRows(forumScrubberPipelined)):
+            self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testAnonymizedBulkLoad(self):
+        # Rows loaded via spool file and LOAD DATA LOCAL INFILE
+        # must be identical to rows inserted via INSERT:
+        forumScrubberBulk = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', bulkLoad=True)
+        forumScrubberBulk.populateUserCache()
+        forumScrubberBulk.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        self.assertEqual(len(TestForumEtl.tinyForumGoldAnonymized), forumScrubberBulk.counter)
+        for rowNum, forumPost in enumerate(self.forumRows(forumScrubberBulk)):
+            self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testNonAnonymizedBulkLoad(self):
+        forumScrubberBulk = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', anonymize=False, bulkLoad=True)
+        forumScrubberBulk.populateUserCache()
+        forumScrubberBulk.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        for rowNum, forumPost in enumerate(self.forumRows(forumScrubberBulk)):
+            self.assertEqual(TestForumEtl.tinyForumGoldClear[rowNum], forumPost)
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testIncremental(self):
+        self.mysqldb.dropTable(EdxForumScrubber.WATERMARK_TABLE)
+        forumScrubberIncr = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', incremental=True)
+        forumScrubberIncr.populateUserCache()
+        forumScrubberIncr.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        forumScrubberIncr.saveWatermarks()
+        self.assertEqual(len(TestForumEtl.tinyForumGoldAnonymized), forumScrubberIncr.counter)
+
+        # Edit the harmless post, and post a new one, both
+        # after the watermark:
+        self.mongoDb.clearCollection()
+        currDir = os.path.dirname(__file__)
+        with open(os.path.join(currDir, 'data/tinyForum.json'), 'r') as jsonFd:
+            for line in jsonFd:
+                forumPost = json.loads(line)
+                if forumPost['body'] == 'Harmless body':
+                    forumPost['body'] = 'Edited harmless body'
+                    forumPost['updated_at'] = '2013-05-17T10:00:00.000Z'
+                    self.mongoDb.insert(forumPost)
+                    forumPost['_id'] = '519461555924670200000099'
+                    forumPost['body'] = 'New harmless body'
+                self.mongoDb.insert(forumPost)
+
+        forumScrubberIncr = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', incremental=True)
+        forumScrubberIncr.populateUserCache()
+        forumScrubberIncr.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        forumScrubberIncr.saveWatermarks()
+        bodies = [row[0] for row in self.mysqldb.query('SELECT body FROM unittest.contents')]
+        self.assertEqual(len(TestForumEtl.tinyForumGoldAnonymized) + 1, len(bodies))
+        self.assertIn('Edited harmless body', bodies)
+        self.assertIn('New harmless body', bodies)
+        self.assertNotIn('Harmless body', bodies)
+        # Besides the edited and the new post, only the phone number
+        # post, which is stamped exactly at the old watermark, is reloaded:
+        self.assertEqual(3, forumScrubberIncr.counter)
+        self.assertEqual(['2013-05-17T10:00:00.000Z'],
+                         [row[0] for row in self.mysqldb.query("SELECT watermark FROM unittest.%s" % EdxForumScrubber.WATERMARK_TABLE)])
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testBulkLoadFailureKeepsWatermarks(self):
+        self.mysqldb.dropTable(EdxForumScrubber.WATERMARK_TABLE)
+        forumScrubberIncr = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', incremental=True)
+        forumScrubberIncr.populateUserCache()
+        forumScrubberIncr.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        forumScrubberIncr.saveWatermarks()
+        watermarkQuery = "SELECT course_display_name, watermark FROM unittest.%s" % EdxForumScrubber.WATERMARK_TABLE
+        oldWatermarks = list(self.mysqldb.query(watermarkQuery))
+
+        # An edit after the watermark, which a failing LOAD DATA does not load:
+        self.mongoDb.clearCollection()
+        currDir = os.path.dirname(__file__)
+        with open(os.path.join(currDir, 'data/tinyForum.json'), 'r') as jsonFd:
+            for line in jsonFd:
+                forumPost = json.loads(line)
+                if forumPost['body'] == 'Harmless body':
+                    forumPost['body'] = 'Edited harmless body'
+                    forumPost['updated_at'] = '2013-05-17T10:00:00.000Z'
+                self.mongoDb.insert(forumPost)
+        loadCmds = []
+        def failingLoad(cmdArgs):
+            loadCmds.append(cmdArgs[-1])
+            return 1
+        forumScrubberBulk = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', incremental=True, bulkLoad=True)
+        forumScrubberBulk.populateUserCache()
+        subprocessCall = extractor.subprocess.call
+        extractor.subprocess.call = failingLoad
+        try:
+            forumScrubberBulk.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        finally:
+            extractor.subprocess.call = subprocessCall
+        forumScrubberBulk.saveWatermarks()
+        self.assertTrue(forumScrubberBulk.bulkLoadFailed)
+        self.assertEqual(oldWatermarks, list(self.mysqldb.query(watermarkQuery)))
+        # The spool file is kept for a manual load:
+        os.remove(re.search(r"INFILE '([^']+)'", loadCmds[0]).group(1))
+
+    @unittest.skipIf(not RUN_ALL_TESTS, 
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testResume(self):
+        # A run that dies while reading the fifth post, after
+        # two batches of two posts each were committed:
+        class DyingSource(object):
+            def __init__(self, mongoDb):
+                self.mongoDb = mongoDb
+            def query(self, mongoQuery):
+                for postNum, forumPost in enumerate(self.mongoDb.query(mongoQuery)):
+                    if postNum == 4:
+                        raise IOError('Connection lost')
+                    yield forumPost
+        forumScrubberDying = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', insertBatchSize=2)
+        forumScrubberDying.populateUserCache()
+        self.assertRaises(IOError, forumScrubberDying.forumMongoToRelational, DyingSource(self.mongoDb), self.mysqldb, 'contents')
+        self.assertEqual(4, forumScrubberDying.counter)
+
+        forumScrubberResumed = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', insertBatchSize=2, resume=True)
+        self.assertEqual(4, forumScrubberResumed.counter)
+        forumScrubberResumed.populateUserCache()
+        forumScrubberResumed.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        self.assertEqual(len(TestForumEtl.tinyForumGoldAnonymized), forumScrubberResumed.counter)
+        for rowNum, forumPost in enumerate(self.forumRows(forumScrubberResumed)):
+            self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
+        # The finished run leaves no checkpoint behind:
+        self.assertEqual([], list(self.mysqldb.query("SELECT * FROM unittest.%s WHERE forum_table = 'contents'" % EdxForumScrubber.CHECKPOINT_TABLE)))
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testResumeWithoutCheckpointPost(self):
+        # A run that dies after committing the first four posts:
+        class DyingSource(object):
+            def __init__(self, mongoDb):
+                self.mongoDb = mongoDb
+            def query(self, mongoQuery):
+                for postNum, forumPost in enumerate(self.mongoDb.query(mongoQuery)):
+                    if postNum == 4:
+                        raise IOError('Connection lost')
+                    yield forumPost
+        forumScrubberDying = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', insertBatchSize=2)
+        forumScrubberDying.populateUserCache()
+        self.assertRaises(IOError, forumScrubberDying.forumMongoToRelational, DyingSource(self.mongoDb), self.mysqldb, 'contents')
+
+        # The fourth post, which the checkpoint names, disappears:
+        self.mongoDb.clearCollection()
+        currDir = os.path.dirname(__file__)
+        with open(os.path.join(currDir, 'data/tinyForum.json'), 'r') as jsonFd:
+            for line in jsonFd:
+                forumPost = json.loads(line)
+                if forumPost['_id'] != '519461555924670200000008':
+                    self.mongoDb.insert(forumPost)
+        forumScrubberResumed = EdxForumScrubber(None, mysqlDbObj=self.mysqldb, forumTableName='contents', allUsersTableName='unittest.UserGrade', insertBatchSize=2, resume=True)
+        forumScrubberResumed.populateUserCache()
+        self.assertRaises(ValueError, forumScrubberResumed.forumMongoToRelational, self.mongoDb, self.mysqldb, 'contents')
+        # Nothing was loaded, and the checkpoint is kept:
+        self.assertEqual(4, forumScrubberResumed.counter)
+        self.assertEqual(1, len(list(self.mysqldb.query("SELECT * FROM unittest.%s WHERE forum_table = 'contents'" % EdxForumScrubber.CHECKPOINT_TABLE))))
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testAnonymizedPostersOnly(self):
+        authorIds = self.forumScrubberAnonymized.collectAuthorIds(self.mongoDb)
+        self.assertEqual(set([5, 7, 10]), authorIds)
+        # A .bson file of the same posts has the same authors:
+        tmpDir = tempfile.mkdtemp(prefix='forumEtlTest')
+        try:
+            bsonFileName = os.path.join(tmpDir, 'tinyForum.bson')
+            with open(bsonFileName, 'wb') as bsonFd:
+                for forumPost in self.mongoDb.query({}):
+                    bsonFd.write(bson.BSON.encode(forumPost))
+            self.assertEqual(authorIds, self.forumScrubberAnonymized.collectAuthorIds(BsonFileReader(bsonFileName)))
+        finally:
+            shutil.rmtree(tmpDir)
+        # Add a user who never posted, who must not be loaded:
+        self.mysqldb.execute("INSERT INTO UserGrade (name,screen_name,user_int_id,anon_screen_name) VALUES ('Silent Sam','samS',11,'jkl')")
+        self.forumScrubberAnonymized.populateUserCache(authorIds)
+        self.assertEqual(sorted(authorIds), sorted(self.forumScrubberAnonymized.userCache.keys()))
+        self.forumScrubberAnonymized.forumMongoToRelational(self.mongoDb, self.mysqldb, 'contents')
+        for rowNum, forumPost in enumerate(self.forumRows(self.forumScrubberAnonymized)):
+            self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
+
+    def forumRows(self, forumScrubber):
+        '''
+        Return the rows of unittest.contents without their forum_uid,
+        which EdxPrivate.idInt2Forum() computes from a salt that
+        the tests do not know.
+        '''
+        colNames = [colName for colName in forumScrubber.forumSchema.keys() if colName != 'forum_uid']
+        return self.mysqldb.query('SELECT %s FROM unittest.contents' % ','.join(colNames))
 
-    
     def resetMongoTestDb(self):
         self.mongoDb.clearCollection()
         # Use small, known forum collection:
@@ -0,0 +1,64 @@
+'''
+Tests for the SQLite backed IdentityCache.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from identity_cache import IdentityCache
+
+
+class TestIdentityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cachePath = os.path.join(self.tmpDir, 'identities.sqlite')
+        self.identityCache = IdentityCache(self.cachePath)
+        self.queried = []
+
+    def tearDown(self):
+        self.identityCache.close()
+        shutil.rmtree(self.tmpDir)
+
+    def queryMisses(self, keys):
+        # Stand-in for a MySQL function; knows no key above 100:
+        self.queried.append(sorted(keys))
+        return dict([(key, 'uid%d' % key if key <= 100 else None) for key in keys])
+
+    def testLookupQueriesMissesOnly(self):
+        self.assertEqual({1 : 'uid1', 2 : 'uid2', 200 : None},
+                         self.identityCache.lookup('idInt2Forum', '1', [1, 2, 200], self.queryMisses))
+        self.assertEqual({1 : 'uid1', 3 : 'uid3', 200 : None},
+                         self.identityCache.lookup('idInt2Forum', '1', [1, 3, 200], self.queryMisses))
+        # Unmapped keys are asked again:
+        self.assertEqual([[1, 2, 200], [3, 200]], self.queried)
+        self.assertEqual((1, 5), (self.identityCache.numHits, self.identityCache.numMisses))
+
+    def testPersistsAcrossInstances(self):
+        self.identityCache.lookup('idInt2Forum', '1', [5, 6], self.queryMisses)
+        self.identityCache.close()
+        otherCache = IdentityCache(self.cachePath)
+        self.assertEqual({5 : 'uid5', 6 : 'uid6'}, otherCache.lookup('idInt2Forum', '1', [5, 6], self.queryMisses))
+        otherCache.close()
+        self.assertEqual([[5, 6]], self.queried)
+
+    def testNamespacesAndVersions(self):
+        self.identityCache.prefill('idInt2Forum', '1', [(7, 'old7')])
+        self.identityCache.prefill('ltiToUserIntId', '1', [(u'7', 77)])
+        self.assertEqual({7 : 'old7'}, self.identityCache.getMany('idInt2Forum', '1', [7]))
+        self.assertEqual({'7' : 77}, self.identityCache.getMany('ltiToUserIntId', '1', ['7']))
+        # A new function version does not see the old entries:
+        self.assertEqual({}, self.identityCache.getMany('idInt2Forum', '2', [7]))
+        self.assertEqual({7 : 'uid7'}, self.identityCache.lookup('idInt2Forum', '2', [7], self.queryMisses))
+        self.assertEqual({7 : 'old7'}, self.identityCache.getMany('idInt2Forum', '1', [7]))
+
+    def testBulkPrefill(self):
+        numStored = self.identityCache.prefill('idInt2Forum', '1', ((userIntId, 'uid%d' % userIntId) for userIntId in xrange(25000)))
+        self.assertEqual(25000, numStored)
+        cached = self.identityCache.getMany('idInt2Forum', '1', range(24990, 25010))
+        self.assertEqual(10, len(cached))
+        self.assertEqual('uid24999', cached[24999])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+'''
+Tests for the LOAD DATA spool file escaping in mysql_tsv.
+'''
+import re
+import unittest
+
+from mysql_tsv import TsvSpoolFile, sqlLiteralUnescape, tsvField
+
+
+# What LOAD DATA does with a field in MySQL's default
+# format (ESCAPED BY '\\'), for checking round trips:
+LOAD_DATA_ESCAPES = {'0' : '\0', 'b' : '\b', 'n' : '\n', 'r' : '\r', 't' : '\t', 'Z' : '\x1a'}
+
+def loadDataUnescape(field):
+    if field == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda match: LOAD_DATA_ESCAPES.get(match.group(1), match.group(1)), field.decode('UTF-8'))
+
+
+class TestMySqlTsv(unittest.TestCase):
+
+    def testSqlLiteralUnescape(self):
+        self.assertEqual('Body with "quotes".', sqlLiteralUnescape('Body with \\"quotes\\".'))
+        self.assertEqual('back\\slash', sqlLiteralUnescape('back\\\\slash'))
+        self.assertEqual('100\\% sure', sqlLiteralUnescape('100\\% sure'))
+        self.assertEqual('Plain body', sqlLiteralUnescape('Plain body'))
+
+    def testRoundTrip(self):
+        # Each value as it would appear inside the double quotes
+        # of an INSERT literal, and the cell content MySQL stores:
+        literalsAndCells = [(u'Harmless body', u'Harmless body'),
+                            (u'He said \\"hi\\"', u'He said "hi"'),
+                            (u'Tab\there, newline\nthere', u'Tab\there, newline\nthere'),
+                            (u'C:\\\\temp\\\\new', u'C:\\temp\\new'),
+                            (u'Caf\xe9 \u2013 ok', u'Caf\xe9 \u2013 ok'),
+                            ('utf-8 bytes: caf\xc3\xa9', u'utf-8 bytes: caf\xe9'),
+                            ]
+        for literal, cell in literalsAndCells:
+            self.assertEqual(cell, loadDataUnescape(tsvField(literal)))
+        self.assertEqual(None, loadDataUnescape(tsvField(None)))
+        self.assertEqual(u'10', loadDataUnescape(tsvField(10L)))
+
+    def testFieldsStayOnOneLine(self):
+        field = tsvField(u'one\ttwo\nthree\r\n')
+        self.assertNotIn('\t', field)
+        self.assertNotIn('\n', field)
+        self.assertNotIn('\r', field)
+
+    def testSpoolFile(self):
+        spoolFile = TsvSpoolFile()
+        try:
+            spoolFile.writeRow([u'abc', None, 5, u'two\nlines'])
+            spoolFile.writeRow([u'def', u'x', 7, u''])
+            spoolFile.close()
+            with open(spoolFile.name, 'rb') as spoolFd:
+                rows = [[loadDataUnescape(field) for field in line.rstrip('\n').split('\t')] for line in spoolFd]
+            self.assertEqual([[u'abc', None, u'5', u'two\nlines'],
+                              [u'def', u'x', u'7', u'']],
+                             rows)
+            self.assertEqual(2, spoolFile.numRows)
+        finally:
+            spoolFile.remove()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+'''
+Tests for the Aho-Corasick roster name matcher.
+'''
+import random
+import string
+import time
+import unittest
+
+from name_matcher import RosterNameMatcher
+
+
+class TestNameMatcher(unittest.TestCase):
+
+    def testWholeCapitalizedWords(self):
+        matcher = RosterNameMatcher(['Theo', 'Will', 'Ann', 'Joann'])
+        self.assertEqual('Ask <nameRedac> about Theology; he will know.',
+                         matcher.redact('Ask Theo about Theology; he will know.'))
+        self.assertEqual('<nameRedac> and <nameRedac>, not Annabel.',
+                         matcher.redact('Joann and Ann, not Annabel.'))
+        self.assertEqual('THEO_X and <nameRedac>!',
+                         matcher.redact('THEO_X and WILL!'))
+
+    def testOverlappingNames(self):
+        # Leftmost, then longest hit wins:
+        matcher = RosterNameMatcher(['Mary', 'Mary Ann', 'Ann Lee'])
+        self.assertEqual([(0, 8)], matcher.findNames('Mary Ann'))
+        self.assertEqual('<nameRedac> Lee', matcher.redact('Mary Ann Lee'))
+
+    def testSuffixNames(self):
+        # Names that are suffixes of other names are found via output links:
+        matcher = RosterNameMatcher(['Christina', 'Tina', 'Ina'])
+        self.assertEqual('<nameRedac>, <nameRedac>, <nameRedac>',
+                         matcher.redact('Christina, Tina, Ina'))
+
+    def testUnicodeAndShortNames(self):
+        matcher = RosterNameMatcher([u'Jos\xe9', 'A', ''])
+        self.assertEqual(1, len(matcher))
+        self.assertEqual('Hi <nameRedac>, A.', matcher.redact('Hi Jos\xc3\xa9, A.'))
+        self.assertEqual('Hi Jos\xc3\xa9phine', matcher.redact('Hi Jos\xc3\xa9phine'))
+
+    def testNonAsciiCapitals(self):
+        # Capitalization is judged on the decoded first character:
+        matcher = RosterNameMatcher([u'\xc9lodie', u'\xd8ystein'])
+        self.assertEqual('Ask <nameRedac> and <nameRedac>.',
+                         matcher.redact('Ask \xc3\x89lodie and \xc3\x98ystein.'))
+        self.assertEqual('Ask \xc3\xa9lodie.', matcher.redact('Ask \xc3\xa9lodie.'))
+
+    def testLargeRoster(self):
+        # Scan time must not grow with the roster size:
+        rand = random.Random(4)
+        names = set()
+        while len(names) < 20000:
+            names.add(''.join(rand.choice(string.ascii_lowercase) for _ in range(rand.randint(3, 9))).capitalize())
+        matcher = RosterNameMatcher(names)
+        name = sorted(names)[500]
+        body = ('Some harmless words with %s in between. ' % name) * 1000
+        startTime = time.time()
+        redacted = matcher.redact(body)
+        self.assertLess(time.time() - startTime, 2.0)
+        self.assertNotIn(name + ' ', redacted)
+
+if __name__ == "__main__":
+    unittest.main()
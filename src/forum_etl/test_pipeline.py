@@ -0,0 +1,85 @@
+'''
+Tests for the pipeline stage threads.
+'''
+import threading
+import time
+import unittest
+
+from pipeline import BackgroundConsumer, BackgroundIterator
+
+
+class Failing(Exception):
+    pass
+
+def failingSource(numItems):
+    for item in range(numItems):
+        yield item
+    raise Failing('source died')
+
+
+class TestPipeline(unittest.TestCase):
+
+    def testBackgroundIterator(self):
+        reader = BackgroundIterator(iter(range(1000)), 10)
+        self.assertEqual(range(1000), list(reader))
+        reader.close()
+
+    def testReaderIsBounded(self):
+        numProduced = [0]
+        def countingSource():
+            for item in range(100):
+                numProduced[0] += 1
+                yield item
+        reader = BackgroundIterator(countingSource(), 10)
+        readerIter = iter(reader)
+        readerIter.next()
+        time.sleep(0.2)
+        # The chunk being consumed, 10 items queued, and
+        # the chunk waiting to be queued:
+        self.assertTrue(numProduced[0] <= 20)
+        reader.close()
+        self.assertFalse(reader.thread.is_alive())
+
+    def testReaderFailure(self):
+        reader = BackgroundIterator(failingSource(3), 10)
+        items = []
+        try:
+            for item in reader:
+                items.append(item)
+            self.fail('Exception of the source was not raised.')
+        except Failing:
+            pass
+        self.assertEqual([0, 1, 2], items)
+        reader.close()
+
+    def testBackgroundConsumer(self):
+        consumed = []
+        consumerThreads = set()
+        def consume(item):
+            consumed.append(item)
+            consumerThreads.add(threading.current_thread().name)
+        writer = BackgroundConsumer(consume, 3, 'testWriter')
+        for item in range(500):
+            writer.put(item)
+        writer.finish()
+        self.assertEqual(range(500), consumed)
+        self.assertEqual(set(['testWriter']), consumerThreads)
+        writer.close()
+
+    def testConsumerFailure(self):
+        def consume(item):
+            if item == 5:
+                raise Failing('insert failed')
+        writer = BackgroundConsumer(consume, 2)
+        try:
+            for item in range(100):
+                writer.put(item)
+            writer.finish()
+            self.fail('Exception of the consumer was not raised.')
+        except Failing:
+            pass
+        writer.close()
+        self.assertFalse(writer.thread.is_alive())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+'''
+Tests for the post body detectors in the redaction module.
+'''
+import time
+import unittest
+
+import re
+
+from redaction import PosterRedactorCache, namePattern, redactBody, redactEmails, scannerPattern, subEither
+from redaction_benchmark import ADVERSARIAL_BODIES, legacyRedactEmails
+
+
+class TestRedaction(unittest.TestCase):
+
+    def testEmailAsLegacy(self):
+        # Single-address lines come out as they did
+        # with the original pattern:
+        for body in ['Body with joe@comcast.com email.',
+                     'Write to  jane.doe-x@cs.stanford.edu   soon',
+                     'Ends with (f.b@mit.edu',
+                     ]:
+            self.assertEqual(legacyRedactEmails(body), redactEmails(body))
+        self.assertEqual(' Body with <emailRedac> email.', redactEmails('Body with joe@comcast.com email.'))
+
+    def testNoEmail(self):
+        for body in ['No address here.',
+                     'Twitter handle @someone',
+                     'Not redacted: joe@comcast.org',
+                     ]:
+            self.assertEqual(body, redactEmails(body))
+
+    def testAllAddressesKept(self):
+        # The original pattern only redacted the last address
+        # of a line, and dropped lines without an address:
+        body = 'First line\nMail a@x.com or b@y.edu today\njoe@z.com'
+        self.assertEqual(' First line\nMail <emailRedac> or <emailRedac> today\n <emailRedac> ',
+                         redactEmails(body))
+
+    def testAdversarialBodiesBounded(self):
+        # The original pattern needs many seconds for each of
+        # these bodies; a linear scan needs milliseconds:
+        for bodyKind, makeBody in ADVERSARIAL_BODIES.items():
+            body = makeBody(256 * 1024)
+            startTime = time.time()
+            redacted = redactEmails(body)
+            self.assertLess(time.time() - startTime, 1.0, 'Slow email redaction for %s bodies' % bodyKind)
+            self.assertIn('<emailRedac>', redacted)
+            self.assertNotIn('comcast.com', redacted)
+
+    def testRedactBodyTokens(self):
+        nameToken = '<nameRedac_abc>'
+        self.assertEqual('Body with <phoneRedac> a phone number.',
+                         redactBody('Body with 650-333-4567 a phone number.'))
+        self.assertEqual('Ship to <zipRedac> and <zipRedac>.',
+                         redactBody('Ship to 94305 and 02139-4307.'))
+        self.assertEqual(' Body with <emailRedac> email.',
+                         redactBody('Body with joe@comcast.com email.'))
+        self.assertEqual('Body with poster screen name <nameRedac_abc> <nameRedac_abc> <nameRedac_abc> embedded.',
+                         redactBody('Body with poster screen name Otto van Homberg embedded.',
+                                    posterNames=u'Otto van Homberg'.split(), screenName='otto_king', nameToken=nameToken))
+        self.assertEqual('Body with poster screen name <nameRedac_abc> embedded.',
+                         redactBody('Body with poster screen name otto_king embedded.',
+                                    posterNames=['Otto', 'King'], screenName='otto_king', nameToken=nameToken))
+
+    def testRedactBodyAllAtOnce(self):
+        body = 'Otto here: call 650-333-4567, mail otto@mit.edu, zip 94305. Theology, not Theo.'
+        self.assertEqual(' <nameRedac> here: call <phoneRedac>, mail <emailRedac> , zip <zipRedac>. Theology, not <nameRedac>.',
+                         redactBody(body, posterNames=['Otto', 'Theo']))
+
+    def testRedactBodyPrefilters(self):
+        # Names shorter than three characters are left alone, and
+        # bodies without candidates are returned unchanged:
+        self.assertEqual('Al said hi', redactBody('Al said hi', posterNames=['Al']))
+        body = 'Nothing to see here.'
+        self.assertIs(body, redactBody(body, posterNames=['Otto'], screenName='otto_king'))
+
+    def testOnlyNamesIgnoreCase(self):
+        # As with the individual detectors, the email and phone
+        # detectors are case sensitive, while names are not:
+        self.assertEqual('Mail JOE@COMCAST.COM or call 650-333-4567 EXT 12',
+                         redactEmails('Mail JOE@COMCAST.COM or call 650-333-4567 EXT 12'))
+        self.assertEqual('Mail JOE@COMCAST.COM or call <phoneRedac> EXT 12, <nameRedac>',
+                         redactBody('Mail JOE@COMCAST.COM or call 650-333-4567 EXT 12, OTTO', posterNames=['Otto']))
+        self.assertEqual('<nameRedac> and <nameRedac>',
+                         redactBody('otto_king and OTTO_King', screenName='Otto_King'))
+
+    def testNonAsciiBodyWithUnicodeNames(self):
+        # Names come from the user cache as Unicode; bodies are UTF-8:
+        self.assertEqual('Gr\xc3\xbc\xc3\x9fe, <nameRedac_abc>! caf\xc3\xa9 <nameRedac_abc>',
+                         redactBody('Gr\xc3\xbc\xc3\x9fe, Otto! caf\xc3\xa9 otto_king',
+                                    posterNames=u'Otto van Homberg'.split(), screenName=u'otto_king', nameToken='<nameRedac_abc>'))
+
+    def testScreenNameIsLiteral(self):
+        # Screen names are not regular expressions:
+        self.assertEqual('j.doe wrote <nameRedac>',
+                         redactBody('j.doe wrote j+doe', screenName='j+doe'))
+
+    def testNamesScannedSeparately(self):
+        # Scanning names apart from the fixed detectors gives
+        # the same result as one alternation of all of them:
+        combined = re.compile('%s|%s' % (scannerPattern(True, True), namePattern(['Otto', 'King'], 'otto_king')))
+        replace = lambda match: '<%s>' % match.lastgroup
+        for body in ['otto_king@mit.edu and Otto 94305',
+                     'Otto Otto_king 650-333-4567x12 king',
+                     ' ottoking@comcast.com  otto_king 02139 4307',
+                     ]:
+            self.assertEqual(combined.sub(replace, body),
+                             subEither(re.compile(scannerPattern(True, True)),
+                                       re.compile(namePattern(['Otto', 'King'], 'otto_king')),
+                                       replace,
+                                       body))
+
+    def testPosterRedactorCache(self):
+        cache = PosterRedactorCache(maxPosters=2)
+        ottoRedactor = cache.get(1, ['Otto', 'King'], 'otto_king')
+        self.assertEqual('Hi, <nameRedac_1> here', ottoRedactor.redact('Hi, Otto here', '<nameRedac_1>'))
+        self.assertIs(ottoRedactor, cache.get(1, ['Otto', 'King'], 'otto_king'))
+        cache.get(2, ['Jane'])
+        # Poster 1 was used more recently than poster 2,
+        # so adding poster 3 evicts poster 2:
+        cache.get(1)
+        cache.get(3, ['Theo'])
+        self.assertEqual(2, len(cache))
+        self.assertIs(ottoRedactor, cache.get(1))
+        self.assertIsNot(None, cache.get(2))
+        self.assertEqual(3, cache.hits)
+        self.assertEqual(4, cache.misses)
+
+if __name__ == "__main__":
+    unittest.main()
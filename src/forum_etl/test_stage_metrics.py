@@ -0,0 +1,70 @@
+'''
+Tests for the per-stage metrics of ETL runs.
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from stage_metrics import StageMetrics
+
+
+class TestStageMetrics(unittest.TestCase):
+
+    def testReport(self):
+        metrics = StageMetrics()
+        for millis in range(1, 101):
+            metrics.record('redaction', millis / 1000.0)
+        # One batch of 10 records, 2ms each:
+        metrics.record('insert', 0.02, 10)
+        metricsReport = metrics.report()
+        self.assertEqual(['redaction', 'insert'], [stage['stage'] for stage in metricsReport['stages']])
+        redaction, insert = metricsReport['stages']
+        self.assertEqual(100, redaction['records'])
+        self.assertEqual(50.0, redaction['p50Ms'])
+        self.assertEqual(99.0, redaction['p99Ms'])
+        self.assertEqual(round(100 / 5.05, 1), redaction['recordsPerSec'])
+        self.assertEqual(10, insert['records'])
+        self.assertEqual(2.0, insert['p99Ms'])
+
+    def testSampleSizeBounded(self):
+        metrics = StageMetrics(sampleSize=100)
+        for _ in range(1000):
+            metrics.record('read', 0.001)
+        self.assertEqual(100, len(metrics.samples['read']))
+        self.assertEqual(1000, metrics.report()['stages'][0]['records'])
+
+    def testTimedIterAndMerge(self):
+        metrics = StageMetrics()
+        self.assertEqual([1, 2, 3], list(metrics.timedIter('read', [1, 2, 3])))
+        workerMetrics = StageMetrics()
+        workerMetrics.record('prepareRecord', 0.004, 2)
+        metrics.merge(workerMetrics.totals, workerMetrics.samples)
+        metricsReport = metrics.report()
+        self.assertEqual([('read', 3), ('prepareRecord', 2)],
+                         [(stage['stage'], stage['records']) for stage in metricsReport['stages']])
+
+    def testWrite(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            jsonPath = os.path.join(tmpDir, 'metrics.json')
+            promPath = os.path.join(tmpDir, 'forum_etl.prom')
+            metrics = StageMetrics(jsonPath, promPath, writeInterval=3600, labels={'dump' : 'course.bson'})
+            metrics.record('insert', 0.5, 100)
+            # Too early for a periodic write:
+            metrics.maybeWrite()
+            self.assertFalse(os.path.exists(jsonPath))
+            metrics.write()
+            with open(jsonPath) as jsonFile:
+                self.assertEqual(200.0, json.load(jsonFile)['stages'][0]['recordsPerSec'])
+            with open(promPath) as promFile:
+                promLines = promFile.read().splitlines()
+            self.assertIn('forum_etl_stage_records_total{dump="course.bson",stage="insert"} 100.0', promLines)
+            self.assertIn('forum_etl_stage_record_latency_seconds{dump="course.bson",quantile="0.99",stage="insert"} 0.005', promLines)
+            self.assertEqual(['forum_etl.prom', 'metrics.json'], sorted(os.listdir(tmpDir)))
+        finally:
+            shutil.rmtree(tmpDir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+'''
+Tests for the array-backed CompactUserCache.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from user_cache import CompactUserCache, loadSnapshot
+
+
+class TestUserCache(unittest.TestCase):
+
+    def setUp(self):
+        self.userCache = CompactUserCache()
+        self.userCache.add(5, (u'Otto van Homberg', u'otto_king', u'abc', u'1234'))
+        self.userCache.add(7, (u'Andreas Fritz', u'fritzL', u'def', None))
+        self.userCache.add(10, (u'Andreas Fritz', 'bebeW', 'ghi', '5678'))
+        self.userCache.finish()
+
+    def testGet(self):
+        self.assertEqual((u'Otto van Homberg', u'otto_king', u'abc', u'1234'), self.userCache.get(5))
+        self.assertEqual((u'Andreas Fritz', u'fritzL', u'def', None), self.userCache.get(7))
+        self.assertEqual(('', '', '', None), self.userCache.get(6, ('', '', '', None)))
+        self.assertEqual(None, self.userCache.get(11))
+        self.assertIn(10, self.userCache)
+        self.assertNotIn(1, self.userCache)
+        self.assertEqual([5, 7, 10], self.userCache.keys())
+        self.assertEqual(3, len(self.userCache))
+
+    def testUnsortedAndRepeatedIds(self):
+        userCache = CompactUserCache()
+        userCache.add(10, (u'Bebe Winter', u'bebeW', u'ghi', None))
+        userCache.add(3, (u'Caf\xe9 Owner', u'cafe', u'jkl', None))
+        userCache.add(10, (u'Bebe Summer', u'bebeS', u'mno', None))
+        userCache.finish()
+        self.assertEqual([3, 10], userCache.keys())
+        self.assertEqual(u'Caf\xe9 Owner', userCache.get(3)[0])
+        # The later entry for an id wins:
+        self.assertEqual(u'Bebe Summer', userCache.get(10)[0])
+
+    def testFirstNames(self):
+        # Each distinct first name once:
+        self.assertEqual([u'Otto', u'Andreas'], list(self.userCache.firstNames()))
+
+    def testSnapshot(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            snapshotPath = os.path.join(tmpDir, 'userCache.snap')
+            self.assertIsNone(loadSnapshot(snapshotPath, 'rows=3'))
+            self.userCache.saveSnapshot(snapshotPath, 'rows=3')
+            mappedCache = loadSnapshot(snapshotPath, 'rows=3')
+            for userIntId in [5, 7, 10]:
+                self.assertEqual(self.userCache.get(userIntId), mappedCache.get(userIntId))
+            self.assertIsNone(mappedCache.get(6))
+            self.assertNotIn(11, mappedCache)
+            self.assertEqual([5, 7, 10], mappedCache.keys())
+            self.assertEqual([u'Otto', u'Andreas'], list(mappedCache.firstNames()))
+            mappedCache.close()
+            # The user table changed since the snapshot was taken:
+            self.assertIsNone(loadSnapshot(snapshotPath, 'rows=4'))
+            # Truncated snapshot:
+            with open(snapshotPath, 'r+b') as snapshotFile:
+                snapshotFile.truncate(os.path.getsize(snapshotPath) - 1)
+            self.assertIsNone(loadSnapshot(snapshotPath, 'rows=3'))
+        finally:
+            shutil.rmtree(tmpDir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,336 @@
+'''
+Compact storage for the user cache of EdxForumScrubber.
+
+A dict of per-user Python lists costs several hundred bytes per
+user, which adds up to gigabytes for the full UserGrade table.
+CompactUserCache instead keeps:
+
+    - a sorted array of user_int_ids,
+    - for each user and each of the fields full name, screen_name,
+      anon_screen_name, and forum_uid: start and length of the
+      field's UTF-8 bytes in one shared string buffer,
+    - one byte per user that marks the fields that are NULL.
+
+Values are not deduplicated: nearly all of them are unique per
+user, and an index of the distinct values would more than double
+the memory needed while the cache is built. Lookups binary-search
+the id array, and return the same (fullName, screen_name,
+anon_screen_name, forum_uid) tuple that the original dict held as
+a list.
+
+A finished cache can be saved to a snapshot file that holds the
+same arrays and buffer. loadSnapshot() memory-maps such a file,
+and lookups then read straight from the mapped pages: opening a
+snapshot of a million users takes milliseconds, and processes that
+map the same file share its pages. Each snapshot records a change
+marker of the user table it was built from, such as its row count
+and highest user_int_id; a snapshot whose marker differs from the
+current one is ignored.
+'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+import mmap
+import os
+import struct
+import sys
+
+
+class CompactUserCache(object):
+    '''
+    Read-only user cache with a dict-like get(). Fill it with
+    add() in increasing user_int_id order, if possible, and call
+    finish() before the first lookup.
+    '''
+
+    # Fields stored per user, in tuple order:
+    FIELDS = ('name', 'screen_name', 'anon_screen_name', 'forum_uid')
+
+    def __init__(self):
+        self.ids = array('l')
+        # Per user, len(FIELDS) entries each:
+        self.starts = array('L')
+        self.lengths = array('L')
+        # Per user: bit i set if field i is NULL:
+        self.nullFlags = bytearray()
+        self.buf = bytearray()
+        self.isSorted = True
+
+    def add(self, userIntId, fieldValues):
+        '''
+        Add one user.
+
+        :param userIntId: the user's user_int_id
+        :type userIntId: int
+        :param fieldValues: full name, screen_name, anon_screen_name, forum_uid;
+            each a string or None
+        :type fieldValues: ({str | unicode | None})
+        '''
+        if len(self.ids) > 0 and userIntId <= self.ids[-1]:
+            self.isSorted = False
+        self.ids.append(userIntId)
+        nullFlags = 0
+        for fieldIndex, value in enumerate(fieldValues):
+            if value is None:
+                nullFlags |= 1 << fieldIndex
+                self.starts.append(0)
+                self.lengths.append(0)
+                continue
+            if isinstance(value, unicode):
+                value = value.encode('UTF-8')
+            else:
+                value = str(value)
+            self.starts.append(len(self.buf))
+            self.lengths.append(len(value))
+            self.buf.extend(value)
+        self.nullFlags.append(nullFlags)
+
+    def finish(self):
+        '''
+        Sort the users by user_int_id if they were not added in
+        order. If an id was added more than once, the last entry wins.
+        '''
+        if self.isSorted:
+            return
+        numFields = len(CompactUserCache.FIELDS)
+        # Stable sort, so that among equal ids the last added comes last:
+        order = sorted(xrange(len(self.ids)), key=self.ids.__getitem__)
+        ids = array('l')
+        starts = array('L')
+        lengths = array('L')
+        nullFlags = bytearray()
+        for pos, userPos in enumerate(order):
+            if pos + 1 < len(order) and self.ids[order[pos + 1]] == self.ids[userPos]:
+                # Superseded by a later entry for the same id:
+                continue
+            ids.append(self.ids[userPos])
+            starts.extend(self.starts[userPos * numFields:(userPos + 1) * numFields])
+            lengths.extend(self.lengths[userPos * numFields:(userPos + 1) * numFields])
+            nullFlags.append(self.nullFlags[userPos])
+        (self.ids, self.starts, self.lengths, self.nullFlags) = (ids, starts, lengths, nullFlags)
+        self.isSorted = True
+
+    def position(self, userIntId):
+        '''
+        Return the index of the given user in self.ids, or -1.
+        '''
+        pos = bisect_left(self.ids, userIntId)
+        if pos < len(self.ids) and self.ids[pos] == userIntId:
+            return pos
+        return -1
+
+    def fieldValue(self, pos, fieldIndex):
+        '''
+        Return one field of the user at index pos as Unicode, or None.
+        '''
+        if self.nullFlags[pos] & (1 << fieldIndex):
+            return None
+        valueIndex = pos * len(CompactUserCache.FIELDS) + fieldIndex
+        start = self.starts[valueIndex]
+        return self.buf[start:start + self.lengths[valueIndex]].decode('UTF-8', 'replace')
+
+    def get(self, userIntId, default=None):
+        '''
+        Return (fullName, screen_name, anon_screen_name, forum_uid)
+        of the given user, or default if the user is unknown.
+
+        :param userIntId: the user's user_int_id
+        :type userIntId: int
+        '''
+        pos = self.position(userIntId)
+        if pos < 0:
+            return default
+        return tuple([self.fieldValue(pos, fieldIndex) for fieldIndex in range(len(CompactUserCache.FIELDS))])
+
+    def firstNames(self):
+        '''
+        Generator of the distinct first names of all users.
+        '''
+        seen = set()
+        for pos in xrange(len(self.ids)):
+            fullName = self.fieldValue(pos, 0)
+            if not fullName:
+                continue
+            nameParts = fullName.split()
+            if len(nameParts) > 0 and nameParts[0] not in seen:
+                seen.add(nameParts[0])
+                yield nameParts[0]
+
+    def keys(self):
+        return self.ids.tolist()
+
+    def saveSnapshot(self, snapshotPath, marker):
+        '''
+        Write the finished cache to a snapshot file that loadSnapshot()
+        can map. The file is written under a temporary name, and then
+        renamed, so that readers never see a partial snapshot.
+
+        :param snapshotPath: path of the snapshot file
+        :type snapshotPath: str
+        :param marker: change marker of the user table the cache was built from
+        :type marker: str
+        '''
+        self.finish()
+        header = struct.pack(SNAPSHOT_HEADER_FORMAT,
+                             SNAPSHOT_MAGIC,
+                             SNAPSHOT_VERSION,
+                             self.ids.itemsize,
+                             self.starts.itemsize,
+                             sys.byteorder == 'little',
+                             len(self.ids),
+                             len(self.buf),
+                             len(marker))
+        tmpPath = '%s.tmp%d' % (snapshotPath, os.getpid())
+        with open(tmpPath, 'wb') as snapshotFile:
+            snapshotFile.write(header)
+            snapshotFile.write(marker)
+            for section in (self.ids, self.starts, self.lengths, self.nullFlags):
+                writePadding(snapshotFile)
+                snapshotFile.write(section)
+            writePadding(snapshotFile)
+            snapshotFile.write(self.buf)
+        os.rename(tmpPath, snapshotPath)
+
+    def __contains__(self, userIntId):
+        return self.position(userIntId) >= 0
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# Snapshot file layout: header, marker, and then ids, starts, lengths,
+# nullFlags, and buf, each starting at a multiple of SNAPSHOT_ALIGNMENT.
+# Arrays are stored in the writing machine's native format, which the
+# header records:
+SNAPSHOT_MAGIC = 'FUCSNAP\0'
+SNAPSHOT_VERSION = 1
+# Magic, version, id item size, offset item size, little endian,
+# number of users, buffer length, marker length:
+SNAPSHOT_HEADER_FORMAT = '=8sIBB?xQQI'
+SNAPSHOT_ALIGNMENT = 8
+
+
+class MappedArray(object):
+    '''
+    Read-only array view of a section of a memory-mapped
+    snapshot. Elements are unpacked on access.
+    '''
+
+    def __init__(self, mappedFile, offset, typeCode, length):
+        self.mappedFile = mappedFile
+        self.offset = offset
+        self.format = '@' + typeCode
+        self.itemsize = struct.calcsize(self.format)
+        self.length = length
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.length:
+            raise IndexError(index)
+        return struct.unpack_from(self.format, self.mappedFile, self.offset + index * self.itemsize)[0]
+
+    def __len__(self):
+        return self.length
+
+    def unpackRange(self, start, count):
+        '''
+        Return a tuple of the count elements from index start on.
+        '''
+        count = max(0, min(count, self.length - start))
+        return struct.unpack_from('@%d%s' % (count, self.format[1:]), self.mappedFile, self.offset + start * self.itemsize)
+
+    def tolist(self):
+        return list(self.unpackRange(0, self.length))
+
+
+class MappedUserCache(CompactUserCache):
+    '''
+    CompactUserCache whose arrays and buffer are sections of a
+    memory-mapped snapshot file. Obtained from loadSnapshot().
+    '''
+
+    # Users per block of the in-memory id index:
+    ID_BLOCK_SIZE = 64
+
+    def __init__(self, mappedFile, numUsers, bufLen, sectionsOffset):
+        self.mappedFile = mappedFile
+        self.isSorted = True
+        numValues = numUsers * len(CompactUserCache.FIELDS)
+        sections = []
+        offset = sectionsOffset
+        for typeCode, length in (('l', numUsers), ('L', numValues), ('L', numValues), ('B', numUsers)):
+            offset = alignedOffset(offset)
+            sections.append(MappedArray(mappedFile, offset, typeCode, length))
+            offset += length * sections[-1].itemsize
+        (self.ids, self.starts, self.lengths, self.nullFlags) = sections
+        offset = alignedOffset(offset)
+        if offset + bufLen > len(mappedFile):
+            raise ValueError('User cache snapshot is truncated.')
+        self.buf = buffer(mappedFile, offset, bufLen)
+        # First id of each block of ID_BLOCK_SIZE users, so that a
+        # lookup unpacks only one block of the mapped id array:
+        self.blockFirstIds = array('l', [self.ids[pos] for pos in xrange(0, numUsers, MappedUserCache.ID_BLOCK_SIZE)])
+
+    def position(self, userIntId):
+        '''
+        Return the index of the given user in self.ids, or -1.
+        '''
+        block = bisect_right(self.blockFirstIds, userIntId) - 1
+        if block < 0:
+            return -1
+        blockStart = block * MappedUserCache.ID_BLOCK_SIZE
+        blockIds = self.ids.unpackRange(blockStart, MappedUserCache.ID_BLOCK_SIZE)
+        pos = bisect_left(blockIds, userIntId)
+        if pos < len(blockIds) and blockIds[pos] == userIntId:
+            return blockStart + pos
+        return -1
+
+    def add(self, userIntId, fieldValues):
+        raise TypeError('A mapped user cache snapshot is read-only.')
+
+    def close(self):
+        self.buf = None
+        self.mappedFile.close()
+
+
+def loadSnapshot(snapshotPath, marker):
+    '''
+    Map a snapshot file written by CompactUserCache.saveSnapshot().
+
+    :param snapshotPath: path of the snapshot file
+    :type snapshotPath: str
+    :param marker: current change marker of the user table
+    :type marker: str
+    :return: the mapped cache, or None if the file does not exist, or
+        was written for a different marker, format version, or machine
+    :rtype: {MappedUserCache | None}
+    '''
+    try:
+        with open(snapshotPath, 'rb') as snapshotFile:
+            if os.fstat(snapshotFile.fileno()).st_size < struct.calcsize(SNAPSHOT_HEADER_FORMAT):
+                return None
+            mappedFile = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError):
+        return None
+    headerLen = struct.calcsize(SNAPSHOT_HEADER_FORMAT)
+    (magic, version, idSize, offsetSize, littleEndian, numUsers, bufLen, markerLen) = \
+        struct.unpack_from(SNAPSHOT_HEADER_FORMAT, mappedFile, 0)
+    if magic != SNAPSHOT_MAGIC or \
+       version != SNAPSHOT_VERSION or \
+       idSize != array('l').itemsize or \
+       offsetSize != array('L').itemsize or \
+       littleEndian != (sys.byteorder == 'little') or \
+       mappedFile[headerLen:headerLen + markerLen] != marker:
+        mappedFile.close()
+        return None
+    try:
+        return MappedUserCache(mappedFile, numUsers, bufLen, headerLen + markerLen)
+    except ValueError:
+        mappedFile.close()
+        return None
+
+def alignedOffset(offset):
+    return (offset + SNAPSHOT_ALIGNMENT - 1) // SNAPSHOT_ALIGNMENT * SNAPSHOT_ALIGNMENT
+
+def writePadding(snapshotFile):
+    offset = snapshotFile.tell()
+    snapshotFile.write('\0' * (alignedOffset(offset) - offset))
@@ -0,0 +1,82 @@
+'''
+Loader for Piazza's account_mapping.csv, which maps each Piazza
+user id to the LTI ids with which the user came to Piazza. A row
+holds the user's email, Piazza id, and LTI ids; several LTI ids
+share one quoted field:
+
+    jdoe@gmail.com,hc19qkoyc9C,"stanford.edu__88115, stanford.edu__47bf69315b7391dace7ccbc344690969"
+
+(The header row of Piazza's files names the first two columns
+the other way round.)
+
+Each LTI id is <consumer domain>__<user id at the consumer>. Of a
+user's LTI ids, the one issued by OpenEdX, 32 hex digits, is the
+one that MySQL function idExt2Anon() converts. Only the Piazza id
+and that user id are kept; emails are not.
+'''
+
+import csv
+import re
+
+
+# Separates the consumer domain from the user id in an LTI id:
+LTI_SEPARATOR = '__'
+# User id of the OpenEdX LTI consumer:
+OPENEDX_LTI_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+EMAIL_COLUMN = 0
+PIAZZA_ID_COLUMN = 1
+LTI_IDS_COLUMN = 2
+
+
+def preferredLti(ltiIds):
+    '''
+    Return the user id part of the LTI id that OpenEdX issued,
+    or, if there is none, of the first LTI id.
+
+    :param ltiIds: LTI ids, such as 'stanford.edu__88115'
+    :type ltiIds: [String]
+    :return: user id at the LTI consumer, or None if ltiIds is empty
+    :rtype: String
+    '''
+    userIds = [ltiId.strip().split(LTI_SEPARATOR)[-1] for ltiId in ltiIds if len(ltiId.strip()) > 0]
+    for userId in userIds:
+        if OPENEDX_LTI_PATTERN.match(userId) is not None:
+            return userId
+    if len(userIds) == 0:
+        return None
+    return userIds[0]
+
+
+class AccountMapping(object):
+    '''
+    Piazza user ids and their preferred LTI user ids, read
+    from an account_mapping.csv file one row at a time.
+    '''
+
+    def __init__(self, mappingFd, rowSkips=1):
+        '''
+        :param mappingFd: open account_mapping.csv file, or zip archive member
+        :type mappingFd: file
+        :param rowSkips: number of header rows
+        :type rowSkips: int
+        '''
+        self.ltisByPiazzaId = {}
+        for rowNum, row in enumerate(csv.reader(mappingFd)):
+            if rowNum < rowSkips or len(row) <= LTI_IDS_COLUMN:
+                continue
+            lti = preferredLti(row[LTI_IDS_COLUMN].split(','))
+            if lti is not None:
+                # Many users; share the strings with other
+                # uses of the same ids:
+                self.ltisByPiazzaId[intern(row[PIAZZA_ID_COLUMN].strip())] = intern(lti)
+
+    def getLti(self, piazzaId):
+        '''
+        Return the preferred LTI user id of the given Piazza
+        user, or None if the mapping does not cover the user.
+        '''
+        return self.ltisByPiazzaId.get(piazzaId)
+
+    def __len__(self):
+        return len(self.ltisByPiazzaId)
@@ -0,0 +1,171 @@
+'''
+Streaming decoder for files that hold one large JSON array,
+such as Piazza's class_content.json and users.json.
+
+iterJsonArray() reads the file in chunks, and yields the elements
+of the top level array one at a time. Only the element being
+decoded is held in memory, plus one read chunk, no matter how
+large the file is.
+
+Each element is decoded by the standard json decoder, straight
+from the read buffer. An element that runs past the end of the
+buffer fails to decode; more is then read, and the element is
+decoded again. Reads grow with the element, so a large element
+is decoded a few times at most.
+
+The decoder runs in non-strict mode: Piazza dumps contain raw
+newlines and tabs inside strings, which strict JSON forbids.
+They are kept in the decoded strings as they are.
+'''
+
+import json
+import re
+
+
+DEFAULT_READ_SIZE = 256 * 1024
+
+# Separators before the next element of the array:
+SEPARATOR_PATTERN = re.compile(r'[\s,]*')
+WHITESPACE_PATTERN = re.compile(r'\s*')
+# Characters that change the nesting outside of strings:
+STRUCTURE_PATTERN = re.compile(r'["\[\]{}]')
+# Characters that end a string, or escape the next character:
+STRING_PATTERN = re.compile(r'["\\]')
+# End of a number, true, false, or null:
+SCALAR_END_PATTERN = re.compile(r'[\s,\]]')
+# Characters that may continue a number:
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+def iterJsonArray(fileObj, readSize=DEFAULT_READ_SIZE):
+    '''
+    Generator of the elements of the JSON array in the given file,
+    decoded as json.load() would decode them, except that control
+    characters inside strings are accepted.
+
+    :param fileObj: open file, or zip archive member, positioned at the array
+    :type fileObj: file
+    :param readSize: number of bytes read at a time
+    :type readSize: int
+    :raise ValueError: if the input is not a JSON array, is cut
+        off, or an element is malformed
+    '''
+    return iter(JsonArrayStream(fileObj, readSize))
+
+
+class JsonArrayStream(object):
+    '''
+    Iterable over the elements of a JSON array in a file.
+    '''
+
+    def __init__(self, fileObj, readSize=DEFAULT_READ_SIZE):
+        self.fileObj = fileObj
+        self.readSize = readSize
+        self.decoder = json.JSONDecoder(strict=False)
+        self.buf = ''
+        # File offset of buf[0], for error messages:
+        self.bufOffset = 0
+        self.eof = False
+
+    def __iter__(self):
+        pos = self.skip(0, WHITESPACE_PATTERN)
+        if self.buf[pos] != '[':
+            raise ValueError("Expected a JSON array, but found '%s' at offset %d." % (self.buf[pos], self.bufOffset + pos))
+        pos += 1
+        elementIndex = 0
+        while True:
+            pos = self.skip(pos, SEPARATOR_PATTERN)
+            if self.buf[pos] == ']':
+                return
+            (element, pos) = self.decodeAt(pos, elementIndex)
+            yield element
+            elementIndex += 1
+
+    def readMore(self, keepFrom):
+        '''
+        Drop the buffer up to keepFrom, and append the next chunk
+        of the file, which is at least as large as what is kept.
+        '''
+        chunk = self.fileObj.read(max(self.readSize, len(self.buf) - keepFrom))
+        self.buf = self.buf[keepFrom:] + chunk
+        self.bufOffset += keepFrom
+        self.eof = len(chunk) == 0
+
+    def skip(self, pos, skipPattern):
+        '''
+        Return the position of the first character at or after
+        pos that skipPattern does not match, reading as needed.
+        '''
+        while True:
+            pos = skipPattern.match(self.buf, pos).end()
+            if pos < len(self.buf):
+                return pos
+            if self.eof:
+                raise ValueError('JSON array ends prematurely at offset %d.' % (self.bufOffset + pos))
+            self.readMore(pos)
+            pos = 0
+
+    def decodeAt(self, pos, elementIndex):
+        '''
+        Decode the element that starts at pos, reading as needed.
+
+        :return: the element, and the position just behind it
+        :rtype: (<any>, int)
+        '''
+        isScalar = self.buf[pos] not in '{["'
+        numReads = 0
+        while True:
+            try:
+                (element, end) = self.decoder.raw_decode(self.buf, pos)
+                # A number at the end of the buffer
+                # may continue in the next chunk:
+                if self.eof or (end < len(self.buf) and (not isScalar or self.buf[end] not in NUMBER_CHARS)):
+                    return (element, end)
+            except ValueError as e:
+                # Most failures are elements cut off by the end of the
+                # buffer. Only after a read has not helped is it worth
+                # checking whether the element is malformed:
+                if self.eof or (numReads > 0 and holdsElement(self.buf, pos)):
+                    raise ValueError('Malformed JSON array element %d at offset %d: %s' % (elementIndex, self.bufOffset + pos, `e`))
+            self.readMore(pos)
+            pos = 0
+            numReads += 1
+
+def holdsElement(buf, start):
+    '''
+    Return True if buf holds the whole element that starts at
+    start, as far as its brackets and quotes tell. If it does,
+    but the element cannot be decoded, the element is malformed,
+    rather than cut off by the end of the buffer.
+    '''
+    if buf[start] not in '{["':
+        return SCALAR_END_PATTERN.search(buf, start) is not None
+    depth = 0
+    inString = False
+    pos = start
+    while True:
+        if inString:
+            match = STRING_PATTERN.search(buf, pos)
+            if match is None:
+                return False
+            if match.group() == '\\':
+                # Skip the escaped character:
+                pos = match.end() + 1
+                continue
+            inString = False
+            pos = match.end()
+            if depth == 0:
+                return True
+            continue
+        match = STRUCTURE_PATTERN.search(buf, pos)
+        if match is None:
+            return False
+        pos = match.end()
+        if match.group() == '"':
+            inString = True
+        elif match.group() in '{[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth <= 0:
+                return True
@@ -123,18 +123,50 @@ Endorsement:
 #from UserDict import DictMixin
 import argparse
 import base64
-import copy
+from contextlib import contextmanager
 import getpass
 import hashlib
+import importlib
 import json
 import logging
 import os
 import sys
 import zipfile
 
+from account_mapping import AccountMapping, preferredLti
+from json_stream import iterJsonArray
 from pymysql_utils.pymysql_utils import MySQLDB
 
 
+def forumEtlModule(moduleName):
+    '''
+    Return the named module of the sibling forum_etl package,
+    which holds the identity cache and the profiler that the
+    forum extractor shares with this importer.
+
+    :param moduleName: module name within forum_etl, such as 'identity_cache'
+    :type moduleName: String
+    :rtype: module
+    '''
+    srcDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    if srcDir not in sys.path:
+        sys.path.append(srcDir)
+    return importlib.import_module('forum_etl.%s' % moduleName)
+
+def openIdentityCache(cacheFileName):
+    '''
+    Return an IdentityCache on the given file.
+    '''
+    return forumEtlModule('identity_cache').IdentityCache(cacheFileName)
+
+@contextmanager
+def noProfiling():
+    '''
+    Stands in for an EtlProfiler when a run is not profiled.
+    '''
+    yield
+
+
 class PiazzaImporterMetaclass(type):
     
     def __init__(self, className, bases, namespace):
@@ -175,6 +207,17 @@ class PiazzaImporter(object):
     # idExt2Anon()
     CONVERT_FUNCTIONS_DB = 'Edx'
     
+    # Maximum number of LTI uids resolved to
+    # user_int_ids by one query:
+    LTI_LOOKUP_CHUNK_SIZE = 1000
+    
+    # Name of the LTI uid --> user_int_id mapping in the
+    # identity cache, and the version of the mapping under
+    # which its results are kept. Change the version when
+    # the MySQL functions start to return different ids:
+    LTI_LOOKUP_NAMESPACE = 'Edx.idAnon2Int(idExt2Anon())'
+    LTI_LOOKUP_FUNCTION_VERSION = '1'
+    
     # Dict to hold map between Piazza 'id' field, and user_int_id:
     piazza2UserIntId = {}
     
@@ -193,7 +236,10 @@ class PiazzaImporter(object):
                  usersFileName=None, 
                  loggingLevel=logging.INFO, 
                  logFile=None,
-                 unittesting=False):
+                 unittesting=False,
+                 streamContent=False,
+                 mappingFileName=None,
+                 identityCacheFile=None):
         '''
         Create an instance that will hold a dict between
         Piazza IDs and anon_screen_name ids:
@@ -215,6 +261,19 @@ class PiazzaImporter(object):
         :type loggingLevel: logging
         :param logFile: file to send log into. If None: log to console
         :type String 
+        :param streamContent: if True, the posts are not loaded into jData. Instead,
+            each iteration over this instance decodes them from the content file
+            one top level post at a time, and only the PiazzaPost instances of the
+            current post's thread are kept. Posts cannot then be accessed by index.
+        :type streamContent: Bool
+        :param mappingFileName: Piazza's account_mapping.csv, or a zip file that holds it;
+            maps Piazza user ids to LTI ids. If None, the account_mapping.csv in
+            the users zip file is used, if there is one.
+        :type mappingFileName: String
+        :param identityCacheFile: SQLite file in which the user_int_ids of LTI uids
+            are kept across runs, and shared with the forum extractor. If given,
+            MySQL is only asked for LTI uids the file does not hold.
+        :type identityCacheFile: String
         '''
         
         self.mysqlUser = mysqlUser
@@ -223,6 +282,19 @@ class PiazzaImporter(object):
         self.tablename = tablename
         self.jsonFileName = jsonFileName
         self.usersFile = usersFileName
+        self.mappingFileName = mappingFileName
+        if identityCacheFile is None:
+            self.identityCache = None
+        else:
+            self.identityCache = openIdentityCache(identityCacheFile)
+        self.streamContent = streamContent
+        # Top level post dicts; stays None if streamContent is True:
+        self.jData = None
+        # The JSON dict of each post and child post by oid, and
+        # the oid of each such dict by its Python id(); built by
+        # indexPosts() when the content is loaded:
+        self.postIndex = {}
+        self.oidsByDictId = {}
               
         self.setupLogging(loggingLevel, logFile)
         
@@ -238,12 +310,16 @@ class PiazzaImporter(object):
         else:
             # Caller did not provide a zip file from Piazza, but
             # a separate JSON file with the forum content:
-            with open(jsonFileName, 'r') as jsonFd:
-                self.jData = json.load(jsonFd)
+            self.importJsonContentFromPiazzaZip(jsonFileName)
 
             # Load user info:
             self.importJsonUsersFromPiazzaZip(usersFileName)
 
+        # All user_int_ids are looked up:
+        if self.identityCache is not None:
+            PiazzaImporter.logger.info('Identity cache: %d user_int_ids found, %d queried' % (self.identityCache.numHits, self.identityCache.numMisses))
+            self.identityCache.close()
+
     def importJsonContentFromPiazzaZip(self, zipContentFileName):
         '''
         Given a JSON file with all of one class' Piazza forum data,
@@ -255,28 +331,78 @@ class PiazzaImporter(object):
         inside a zip file, of which zipContentFileName is the name. In that
         case the JSON within the zip file must be named class_contents.json.
         
+        The JSON is decoded one post at a time by iterJsonArray(), so
+        the file's text is never held in memory as a whole. With
+        streamContent, nothing is loaded; see iterContentJson().
+        
         :param zipContentFileName: name of file, or zip file with JSON encoded Piazz forum content
         :type zipFileName: String
         '''
-
-        contentFd = None
+        self.contentFileName = zipContentFileName
+        if self.streamContent:
+            return
+        self.jData = list(self.iterContentJson())
+        self.indexPosts()
+    
+    def indexPosts(self):
+        '''
+        Build the oid index of all posts in self.jData, and
+        of their children, recursively.
+        '''
+        self.postIndex = {}
+        self.oidsByDictId = {}
+        for postNum, jsonDict in enumerate(self.jData):
+            self.indexPost(jsonDict, PiazzaImporter.postOid(postNum))
+    
+    def indexPost(self, jsonDict, oid):
+        '''
+        Add one top level post and its children to the oid index.
+        
+        :param jsonDict: the post's JSON dict
+        :type jsonDict: dict
+        :param oid: the post's oid
+        :type oid: String
+        '''
+        pendingPosts = [(jsonDict, oid)]
+        while len(pendingPosts) > 0:
+            (postDict, postOid) = pendingPosts.pop()
+            self.postIndex[postOid] = postDict
+            self.oidsByDictId[id(postDict)] = postOid
+            for childNum, childDict in enumerate(postDict.get('children') or []):
+                if type(childDict) == dict:
+                    pendingPosts.append((childDict, PiazzaImporter.childOid(postOid, 'children', childNum)))
+    
+    def iterContentJson(self):
+        '''
+        Generator of the top level post dicts in the content
+        file, decoded one at a time.
+        '''
+        contentFd = PiazzaImporter.openJsonMember(self.contentFileName, PiazzaImporter.STANDARD_CONTENT_FILE_NAME)
         try:
-            if zipfile.is_zipfile(zipContentFileName):
-                zipObj = zipfile.ZipFile(zipContentFileName)
-                contentFd = zipObj.open(PiazzaImporter.STANDARD_CONTENT_FILE_NAME)
-                fileNameList = zipObj.namelist()
-                if not PiazzaImporter.STANDARD_CONTENT_FILE_NAME in fileNameList:
-                    raise ValueError('Zip file %s does not contain a file %s.' % (zipContentFileName, PiazzaImporter.STANDARD_CONTENT_FILE_NAME))
-            else:
-                contentFd = open(zipContentFileName, 'r')
-
-            jsonArr = contentFd.readlines()
-            jsonStr = ''.join([line.strip() for line in jsonArr])
-            self.jData = json.loads(jsonStr)
-            #print('Read')
+            for jsonDict in iterJsonArray(contentFd):
+                yield jsonDict
         finally:
-            if contentFd is not None:
-                contentFd.close()
+            contentFd.close()
+    
+    @classmethod
+    def openJsonMember(cls, fileName, memberName):
+        '''
+        Open the given file, or, if it is a zip file, its
+        archive member of the given name.
+        
+        :param fileName: name of JSON file, or of zip file
+        :type fileName: String
+        :param memberName: name of the JSON file within a zip file
+        :type memberName: String
+        :return: file object to read the JSON from
+        :rtype: file
+        '''
+        if zipfile.is_zipfile(fileName):
+            zipObj = zipfile.ZipFile(fileName)
+            if not memberName in zipObj.namelist():
+                raise ValueError('Zip file %s does not contain a file %s.' % (fileName, memberName))
+            return zipObj.open(memberName)
+        return open(fileName, 'r')
     
     def importJsonUsersFromPiazzaZip(self, zipUserFileName):
         '''
@@ -296,6 +422,11 @@ class PiazzaImporter(object):
         inside a zip file, of which zipUserFileName is the name. In that
         case the JSON within the zip file must be named users.json.
         
+        Each user's LTI uid is taken from the account mapping (see
+        loadAccountMapping()), or else from the user's ext_id field,
+        which PiazzaUser derives from the user's lti_ids. Only the LTI
+        uids need MySQL, to be converted to user_int_ids.
+        
         A dict: user info keyed on Piazza ID.
         
         :param zipUserFileName: name of file, or zip file with JSON encoded Piazza forum users
@@ -304,18 +435,8 @@ class PiazzaImporter(object):
 
         usersFd = None
         try:
-            if zipfile.is_zipfile(zipUserFileName):
-                zipObj = zipfile.ZipFile(zipUserFileName)
-                usersFd = zipObj.open(PiazzaImporter.STANDARD_USERS_FILE_NAME)
-                fileNameList = zipObj.namelist()
-                if not PiazzaImporter.STANDARD_USERS_FILE_NAME in fileNameList:
-                    raise ValueError('Zip file %s does not contain a file %s.' % (zipUserFileName, PiazzaImporter.STANDARD_USERS_FILE_NAME))
-            else:
-                usersFd = open(zipUserFileName, 'r')
-
-            jsonArr = usersFd.readlines()
-            jsonStr = ''.join([line.strip() for line in jsonArr])
-            userInfoArray = json.loads(jsonStr)
+            usersFd = PiazzaImporter.openJsonMember(zipUserFileName, PiazzaImporter.STANDARD_USERS_FILE_NAME)
+            userInfoArray = iterJsonArray(usersFd)
             PiazzaImporter.usersByPiazzaId  = {}
             PiazzaImporter.usersByTrueUserName  = {}
             for userJsonStruct in userInfoArray:
@@ -340,28 +461,141 @@ class PiazzaImporter(object):
             if usersFd is not None:
                 usersFd.close()
     
+        userObjs = PiazzaImporter.usersByPiazzaId.values()
+        accountMapping = self.loadAccountMapping(zipUserFileName)
+        ltisByPiazzaId = dict([(userObj['piazza_id'], self.getUserLti(userObj, accountMapping)) for userObj in userObjs])
+        ltis = set(ltisByPiazzaId.values())
+        ltis.discard(None)
+    
         # Now, try to give each user object a proper user_int_id,
         # which are used by the OpenEdx platform. Also, add key/value
         # pair anon_screen_name--->'anon_screen_name_redacted'
+        userIntIdsByLti = {}
+        if len(ltis) > 0:
+            userIntIdsByLti = self.lookupUserIntIds(ltis)
+        
+        for userObj in userObjs:
+            # If no mapping from LTI to integer exists, set user_int_id to -1:
+            userIntId = userIntIdsByLti.get(ltisByPiazzaId[userObj['piazza_id']])
+            if userIntId is None:
+                userIntId = -1
+            userObj['user_int_id'] = userIntId
+
+            # Help quickly find a user_int_id from a Piazza id:
+            PiazzaImporter.piazza2UserIntId[userObj['piazza_id']] = userIntId
+
+    def loadAccountMapping(self, zipUserFileName):
+        '''
+        Load Piazza's account_mapping.csv from the mapping file given
+        to the constructor, or else from the zip file of the users,
+        if it holds one.
+        
+        :param zipUserFileName: name of file, or zip file with JSON encoded Piazza forum users
+        :type zipUserFileName: String
+        :return: the mapping, or None if there is no mapping file
+        :rtype: AccountMapping
+        '''
+        mappingFileName = self.mappingFileName
+        if mappingFileName is None:
+            if not zipfile.is_zipfile(zipUserFileName) or \
+               PiazzaImporter.STANDARD_MAPPING_FILE_NAME not in zipfile.ZipFile(zipUserFileName).namelist():
+                return None
+            mappingFileName = zipUserFileName
+        mappingFd = PiazzaImporter.openJsonMember(mappingFileName, PiazzaImporter.STANDARD_MAPPING_FILE_NAME)
+        try:
+            accountMapping = AccountMapping(mappingFd, PiazzaImporter.MAPPING_FILE_ROW_SKIPS)
+        finally:
+            mappingFd.close()
+        PiazzaImporter.logger.info('Read LTI ids of %d Piazza users from %s.' % (len(accountMapping), mappingFileName))
+        return accountMapping
+    
+    @classmethod
+    def getUserLti(cls, userObj, accountMapping):
+        '''
+        Return the LTI uid of the given user, or None if it is unknown.
+        
+        :param userObj: user from users.json
+        :type userObj: PiazzaUser
+        :param accountMapping: Piazza's account mapping, or None
+        :type accountMapping: AccountMapping
+        '''
+        lti = None
+        if accountMapping is not None:
+            lti = accountMapping.getLti(userObj['piazza_id'])
+        if lti is None:
+            lti = userObj.get('ext_id')
+        return lti
+
+    def lookupUserIntIds(self, ltis):
+        '''
+        Convert LTI uids to user_int_ids, from the identity cache
+        where possible, else via queryUserIntIds().
+        
+        :param ltis: LTI uids to convert
+        :type ltis: {String}
+        :return: dict mapping each LTI uid to its user_int_id, or to None
+            if MySQL knows no user_int_id for it
+        :rtype: {String : int}
+        '''
+        if self.identityCache is None:
+            return self.queryUserIntIds(ltis)
+        userIntIdsByLti = self.identityCache.lookup(PiazzaImporter.LTI_LOOKUP_NAMESPACE,
+                                                    PiazzaImporter.LTI_LOOKUP_FUNCTION_VERSION,
+                                                    ltis,
+                                                    self.queryUserIntIds)
+        # Prefilled entries may hold the ids as text:
+        return dict([(lti, None if userIntId is None else int(userIntId)) for (lti, userIntId) in userIntIdsByLti.items()])
+    
+    def queryUserIntIds(self, ltis):
+        '''
+        Convert LTI uids to user_int_ids via MySQL, using one query
+        per LTI_LOOKUP_CHUNK_SIZE uids. The uids are passed to MySQL
+        as query parameters; see ltiLookupQuery().
+        
+        :param ltis: LTI uids to convert
+        :type ltis: {String}
+        :return: dict mapping each LTI uid to its user_int_id, or to None
+            if MySQL knows no user_int_id for it
+        :rtype: {String : int}
+        '''
         try:
             db = None
             db = MySQLDB(user=self.mysqlUser, passwd=self.mysqlPwd,  db=PiazzaImporter.CONVERT_FUNCTIONS_DB)
         except Exception as e:
             raise(IOError('Could not open MySQL db for user %s to resolve LTI uids to user_int_ids: %s' % (self.mysqlUser, `e`)))
-        
-        for (userObj, lti) in [(userObj, userObj.get('ext_id')) for userObj in PiazzaImporter.usersByPiazzaId.values()]:
-            queryIt = db.query("SELECT %s.idAnon2Int(idExt2Anon('%s'));" % (PiazzaImporter.CONVERT_FUNCTIONS_DB,lti))
-            # Results come back as tuples, so the LTI will be as in (211516L,):
-            userObj['user_int_id'] = queryIt.next()[0]
-            # If no mapping from LTI to integer exists, set user_int_id to -1:
-            if userObj['user_int_id'] is None:
-                userObj['user_int_id'] = -1
+        userIntIdsByLti = {}
+        ltis = list(ltis)
+        chunkSize = PiazzaImporter.LTI_LOOKUP_CHUNK_SIZE
+        try:
+            for chunkStart in range(0, len(ltis), chunkSize):
+                ltiChunk = ltis[chunkStart:chunkStart + chunkSize]
+                cursor = db.connection.cursor()
+                try:
+                    cursor.execute(PiazzaImporter.ltiLookupQuery(len(ltiChunk)), ltiChunk)
+                    # Results come back as tuples, as in ('<lti>', 211516L):
+                    for (lti, userIntId) in cursor.fetchall():
+                        userIntIdsByLti[lti] = userIntId
+                finally:
+                    cursor.close()
+        finally:
+            db.close()
+        return userIntIdsByLti
 
-            # Help quickly find a user_int_id from a Piazza id:
-            PiazzaImporter.piazza2UserIntId[userObj['piazza_id']] = userObj['user_int_id']
+    @classmethod
+    def ltiLookupQuery(cls, numLtis):
+        '''
+        Return a query that converts numLtis LTI uids, given as
+        query parameters, to user_int_ids. The uids form a derived
+        table, so one set based query converts them all:
         
-
-        db.close()
+          SELECT ext.lti, Edx.idAnon2Int(idExt2Anon(ext.lti))
+            FROM (SELECT %s AS lti UNION ALL SELECT %s ...) AS ext;
+        
+        :param numLtis: number of LTI uids
+        :type numLtis: int
+        '''
+        ltiTable = ' UNION ALL '.join(['SELECT %s AS lti'] + ['SELECT %s'] * (numLtis - 1))
+        return 'SELECT ext.lti, %s.idAnon2Int(idExt2Anon(ext.lti)) FROM (%s) AS ext;' % (cls.CONVERT_FUNCTIONS_DB, ltiTable)
 
     # ----------------------------------------  Getters ------------------------------------------
     
@@ -665,17 +899,22 @@ class PiazzaImporter(object):
         if type(offsetOrObjId) == int:
             # Behave like a list.
             # offsetOrObjId is an offset into the original JSON list:
+            if self.jData is None:
+                raise TypeError('Posts cannot be accessed by index when streaming the content file; iterate instead.')
             objDict = list.__getitem__(self.jData, offsetOrObjId)
-            return self.findOrCreatePostObj(objDict)
+            return PiazzaPost(objDict, oid=PiazzaImporter.postOid(offsetOrObjId % len(self.jData)))
         
         elif type(offsetOrObjId) == dict:
             # Behave like a PiazzaPost instance factory:
             return self.findOrCreatePostObj(offsetOrObjId)
         
-        else: # offsetOrObjId is the obj ID of an already materialized obj
+        else: # offsetOrObjId is the obj ID of a post
             # Behave like a dict: return the obj with that ID,
-            # or raise KeyError:
-            return PiazzaPost.getPiazzaPostObj(offsetOrObjId)
+            # materializing it if needed, or raise KeyError:
+            try:
+                return PiazzaPost.getPiazzaPostObj(offsetOrObjId)
+            except KeyError:
+                return PiazzaPost(self.postIndex[offsetOrObjId], oid=offsetOrObjId)
     
     def __len__(self):
         return len(self.usersByPiazzaId)
@@ -694,35 +933,59 @@ class PiazzaImporter(object):
                 raise StopIteration
             
     def  __iter__(self):
+        if self.jData is None:
+            return self.iterStreamedPosts()
         return PiazzaImporter.PiazzaImporterIterator(self)
 
+    def iterStreamedPosts(self):
+        '''
+        Iteration when streaming the content file: decode one
+        top level post at a time. Each post starts a fresh
+        registry of PiazzaPost instances, so that the instances
+        of earlier threads can be garbage collected.
+        '''
+        for postNum, jsonDict in enumerate(self.iterContentJson()):
+            PiazzaPost.piazzaPostInstances = {}
+            self.postIndex = {}
+            self.oidsByDictId = {}
+            self.indexPost(jsonDict, PiazzaImporter.postOid(postNum))
+            yield PiazzaPost(jsonDict, oid=PiazzaImporter.postOid(postNum))
+
     def findOrCreatePostObj(self, jsonDict):
         
         # Find existing instance for this JSON obj (dict),
-        # or have a new one made:
-
-        oid = PiazzaImporter.makeHashFromJsonDict(jsonDict)
-
-        # Try to find this OID among the already
-        # created instances: caller may make multiple
-        # PiazzaPost instantiations with the same JSON
-        # object; we'll just find the respective object
-        # and return it:
-        try:
-            return PiazzaPost.piazzaPostInstances[oid]
-        except KeyError:
-            pass
-
-        piazzaPostObj = PiazzaPost(jsonDict)
-
-        return piazzaPostObj
+        # or have a new one made. Dicts of the loaded content
+        # are found in the oid index; others are identified
+        # by a hash of their content:
+        return PiazzaPost(jsonDict, oid=self.oidsByDictId.get(id(jsonDict)))
         
       
     # ----------------------------------------  Utilities ------------------------------------------
 
+    @classmethod
+    def postOid(cls, postNum):
+        '''
+        Oid of the top level post at the given position
+        in the content file, such as 'post3'.
+        '''
+        return 'post%d' % postNum
+    
+    @classmethod
+    def childOid(cls, parentOid, fieldName, childNum):
+        '''
+        Oid of an entry in one of a post's arrays of children,
+        change_log, or history, such as 'post3.children0'.
+        '''
+        return '%s.%s%d' % (parentOid, fieldName, childNum)
+    
     @classmethod
     def makeHashFromJsonDict(cls, jsonDict):
-        return base64.urlsafe_b64encode(hashlib.md5(str(jsonDict)).digest())
+        '''
+        Oid of a JSON dict that is not part of the loaded content,
+        and thus has no position: a hash of its content. Keys are
+        sorted, so equal dicts hash alike.
+        '''
+        return base64.urlsafe_b64encode(hashlib.md5(json.dumps(jsonDict, sort_keys=True, default=str)).digest())
     
     @classmethod
     def idPiazza2UserIntId(cls, piazzaId):
@@ -783,8 +1046,9 @@ class PiazzaPostMetaclass(type):
     Metaclass that governs creation of PiazzaPost instances.
     Imposes a singleton pattern, with existing objects held
     in a class level dict called piazzaPostInstances. Keys
-    are OIDs, which are computed from the JSON dict that is
-    passed into the __call__() method. 
+    are OIDs: the post's position in the content file (see
+    PiazzaImporter.postOid() and childOid()), or, for JSON
+    dicts from elsewhere, a hash of the dict's content. 
     '''
     
     def __init__(self, className, bases, namespace):
@@ -792,7 +1056,7 @@ class PiazzaPostMetaclass(type):
         if not hasattr(self, 'piazzePostInstances'):
             self.piazzaPostInstances = {}
 
-    def __call__(self, objIdOrObjOrJsonDict, buildingChangeEventObj=False, buildingHistoryEventObj=False):
+    def __call__(self, objIdOrObjOrJsonDict, buildingChangeEventObj=False, buildingHistoryEventObj=False, oid=None):
         '''
         Invoked whenever a PiazzaPost instance is created.
         Checks whether object with given OID or JSON object
@@ -806,31 +1070,30 @@ class PiazzaPostMetaclass(type):
         :param objIdOrObjOrJsonDict: either an oid, or a JSON structure
             or an already existing PiazzaPost instance from the Piazza forum contents file.
         :type anonScreenNameOrJsonDict: String
+        :param oid: with a JSON structure: its oid, if known from its position
+        :type oid: String
         '''
         # For readability: figure out which
         # type of parm was passed in, and assign
         # to appropriate var:
         if type(objIdOrObjOrJsonDict) == dict:
             jsonDict = objIdOrObjOrJsonDict
-            oid = None
         elif isinstance(objIdOrObjOrJsonDict, basestring):
-            oid = objIdOrObjOrJsonDict
-            jsonDict = None
+            # Caller provided an oid; try to find it.
+            # NameError if doesn't exist:
+            try:
+                return self.piazzaPostInstances[objIdOrObjOrJsonDict]
+            except KeyError:
+                raise NameError("Object with oid '%s' does not exist." % objIdOrObjOrJsonDict)
         elif isinstance(objIdOrObjOrJsonDict, PiazzaPost):
             return objIdOrObjOrJsonDict
         else:
             raise ValueError("Must pass either an OID or a JSON dictionary; oid was None, jsonDict was %s" % str(objIdOrObjOrJsonDict))
         
-        # If caller provided an oid, try to find it.
-        # NameError if doesn't exist:
-        if oid is not None:
-            try:
-                return self.piazzaPostInstances[oid]
-            except KeyError:
-                raise NameError("Object with oid '%s' does not exist." % oid)
-        
-        # No OID provided. Compute OID from the JSON dict;
-        oid = PiazzaImporter.makeHashFromJsonDict(jsonDict)
+        # A JSON dict without a known position is
+        # identified by its content:
+        if oid is None:
+            oid = PiazzaImporter.makeHashFromJsonDict(jsonDict)
 
         # Try to find this OID among the already
         # created instances: caller may make multiple
@@ -845,7 +1108,10 @@ class PiazzaPostMetaclass(type):
         # Really don't have this instance yet:
         
         # Call the PiazzaPost class' init method:
-        resObj = super(PiazzaPostMetaclass, self).__call__(jsonDict, buildingChangeEventObj=buildingChangeEventObj)
+        resObj = super(PiazzaPostMetaclass, self).__call__(jsonDict,
+                                                           buildingChangeEventObj=buildingChangeEventObj,
+                                                           buildingHistoryEventObj=buildingHistoryEventObj,
+                                                           oid=oid)
 
         # The JSON dict will become an instance level
         # variable called nameValueDict. Add OID
@@ -879,10 +1145,18 @@ class PiazzaPost(object):
     # It is named nameValueDict, and is an instance
     # level member.
     # Init anon_screen_name in the JSON dict.
+    #
+    # The JSON dict is shared with the importer's jData,
+    # and is never modified. Derived fields, such as
+    # anon_screen_name, user_int_id, and piazza_id, and
+    # any other values set on the instance are kept in
+    # the instance's overlay dict, which takes precedence.
+    # The change_log and history entries are turned into
+    # PiazzaPost instances only when first accessed.
     __metaclass__ = PiazzaPostMetaclass
 
     
-    def __init__(self, jsonDict, buildingChangeEventObj=False, buildingHistoryEventObj=False):
+    def __init__(self, jsonDict, buildingChangeEventObj=False, buildingHistoryEventObj=False, oid=None):
         '''
         Note: because PiazzaPostMetaclass is this class'
         metaclass, instantiation of PiazzaPost will 
@@ -892,7 +1166,11 @@ class PiazzaPost(object):
         method must also take those args and do the 
         call to this __init__() method with the args. 
         '''
-        self.nameValueDict = copy.deepcopy(jsonDict)
+        # The oid is needed for the oids of the
+        # change_log and history entries:
+        self.oid = oid
+        self.nameValueDict = jsonDict
+        self.overlay = {}
         
         # Add anon_screen_name to this instance's attribute:
         # Three cases: if we are building from a main content post
@@ -950,42 +1228,59 @@ class PiazzaPost(object):
 #             # This JSON post struct doesn't have a good tagger array
 #             pass
         
-        # If there is a change log, turn each
-        # entry into its own PiazzaPost instance.
-        # Also replace name by anonymous name:
-        changeLogField = self['change_log']
-        if changeLogField is not None:
-            # New object does have a change_log field:
-            changeLogObjs = []
-            for oneChangeJson in changeLogField:
-                oneChangeObj = PiazzaPost(oneChangeJson, buildingChangeEventObj=True)
-                changeLogObjs.append(oneChangeObj)
-            self['change_log'] = changeLogObjs
-
-        # If there is a history array, turn each
-        # entry into its own PiazzaPost instance.
-        # Also replace Piazza uid by anonymous name:
-        historyField = self['history']
-        if historyField is not None:
-            # New object does have a history field, which is
-            # a JSON array of history structs (subject, content, created, anon, and uid):
-            historyObjs = []
-            for oneHistoryJson in historyField:
-                oneHistoryObj = PiazzaPost(oneHistoryJson, buildingHistoryEventObj=True)
-                piazzaId = oneHistoryObj.get('uid')
-                if piazzaId is not None:
-                    oneHistoryObj['user_int_id'] = PiazzaImporter.idPiazza2UserIntId(piazzaId)
-                historyObjs.append(oneHistoryObj)
-            self['history'] = historyObjs
+        # Posts without a change log get an empty one:
+        if not jsonDict.has_key('change_log'):
+            self['change_log'] = []
 
     def values(self):
-        return self.nameValueDict.values()
+        return [value for (key, value) in self.items()]
     
     def items(self):
-        return self.nameValueDict.items()
+        return [(key, self.lookup(key)) for key in self.keys() if key != 'oid']
     
     def has_key(self, key):
-        return(self.nameValueDict.has_key(key))
+        return self.overlay.has_key(key) or self.nameValueDict.has_key(key)
+    
+    def lookup(self, key):
+        '''
+        Return the value of key, from the overlay if it is
+        there, else from the JSON dict. Entries of change_log
+        and history are returned as PiazzaPost instances.
+        
+        :param key: field name
+        :type key: String
+        :raise KeyError: if neither holds the key
+        '''
+        try:
+            return self.overlay[key]
+        except KeyError:
+            pass
+        jsonValue = self.nameValueDict[key]
+        if key == 'change_log' or key == 'history':
+            jsonValue = self.materializeEvents(key, jsonValue)
+        return jsonValue
+    
+    def materializeEvents(self, key, jsonEvents):
+        '''
+        Turn the JSON entries of the change_log or history
+        field into PiazzaPost instances, and keep them in
+        the overlay.
+        
+        :param key: 'change_log' or 'history'
+        :type key: String
+        :param jsonEvents: the field's JSON array
+        :type jsonEvents: [dict]
+        :return: the event objects
+        :rtype: [PiazzaPost]
+        '''
+        eventObjs = []
+        for eventNum, oneEventJson in enumerate(jsonEvents):
+            eventObjs.append(PiazzaPost(oneEventJson,
+                                        buildingChangeEventObj=(key == 'change_log'),
+                                        buildingHistoryEventObj=(key == 'history'),
+                                        oid=PiazzaImporter.childOid(self.oid, key, eventNum)))
+        self.overlay[key] = eventObjs
+        return eventObjs
     
     def getPiazzaIdFromChangeEvent(self, jsonDict):
         '''
@@ -1064,7 +1359,7 @@ class PiazzaPost(object):
             # a recursive descend into the history ojbs to find
             # the first subject. Eventually the history obj
             # is found, and will have a 'subject' property
-            if not self.nameValueDict.has_key('subject'):
+            if not self.has_key('subject'):
                 return PiazzaImporter.singletonPiazzaImporter.getSubject(self)
         
         # Allow 'body' instead of content for compatibility
@@ -1102,7 +1397,7 @@ class PiazzaPost(object):
             # We never fail when a property doesn't
             # exist; just return None. Client can
             # use has_key(), or keys() on a PiazzaPost object:
-            jsonValue = self.nameValueDict[key]
+            jsonValue = self.lookup(key)
         except KeyError:
             if key == 'children' or\
                 key == 'change_log':
@@ -1111,9 +1406,10 @@ class PiazzaPost(object):
                 return(None)
     
         if key == 'children':
+            # Children are found by their position under this post:
             jsonValueArr = []
-            for jsonValueEl in jsonValue:
-                jsonValueArr.append(PiazzaImporter.singletonPiazzaImporter[jsonValueEl]) 
+            for childNum, jsonValueEl in enumerate(jsonValue):
+                jsonValueArr.append(PiazzaPost(jsonValueEl, oid=PiazzaImporter.childOid(self.oid, 'children', childNum))) 
             return jsonValueArr
         else:
             return jsonValue
@@ -1123,15 +1419,22 @@ class PiazzaPost(object):
         if key == 'oid':
             self.oid = value
             return
-        self.nameValueDict[key] = value
+        self.overlay[key] = value
     
     def __delitem__(self, key):
         if key == 'anon_screen_name' or key == 'oid':
             raise ValueError('Cannot delete anon_screen_name or oid from PiazzaPost instances')
-        del self.nameValueDict[key]
+        if not self.has_key(key):
+            raise KeyError(key)
+        self.overlay.pop(key, None)
+        if self.nameValueDict.has_key(key):
+            # The JSON dict is shared; copy before changing it:
+            self.nameValueDict = dict(self.nameValueDict)
+            del self.nameValueDict[key]
     
     def keys(self):
         theKeys = self.nameValueDict.keys()
+        theKeys.extend([key for key in self.overlay.keys() if not self.nameValueDict.has_key(key)])
         theKeys.append('oid')
         return theKeys
     
@@ -1144,12 +1447,15 @@ class PiazzaPost(object):
         # same as __getitem__(). To get the JSON,
         # use getRaw().
         try:
-            return self.nameValueDict[key]
+            return self.lookup(key)
         except KeyError:
             return(default)
 
     def getRaw(self, key, default=None):
-        return self.nameValueDict.get(key, default)
+        try:
+            return self.overlay[key]
+        except KeyError:
+            return self.nameValueDict.get(key, default)
 
     def toTuple(self):
         '''
@@ -1187,7 +1493,7 @@ class PiazzaUserMetaclass(type):
     Metaclass that governs creation of PiazzaUser instances.
     Imposes a singleton pattern, with existing objects held
     in a class level dict called piazzaUserInstances. Keys
-    are anon_screen_name strings:
+    are the users' Piazza ids (field 'user_id'):
     '''
     
     def __init__(self, className, bases, namespace):
@@ -1227,8 +1533,10 @@ class PiazzaUserMetaclass(type):
             except KeyError:
                 raise NameError("User object with lti '%s' does not exist." % lti)
         
-        # No lti provided. Compute OID from the JSON dict;
-        oid = PiazzaImporter.makeHashFromJsonDict(jsonDict)
+        # No lti provided. The OID is the user's Piazza id:
+        oid = jsonDict.get('user_id')
+        if oid is None:
+            oid = PiazzaImporter.makeHashFromJsonDict(jsonDict)
 
         # Try to find this OID among the already
         # created instances: caller may make multiple
@@ -1289,15 +1597,9 @@ class PiazzaUser(object):
         # Make a new field: 'ext_id' (for 'external id):
         ltiArr = jsonDict.get('lti_ids', [])
         # Replace the lti_ids field of the user json
-        # entry with a non-array:
-        if len(ltiArr) > 0:
-            # Get Piazza's entry for Stanford's LTIs;
-            # they look like this: stanford.edu__47bf69315b7391dace7ccbc344690969
-            stanfordEduLTI = ltiArr[0]
-            ltiSpecComponents = stanfordEduLTI.split('_')
-            jsonDict['ext_id'] = ltiSpecComponents[-1]
-        else:
-            jsonDict['ext_id'] = None
+        # entry with a non-array. Prefer the LTI that OpenEdX
+        # issued; they look like this: stanford.edu__47bf69315b7391dace7ccbc344690969
+        jsonDict['ext_id'] = preferredLti(ltiArr)
         
         jsonDict['piazza_id'] = jsonDict['user_id']
         
@@ -1415,6 +1717,8 @@ class ForumComputer(object):
     
 if __name__ == '__main__':
     
+    EtlProfiler = forumEtlModule('etl_profiler').EtlProfiler
+
     # -------------- Manage Input Parameters ---------------
     
     #usage = 'Usage: pizza_to_relation.py mysql_db_name {<courseFile>.zip | <class_content>.json}\n'
@@ -1442,6 +1746,25 @@ if __name__ == '__main__':
                              '    must contain a file called account_mapping.csv'
                         )
     
+    parser.add_argument('--identityCache',
+                        action='store',
+                        help='SQLite file that keeps the user_int_ids of LTI ids across runs; shared with\n' +\
+                             '    the forum extractor. Only LTI ids it lacks are sent to MySQL. Default: none'
+                        )
+    
+    parser.add_argument('--profile',
+                        action='store',
+                        choices=EtlProfiler.MODES,
+                        help='profile the import: sample (low overhead) or cprofile (exact call counts).\n' +\
+                             '    Writes <profileOutput>.pstats and <profileOutput>.collapsed (for flamegraphs).'
+                        )
+
+    parser.add_argument('--profileOutput',
+                        action='store',
+                        default='piazza_etl_profile',
+                        help='Path prefix of the --profile output files. Default: ./piazza_etl_profile'
+                        )
+    
     parser.add_argument('dbname',
                         action='store',
                         help='Name of MySQL database into which forum data is to be placed.' 
@@ -1464,7 +1787,7 @@ if __name__ == '__main__':
     else:
         mySQLUser = args.mySQLUser
 
-    if args.password and args.pwd:
+    if args.password and args.mySQLPwd:
         raise ValueError('Use either -p, or -w, but not both.')
         
     if args.mySQLPwd:
@@ -1493,10 +1816,17 @@ if __name__ == '__main__':
 
     # -------------- Run the Loading ---------------
 
-    piazzaImporter = PiazzaImporter(args.dbname, 
-                                    mySQLUser,
-                                    mySQLPwd,
-                                    args.tablename, 
-                                    args.jsonFileName 
-                                    )
+    if args.profile is None:
+        profiler = noProfiling()
+    else:
+        profiler = EtlProfiler(args.profileOutput, mode=args.profile)
+    with profiler:
+        piazzaImporter = PiazzaImporter(mySQLUser,
+                                        mySQLPwd,
+                                        args.dbname, 
+                                        args.tablename, 
+                                        args.jsonFileName,
+                                        mappingFileName=args.mappingFile,
+                                        identityCacheFile=args.identityCache
+                                        )
     piazzaImporter.doImport()
\ No newline at end of file
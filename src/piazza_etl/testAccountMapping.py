@@ -0,0 +1,39 @@
+'''
+Tests for the account_mapping.csv loader.
+'''
+from StringIO import StringIO
+import unittest
+import zipfile
+
+from piazza_etl.account_mapping import AccountMapping, preferredLti
+
+
+class TestAccountMapping(unittest.TestCase):
+
+    def testPreferredLti(self):
+        self.assertEqual('47bf69315b7391dace7ccbc344690969',
+                         preferredLti(['stanford.edu__88115', ' stanford.edu__47bf69315b7391dace7ccbc344690969']))
+        self.assertEqual('88115', preferredLti(['stanford.edu__88115']))
+        self.assertEqual(None, preferredLti([]))
+        self.assertEqual(None, preferredLti(['']))
+
+    def testMappingFromZip(self):
+        zipObj = zipfile.ZipFile('data/test_AccountMappingInput.zip')
+        accountMapping = AccountMapping(zipObj.open('account_mapping.csv'))
+        self.assertEqual(3, len(accountMapping))
+        self.assertEqual('aff1b14edf5054292a31e584b4749f42', accountMapping.getLti('hr7xjaytsC8'))
+        self.assertEqual('47bf69315b7391dace7ccbc344690969', accountMapping.getLti('hc19qkoyc9C'))
+        self.assertEqual(None, accountMapping.getLti('afterallforpeace@gmail.com'))
+        self.assertEqual(None, accountMapping.getLti('unknown'))
+
+    def testIrregularRows(self):
+        mappingStr = 'UID,Email,LTI Ids\r\n' +\
+                     'a@b.com,user1,\r\n' +\
+                     '\r\n' +\
+                     'c@d.com,user2\r\n' +\
+                     'e@f.com, user3 ,"x.edu__1, x.edu__2"\r\n'
+        accountMapping = AccountMapping(StringIO(mappingStr))
+        self.assertEqual({'user3' : '1'}, accountMapping.ltisByPiazzaId)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+'''
+Tests for the streaming JSON array decoder.
+'''
+import json
+from StringIO import StringIO
+import unittest
+
+from piazza_etl.json_stream import iterJsonArray
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def testSameAsJsonLoad(self):
+        with open('data/test_PiazzaContent.json') as jsonFd:
+            expected = json.load(jsonFd)
+        # Small reads, so that elements, strings, and
+        # escapes straddle chunk boundaries:
+        for readSize in (1, 7, 64, 100000):
+            with open('data/test_PiazzaContent.json') as jsonFd:
+                self.assertEqual(expected, list(iterJsonArray(jsonFd, readSize)))
+
+    def testTrickyElements(self):
+        jsonStr = ' [ {"a" : "x]}\\"{[,"}, ["b", {"c" : []}], "s\\\\", 12 , -1.5e3,true,null,"\\u00e9" ] trailing'
+        for readSize in range(1, 20) + [1000]:
+            self.assertEqual([{'a' : 'x]}"{[,'}, ['b', {'c' : []}], 's\\', 12, -1500.0, True, None, u'\xe9'],
+                             list(iterJsonArray(StringIO(jsonStr), readSize)))
+        self.assertEqual([], list(iterJsonArray(StringIO('[]'))))
+
+    def testLineBreaksInStrings(self):
+        # Raw newlines are not legal in strict JSON strings,
+        # but occur in Piazza dumps; they are kept:
+        jsonStr = '[{"content" : "first line\n    second line"},\n{"content" : "tab\there"}]'
+        self.assertEqual([{'content' : 'first line\n    second line'}, {'content' : 'tab\there'}],
+                         list(iterJsonArray(StringIO(jsonStr), 5)))
+
+    def testBadInput(self):
+        self.assertRaises(ValueError, list, iterJsonArray(StringIO('{"a" : 1}')))
+        self.assertRaises(ValueError, list, iterJsonArray(StringIO('[{"a" : 1}, {"b" : ')))
+        self.assertRaises(ValueError, list, iterJsonArray(StringIO('[{"a" : 1}, {"b" 2}]')))
+        self.assertRaises(ValueError, list, iterJsonArray(StringIO('')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,12 +9,14 @@ TODO:
      kyleisliving@gmail.com,hqv1vcncSST,stanford.edu__70511e8ac611c4e730405e5998aef007
 '''
 import MySQLdb
+from StringIO import StringIO
 import json
 import unittest
 from unittest.case import skipIf
 import warnings
 
-from piazza_etl.piazza_to_relation import PiazzaImporter, PiazzaPost
+from piazza_etl.account_mapping import AccountMapping
+from piazza_etl.piazza_to_relation import PiazzaImporter, PiazzaPost, PiazzaUser
 
 
 DO_ALL = True
@@ -34,7 +36,7 @@ class Test(unittest.TestCase):
         # and assertions for them being otherwise fail.
         # So we turn MySQL warnings into errors, so we can
         # tell:
-        warnings.filterwarnings(action='error', message='zero rows fetched*', category=MySQLdb.Warning, mmodule)
+        warnings.filterwarnings(action='error', message='zero rows fetched*', category=MySQLdb.Warning)
 
     @skipIf (not DO_ALL, 'comment me if do_all == False, and want to run this test')
     def testPiazzaPostSingletonMechanism(self):
@@ -145,6 +147,30 @@ class Test(unittest.TestCase):
         self.assertEqual(210129, importer.idPiazza2UserIntId('hqyjmaplhAK'))
         self.assertEqual(211516, importer.idPiazza2UserIntId('hc19qkoyc9C'))
 
+    @skipIf (not DO_ALL, 'comment me if do_all == False, and want to run this test')
+    def testUserLtiFromAccountMapping(self):
+        PiazzaUser.piazzaUserInstances = {}
+        # The user's first LTI id is not the one OpenEdX issued:
+        userObj = PiazzaUser({'user_id' : 'hc19qkoyc9C', 'lti_ids' : ['stanford.edu__88115']})
+        self.assertEqual('88115', userObj['ext_id'])
+        accountMapping = AccountMapping(StringIO('UID,Email,LTI Ids\r\n' +\
+                                                 'jdoe@gmail.com,hc19qkoyc9C,"stanford.edu__88115, stanford.edu__47bf69315b7391dace7ccbc344690969"\r\n'))
+        self.assertEqual('47bf69315b7391dace7ccbc344690969', PiazzaImporter.getUserLti(userObj, accountMapping))
+        self.assertEqual('88115', PiazzaImporter.getUserLti(userObj, None))
+        # Without a mapping row, the OpenEdX id among the user's LTI ids is used:
+        otherUserObj = PiazzaUser({'user_id' : 'hr7xjaytsC8',
+                                   'lti_ids' : ['stanford.edu__88116', 'stanford.edu__aff1b14edf5054292a31e584b4749f42']})
+        self.assertEqual('aff1b14edf5054292a31e584b4749f42', PiazzaImporter.getUserLti(otherUserObj, accountMapping))
+        PiazzaUser.piazzaUserInstances = {}
+
+    @skipIf (not DO_ALL, 'comment me if do_all == False, and want to run this test')
+    def testLtiLookupQuery(self):
+        # One placeholder per LTI; no LTI is formatted into the query:
+        query = PiazzaImporter.ltiLookupQuery(3)
+        self.assertEqual(3, query.count('%s'))
+        self.assertEqual(2, query.count('UNION ALL'))
+        self.assertTrue(query.startswith('SELECT ext.lti, unittest.idAnon2Int(idExt2Anon(ext.lti)) FROM (SELECT %s AS lti'))
+
 
     #****@skipIf (not DO_ALL, 'comment me if do_all == False, and want to run this test')
     def testContentLoadingToMemory(self):
@@ -162,7 +188,7 @@ class Test(unittest.TestCase):
         firstPostObj = piazzaImporter[0]
         
         # Internal oid (not client facing):
-        self.assertEqual('ca3GPkUlKbCqqjlRSxirVg==', firstPostObj['oid'])
+        self.assertEqual('post0', firstPostObj['oid'])
         
         # Original Piazza uid of poster:
         self.assertEqual('hr7xjaytsC8', firstPostObj['piazza_id'])
@@ -177,7 +203,7 @@ class Test(unittest.TestCase):
         self.assertEqual('hc19qkoyc9C', firstPostObj['children'][0]['piazza_id'])
         
         secondObj = piazzaImporter[1]
-        self.assertEqual('scqTSRqUDEdBTN3B0XOODg==', secondObj['oid'])
+        self.assertEqual('post1', secondObj['oid'])
         # The first child of the second object should reference
         # the first object:
         self.assertEqual(firstPostObj['piazza_id'], secondObj['children'][0]['piazza_id'])
@@ -204,7 +230,7 @@ class Test(unittest.TestCase):
         children = firstPostObj['children']
         self.assertEqual(1, len(children))
         child = children[0]
-        self.assertEqual('wABgOWyIDVYn-8kzkgMnNw==', child['oid'])
+        self.assertEqual('post0.children0', child['oid'])
 
         childHistArr = child['history']
         self.assertEqual(1, len(childHistArr))
@@ -0,0 +1,110 @@
+'''
+Times the traversal of a post's children on threads whose
+children hold bodies of growing size, and reports the cost
+per child. Children are found by their oid, which is their
+position in the thread, so the per-child figure stays flat
+as the bodies grow. With --legacy, the original way of finding
+a child, an md5 hash of the child's str(), is timed on the same
+children for comparison; its per-child figure grows with the
+body size.
+
+Usage: traversal_benchmark.py [-h] [--legacy] [--children CHILDREN] [--maxKB MAXKB]
+'''
+
+import argparse
+import base64
+import hashlib
+import os
+import sys
+import time
+
+from piazza_to_relation import PiazzaImporter, PiazzaPost
+
+
+def legacyOid(jsonDict):
+    '''
+    The oid that PiazzaImporter.findOrCreatePostObj() originally
+    computed for every child it was asked for.
+    '''
+    return base64.urlsafe_b64encode(hashlib.md5(str(jsonDict)).digest())
+
+def makeThread(numChildren, bodySize):
+    '''
+    Return the JSON dict of a top level post with numChildren
+    follow-ups, each with a body of bodySize bytes.
+    '''
+    children = []
+    for childNum in range(numChildren):
+        children.append({'id' : 'user%d' % childNum,
+                         'type' : 'followup',
+                         'created' : '2014-01-26T18:13:50Z',
+                         'history' : [{'content' : 'x' * bodySize,
+                                       'uid' : 'user%d' % childNum,
+                                       'created' : '2014-01-26T18:13:50Z'}],
+                         'children' : []})
+    return {'id' : 'user0',
+            'type' : 'question',
+            'created' : '2014-01-26T18:13:50Z',
+            'history' : [{'content' : 'Question', 'subject' : 'Subject', 'uid' : 'user0'}],
+            'children' : children}
+
+def bestTime(func, repeats):
+    bestSecs = None
+    for _ in range(repeats):
+        startTime = time.time()
+        func()
+        elapsed = time.time() - startTime
+        if bestSecs is None or elapsed < bestSecs:
+            bestSecs = elapsed
+    return bestSecs
+
+def runBenchmark(numChildren=100, maxKB=256, legacy=False, repeats=5, outFd=sys.stdout):
+    '''
+    Time the traversal of the children of one thread, doubling
+    the size of the children's bodies from 1KB to maxKB.
+
+    :param numChildren: number of children in the thread
+    :type numChildren: int
+    :param maxKB: largest body size in KB
+    :type maxKB: int
+    :param legacy: if True, also time the original child lookup
+    :type legacy: Boolean
+    :param repeats: number of runs, of which the fastest is reported
+    :type repeats: int
+    :param outFd: where to write the report
+    :type outFd: file
+    '''
+    importer = PiazzaImporter('', '', '', '', None, unittesting=True, logFile=os.devnull)
+    sizeKB = 1
+    while sizeKB <= maxKB:
+        thread = makeThread(numChildren, sizeKB * 1024)
+        importer.jData = [thread]
+        importer.indexPosts()
+        PiazzaPost.piazzaPostInstances = {}
+        post = importer[0]
+        # Materialize the children, so that only finding them is timed:
+        post['children']
+        traversalSecs = bestTime(lambda: post['children'], repeats)
+        report = '%6dKB  children: %8.2f us/child' % (sizeKB, 1000000.0 * traversalSecs / numChildren)
+        if legacy:
+            legacySecs = bestTime(lambda: [legacyOid(childDict) for childDict in thread['children']], repeats)
+            report += '  legacy: %8.2f us/child' % (1000000.0 * legacySecs / numChildren)
+        outFd.write(report + '\n')
+        sizeKB *= 2
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument('--legacy',
+                        help='also time the original, hash based child lookup',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--children',
+                        help='number of children in the thread; default: 100',
+                        type=int,
+                        default=100)
+    parser.add_argument('--maxKB',
+                        help="largest body of a child in KB; default: 256",
+                        type=int,
+                        default=256)
+    args = parser.parse_args()
+    runBenchmark(args.children, args.maxKB, args.legacy)